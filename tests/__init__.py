@@ -8,4 +8,40 @@ def run_tests():
     from . import testmisc
     test_suite.addTest(testmisc.suite())
 
+    from . import testnetlink
+    test_suite.addTest(testnetlink.suite())
+
+    from . import testdaemon
+    test_suite.addTest(testdaemon.suite())
+
+    from . import testscanresults
+    test_suite.addTest(testscanresults.suite())
+
+    from . import testwpasupplicant
+    test_suite.addTest(testwpasupplicant.suite())
+
+    from . import testcache
+    test_suite.addTest(testcache.suite())
+
+    from . import testioctl
+    test_suite.addTest(testioctl.suite())
+
+    from . import testroutes
+    test_suite.addTest(testroutes.suite())
+
+    from . import testcommands
+    test_suite.addTest(testcommands.suite())
+
+    from . import testtoolcache
+    test_suite.addTest(testtoolcache.suite())
+
+    from . import testpsk
+    test_suite.addTest(testpsk.suite())
+
+    from . import testtemplates
+    test_suite.addTest(testtemplates.suite())
+
+    from . import testnetworking
+    test_suite.addTest(testnetworking.suite())
+
     unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,352 @@
+"""Micro benchmarks for wicd.
+
+Run with:
+
+    python -m tests.benchmarks [name ...]
+
+Every benchmark prints its own results; without arguments all of them are
+run.
+
+"""
+import fcntl
+import gc
+import glob
+import os
+import socket
+import struct
+import sys
+import time
+import timeit
+
+from wicd import cache
+from wicd import wnettools
+from wicd.scanresults import ScanResults
+from tests.testwnettools import _parse_cells
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _iwlist_corpus(min_cells=150):
+    """Return the recorded iwlist outputs glued into one large scan.
+
+    The recorded cells are repeated until there are at least min_cells of
+    them, which is what a scan on a crowded floor looks like.
+
+    """
+    cells = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, 'iwlist', '*.txt'))):
+        with open(path) as f:
+            cells.extend(f.read().split('   Cell ')[1:])
+    scan = []
+    while len(scan) < min_cells:
+        scan.extend(cells)
+    header = 'wlan0     Scan completed :\n'
+    return header + ''.join('          Cell ' + cell.lstrip(' ')
+                            for cell in scan), len(scan)
+
+
+def bench_iwlist_parser(repeat=5, number=20):
+    """Compare the per-cell regex parser with the single-pass one."""
+    results, cells = _iwlist_corpus()
+    interface = wnettools.BaseWirelessInterface('wlan0')
+
+    def per_cell():
+        _parse_cells(interface, results)
+
+    def single_pass():
+        interface._ParseScanResults(results, None)
+
+    # Both parsers print about hidden networks and odd frequencies.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        old = min(timeit.repeat(per_cell, repeat=repeat, number=number))
+        new = min(timeit.repeat(single_pass, repeat=repeat, number=number))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print('iwlist parser, %d cells per scan:' % cells)
+    for name, elapsed in (('per-cell regex', old), ('single pass', new)):
+        print('  %-16s %8.2f ms/scan  %8.0f cells/s' %
+              (name, elapsed / number * 1000, cells * number / elapsed))
+    print('  speedup          %8.2fx' % (old / new))
+
+
+# Options ReadWirelessNetworkProfile merges in from a typical profile.
+PROFILE_OPTIONS = {
+    'automatic': True, 'never': False, 'use_static_dns': False,
+    'use_global_dns': False, 'use_settings_globally': False,
+    'enctype': 'wpa-psk', 'key': 'correct horse battery staple',
+    'ip': None, 'netmask': None, 'gateway': None, 'dns1': None,
+    'dns2': None, 'dns3': None, 'dns_domain': None, 'search_domain': None,
+    'beforescript': None, 'afterscript': None, 'predisconnectscript': None,
+    'postdisconnectscript': None, 'dhcphostname': 'laptop',
+    'usedhcphostname': False, 'key_index': None, 'bitrate': 'auto',
+    'allow_lower_bitrates': False, 'psk': '0' * 64,
+}
+
+
+def _rss():
+    """Return the resident set size of this process, in bytes."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _fresh(value):
+    """Return an equal but distinct copy of a string, as parsing does."""
+    if isinstance(value, str):
+        return (value + '.')[:-1]
+    return value
+
+
+def _build_scan(count, store):
+    """Build count merged scan results, as plain dicts or in store."""
+    scan = []
+    for i in range(count):
+        ap = {'bssid': _fresh('00:11:22:%02X:%02X:%02X' %
+                              (i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff)),
+              'essid': _fresh('network-%d' % i), 'hidden': False,
+              'channel': _fresh('11'), 'mode': _fresh('Master'),
+              'encryption': True, 'encryption_method': _fresh('WPA2'),
+              'quality': i % 100, 'strength': _fresh('-%d' % (i % 60 + 30)),
+              'bitrates': [_fresh(rate) for rate in
+                           ('1', '2', '5.5', '11', '6', '9', '12', '18',
+                            '24', '36', '48', '54')]}
+        scan.append(ap)
+    if store is not None:
+        scan = store(scan)
+    for ap in scan:
+        for key, value in PROFILE_OPTIONS.items():
+            ap[_fresh(key)] = _fresh(value)
+    return scan
+
+
+def _measure_in_child(func, *args):
+    """Run func in a forked child and return the RSS it added."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        gc.collect()
+        before = _rss()
+        # Keep the result alive until the RSS has been read.
+        result = func(*args)  # noqa: F841
+        gc.collect()
+        os.write(write_fd, struct.pack('q', _rss() - before))
+        os._exit(0)
+    os.close(write_fd)
+    data = os.read(read_fd, 8)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return struct.unpack('q', data)[0]
+
+
+def bench_scan_memory():
+    """Compare the RSS of scan results kept as dicts and as records."""
+    print('scan results memory (RSS added, profile merged in):')
+    for count in (1000, 10000):
+        dicts = _measure_in_child(_build_scan, count, None)
+        records = _measure_in_child(_build_scan, count, ScanResults)
+        print('  %6d APs  dicts %8.1f KiB  records %8.1f KiB  (%.0f%%)' %
+              (count, dicts / 1024, records / 1024,
+               100 * records / dicts if dicts else 0))
+
+
+def bench_ioctl_queries(number=200):
+    """Compare interface queries through ioctls and external programs.
+
+    The address of the loopback interface is queried through the
+    persistent socket of the ioctl backend, through a socket opened for
+    every call (as the old helper did), through an rtnetlink dump of
+    all addresses (uncached and served from the address table) and
+    through ifconfig, as the external backend did.
+
+    """
+    # Importing the backend warns about missing optional modules.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        from wicd.backends import be_ioctl
+        external = wnettools.BaseInterface('lo')
+        external.Check()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    persistent = be_ioctl.IoctlSocket('lo')
+
+    def per_call_socket():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            fcntl.ioctl(sock.fileno(), be_ioctl.SIOCGIFADDR,
+                        struct.pack('256s', b'lo'))
+        finally:
+            sock.close()
+
+    def dump():
+        wnettools.InvalidateAddresses()
+        wnettools.GetAddresses('lo')
+
+    def fork():
+        # Don't let timedcache hide the cost of running ifconfig.
+        cache.CACHE.clear()
+        external.GetIP(external.GetIfconfig())
+
+    print('interface address queries:')
+    for name, func, count in (
+            ('persistent ioctl', persistent.get_addr, number * 100),
+            ('per-call socket', per_call_socket, number * 100),
+            ('netlink dump', dump, number * 10),
+            ('address table', external.GetIP, number * 100),
+            ('external program', fork, number)):
+        elapsed = min(timeit.repeat(func, repeat=3, number=count))
+        print('  %-16s %10.2f us/query' % (name, elapsed / count * 1e6))
+    persistent.close()
+
+
+def bench_main_loop_latency(number=20, tick_ms=5):
+    """Measure how late main loop timers fire while commands run.
+
+    A timer ticks every tick_ms milliseconds while number commands
+    (each taking 50 ms, about what iwconfig or iwlist rate take) are
+    run one after the other, first synchronously from a main loop
+    handler as the D-Bus methods did, then with misc.RunAsync.  The
+    lateness of the ticks is what every other D-Bus client waits.
+
+    Needs the real GLib bindings.
+
+    """
+    from gi.repository import GLib as gobject
+    from wicd import misc
+    if not hasattr(gobject, 'MainContext'):
+        print('main loop latency: needs the GLib bindings')
+        return
+    cmd = ['sh', '-c', 'sleep 0.05']
+
+    def measure(run_next):
+        loop = gobject.MainLoop()
+        lateness = []
+        state = {'last': timeit.default_timer(), 'left': number}
+
+        def tick():
+            now = timeit.default_timer()
+            lateness.append(max(0, now - state['last'] - tick_ms / 1000.0))
+            state['last'] = now
+            return True
+
+        def done(output=None):
+            state['left'] -= 1
+            if state['left']:
+                gobject.idle_add(run_next, done)
+            else:
+                loop.quit()
+            return False
+
+        source = gobject.timeout_add(tick_ms, tick)
+        gobject.idle_add(run_next, done)
+        loop.run()
+        gobject.source_remove(source)
+        lateness.sort()
+        return (lateness[int(len(lateness) * 0.99) - 1] * 1000,
+                lateness[-1] * 1000)
+
+    def sync(done):
+        misc.Run(cmd)
+        return done()
+
+    def async_(done):
+        misc.RunAsync(cmd, done)
+        return False
+
+    print('main loop timer lateness while running %d commands:' % number)
+    for name, run_next in (('synchronous', sync), ('asynchronous', async_)):
+        p99, worst = measure(run_next)
+        print('  %-12s  p99 %8.2f ms  max %8.2f ms' % (name, p99, worst))
+
+
+# Seconds the simulated interface takes for each call, about what the
+# tools take on a laptop (dhclient -r waits for the DHCP server).
+INTERFACE_LATENCIES = {
+    'Down': 0.02, 'ReleaseDHCP': 0.25, 'StopWPA': 0.1, 'FlushDNS': 0.05,
+    'CommitBatch': 0.02, 'Up': 0.02, 'StartDHCP': 0.5,
+}
+
+
+class _SimulatedInterface(object):
+    """An interface whose every call just takes a while."""
+    def __getattr__(self, name):
+        def call(*args):
+            time.sleep(INTERFACE_LATENCIES.get(name, 0))
+            return True
+        return call
+
+
+def _sequential_tear_down(thread, iface):
+    """Tear the interface down one step after the other, the old way."""
+    thread.put_iface_down(iface)
+    thread.release_dhcp_clients(iface)
+    iface.StartBatch()
+    try:
+        thread.reset_ip_addresses(iface)
+        thread.stop_wpa(iface)
+        thread.flush_routes(iface)
+    finally:
+        thread.commit_batch(iface)
+    thread.flush_dns_addresses(iface)
+
+
+def bench_time_to_ip(repeat=3):
+    """Compare the time to IP with a sequential and a staged teardown.
+
+    A wired connection (no scripts, DHCP) is run against an interface
+    simulated with INTERFACE_LATENCIES.  The two second poll waiting
+    for the interface to come up is left out, it is the same for both.
+
+    """
+    from wicd import networking
+    iface = _SimulatedInterface()
+
+    def connect(tear_down):
+        thread = networking.WiredConnectThread(
+            {'profilename': 'bench'}, 'eth0', None, None, None, None, None,
+            None, None, None, None, iface, False)
+        thread.put_iface_up = lambda iface: iface.Up()
+        if tear_down:
+            thread.tear_down = lambda iface: tear_down(thread, iface)
+        start = timeit.default_timer()
+        thread._connect()
+        return timeit.default_timer() - start
+
+    # The connection steps print what they do.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        old = min(connect(_sequential_tear_down) for i in range(repeat))
+        new = min(connect(None) for i in range(repeat))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print('time to IP, simulated wired interface:')
+    for name, elapsed in (('sequential', old), ('staged', new)):
+        print('  %-12s %8.1f ms' % (name, elapsed * 1000))
+    print('  saved        %8.1f ms' % ((old - new) * 1000))
+
+
+BENCHMARKS = {
+    'ioctl_queries': bench_ioctl_queries,
+    'main_loop_latency': bench_main_loop_latency,
+    'iwlist_parser': bench_iwlist_parser,
+    'scan_memory': bench_scan_memory,
+    'time_to_ip': bench_time_to_ip,
+}
+
+
+def run_benchmarks(names=None):
+    for name in names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    run_benchmarks(sys.argv[1:])
@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+from wicd import cache
+from wicd import wnettools
+
+
+class TestTimedCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = cache.TimedCache(maxsize=2, clock=lambda: self.now)
+
+    def test_expiry(self):
+        self.cache.set('wlan0', 'GetIwconfig', (), 'output')
+        self.assertEqual(self.cache.get('wlan0', 'GetIwconfig', (), 2),
+                         'output')
+        self.assertIs(self.cache.get('eth0', 'GetIwconfig', (), 2),
+                      cache.MISSING)
+        self.now = 2
+        self.assertIs(self.cache.get('wlan0', 'GetIwconfig', (), 2),
+                      cache.MISSING)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expired']),
+                         (1, 2, 1))
+        self.assertEqual(stats['GetIwconfig.hits'], 1)
+
+    def test_lru_eviction(self):
+        self.cache.set('wlan0', 'a', (), 1)
+        self.cache.set('wlan0', 'b', (), 2)
+        self.cache.get('wlan0', 'a', (), 5)
+        self.cache.set('wlan0', 'c', (), 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIs(self.cache.get('wlan0', 'b', (), 5), cache.MISSING)
+        self.assertEqual(self.cache.get('wlan0', 'a', (), 5), 1)
+        self.assertEqual(self.cache.stats()['b.evictions'], 1)
+
+    def test_invalidate_namespace(self):
+        self.cache.set('wlan0', 'a', (), 1)
+        self.cache.set('eth0', 'a', (), 2)
+        self.cache.invalidate('wlan0')
+        self.assertIs(self.cache.get('wlan0', 'a', (), 5), cache.MISSING)
+        self.assertEqual(self.cache.get('eth0', 'a', (), 5), 2)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+
+class TestCachedInterface(unittest.TestCase):
+    def setUp(self):
+        cache.CACHE.clear()
+
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.misc.Run')
+    def test_state_changes_invalidate(self, mock_run, mock_exists):
+        mock_run.return_value = 'wlan0  ESSID:"one"'
+        interface = wnettools.BaseWirelessInterface('wlan0')
+        interface.GetIwconfig()
+        interface.GetIwconfig()
+        self.assertEqual(mock_run.call_count, 1)
+        interface.Associate('two')
+        mock_run.reset_mock()
+        interface.GetIwconfig()
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(interface.GetIwconfig.__name__, 'GetIwconfig')
+        self.assertEqual(cache.CACHE.stats()['GetIwconfig.invalidations'], 1)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    for case in (TestTimedCache, TestCachedInterface):
+        suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(case))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import signal
+import threading
+import time
+import unittest
+from unittest import mock
+from wicd import commands
+
+
+class TestCommandExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = commands.CommandExecutor(kill_grace=0.5)
+
+    def test_run(self):
+        self.assertEqual(self.executor.run('echo hi  there'), 'hi there\n')
+        self.assertEqual(self.executor.run(['sh', '-c', 'echo $LC_ALL']),
+                         'C\n')
+        self.assertEqual(self.executor.run(['cat'], input='abc'), 'abc')
+        self.assertEqual(self.executor.run(['sh', '-c', 'echo oops >&2'],
+                                           include_stderr=True), 'oops\n')
+
+    def test_missing_program(self):
+        self.assertEqual(self.executor.run('wicd-no-such-program'), '')
+        stats = self.executor.stats()
+        self.assertEqual(stats['wicd-no-such-program.calls'], 1)
+        self.assertEqual(stats['wicd-no-such-program.failures'], 1)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        output = self.executor.run(['sh', '-c', 'echo started; sleep 10'],
+                                   timeout=0.2)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(output, '')
+        self.assertEqual(self.executor.stats()['sh.timeouts'], 1)
+
+    def test_kill_escalation(self):
+        # The shell ignores SIGTERM, so it has to be killed.
+        start = time.monotonic()
+        self.executor.run(['sh', '-c', 'trap "" TERM; sleep 10'],
+                          timeout=0.2)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_spawn(self):
+        process = self.executor.spawn(['cat'], stdin=True)
+        self.assertEqual(process.communicate('abc')[0], 'abc')
+        self.assertIsNone(self.executor.spawn(['wicd-no-such-program']))
+        stats = self.executor.stats()
+        self.assertEqual(stats['cat.calls'], 1)
+        self.assertEqual(stats['cat.time'], 0)
+
+    def test_coalescing(self):
+        cmd = ['sh', '-c', 'sleep 0.3; echo $$']
+        outputs = []
+
+        def query():
+            outputs.append(self.executor.run(cmd, coalesce=True))
+
+        threads = [threading.Thread(target=query) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # One shell ran, all got its output.
+        self.assertEqual(len(set(outputs)), 1)
+        stats = self.executor.stats()
+        self.assertEqual(stats['sh.calls'], 1)
+        self.assertEqual(stats['sh.coalesced'], 2)
+        self.assertEqual(stats['coalesced'], 2)
+        # Sequential runs aren't shared.
+        self.assertNotEqual(self.executor.run(cmd, coalesce=True),
+                            outputs[0])
+
+    def test_no_coalescing_by_default(self):
+        # Commands changing state always run.
+        cmd = ['sh', '-c', 'sleep 0.2; echo $$']
+        threads = [threading.Thread(target=self.executor.run, args=(cmd,))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.executor.stats()['sh.calls'], 2)
+        self.assertEqual(self.executor.stats()['coalesced'], 0)
+
+    @mock.patch('wicd.commands.gobject')
+    def test_run_async(self, mock_gobject):
+        outputs = []
+        self.executor.run_async(['sh', '-c', 'echo hi; echo oops >&2'],
+                                outputs.append, include_stderr=True)
+        fd, _, on_output = mock_gobject.io_add_watch.call_args[0]
+        _, pid, on_exit = mock_gobject.child_watch_add.call_args[0]
+        # Nothing blocked, what follows is up to the main loop.
+        self.assertEqual(outputs, [])
+        _, status = os.waitpid(pid, 0)
+        self.assertFalse(on_output(fd, mock_gobject.IO_IN))
+        on_exit(pid, status)
+        self.assertEqual(outputs, ['hi\noops\n'])
+        mock_gobject.source_remove.assert_called_once_with(
+            mock_gobject.timeout_add.return_value)
+
+    @mock.patch('wicd.commands.gobject')
+    def test_run_async_timeout(self, mock_gobject):
+        outputs = []
+        self.executor.run_async(['sleep', '10'], outputs.append, timeout=1)
+        _, on_timeout, timeout = mock_gobject.timeout_add.call_args[0]
+        _, pid, on_exit = mock_gobject.child_watch_add.call_args[0]
+        self.assertFalse(on_timeout(timeout))
+        _, on_kill = mock_gobject.timeout_add.call_args[0]
+        self.assertFalse(on_kill())
+        _, status = os.waitpid(pid, 0)
+        on_exit(pid, status)
+        self.assertEqual(outputs, [''])
+        self.assertEqual(self.executor.stats()['sleep.timeouts'], 1)
+        # Failing to start is reported from the main loop too.
+        self.executor.run_async(['wicd-no-such-program'], outputs.append)
+        self.assertFalse(mock_gobject.idle_add.call_args[0][0](
+            *mock_gobject.idle_add.call_args[0][1:]))
+        self.assertEqual(outputs, ['', ''])
+
+    def test_exit_code(self):
+        exited = os.spawnlp(os.P_NOWAIT, 'sh', 'sh', '-c', 'exit 3')
+        killed = os.spawnlp(os.P_NOWAIT, 'sleep', 'sleep', '10')
+        os.kill(killed, signal.SIGKILL)
+        self.assertEqual(commands._exit_code(os.waitpid(exited, 0)[1]), 3)
+        self.assertEqual(commands._exit_code(os.waitpid(killed, 0)[1]),
+                         -signal.SIGKILL)
+
+    def test_timeouts_per_program(self):
+        executor = commands.CommandExecutor(timeouts={'iwlist': 60},
+                                            default_timeout=5)
+        self.assertEqual(executor.timeout_for(['/sbin/iwlist', 'scan']), 60)
+        self.assertEqual(executor.timeout_for(['ifconfig']), 5)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [tests.append(test) for test in dir(TestCommandExecutor)
+     if test.startswith('test')]
+    for test in tests:
+        suite.addTest(TestCommandExecutor(test))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+import os
+import unittest
+from unittest import mock
+from wicd import misc
+from wicd import netlink
+from wicd import templates
+from wicd import wicd_daemon
+
+ENCRYPTION_DIR = os.path.join(os.path.dirname(__file__), '..', 'data',
+                              'encryption')
+
+
+def network(bssid, essid, quality=50):
+    return {'bssid': bssid, 'essid': essid, 'hidden': False, 'channel': 6,
+            'mode': 'Master', 'encryption': False, 'quality': quality,
+            'strength': '-70', 'bitrates': None}
+
+
+class TestWirelessDaemon(unittest.TestCase):
+    def setUp(self):
+        self.daemon = wicd_daemon.WirelessDaemon.__new__(
+            wicd_daemon.WirelessDaemon)
+        self.daemon.LastScan = []
+        self.daemon._raw_scan = {}
+        self.daemon._debug_mode = False
+        self.daemon.config = mock.Mock()
+        self.daemon.config.get.return_value = None
+        self.daemon.config.has_section.return_value = False
+
+    def test_first_scan_adds_everything(self):
+        added, changed, removed = self.daemon._merge_scan(
+            [network('00:00:00:00:00:01', 'one'),
+             network('00:00:00:00:00:02', 'two')])
+        self.assertEqual([props['essid'] for props in added], ['one', 'two'])
+        self.assertEqual((changed, removed), ([], []))
+        self.assertEqual(self.daemon.config.has_section.call_count, 2)
+
+    def test_scan_delta(self):
+        self.daemon._merge_scan([network('00:00:00:00:00:01', 'one'),
+                                 network('00:00:00:00:00:02', 'two'),
+                                 network('00:00:00:00:00:03', 'three')])
+        first = self.daemon.LastScan[0]
+        first['key'] = 'secret'
+        self.daemon.config.reset_mock()
+        added, changed, removed = self.daemon._merge_scan(
+            [network('00:00:00:00:00:02', 'two'),
+             network('00:00:00:00:00:01', 'one', quality=70),
+             network('00:00:00:00:00:04', 'four')])
+        self.assertEqual([props['bssid'] for props in added],
+                         ['00:00:00:00:00:04'])
+        self.assertEqual(changed, [{'bssid': '00:00:00:00:00:01',
+                                    'quality': 70}])
+        self.assertEqual(removed, ['00:00:00:00:00:03'])
+        # Unchanged networks keep their merged profile, only the new one
+        # gets read.
+        self.assertIs(self.daemon.LastScan[1], first)
+        self.assertEqual(first['quality'], 70)
+        self.assertEqual(self.daemon.config.has_section.call_count, 1)
+
+    def test_seen_again_is_not_a_change(self):
+        self.daemon._merge_scan([dict(network('00:00:00:00:00:01', 'one'),
+                                      last_seen=1.0)])
+        added, changed, removed = self.daemon._merge_scan(
+            [dict(network('00:00:00:00:00:01', 'one'), last_seen=2.0)])
+        self.assertEqual((added, changed, removed), ([], [], []))
+        self.assertEqual(self.daemon.LastScan[0]['last_seen'], 2.0)
+
+    def test_profile_frequencies(self):
+        profiles = {'00:00:00:00:00:01': {'automatic': True, 'channel': 6},
+                    '00:00:00:00:00:02': {'automatic': True, 'channel': 36,
+                                          'never': True},
+                    '00:00:00:00:00:03': {'automatic': False, 'channel': 11},
+                    '00:00:00:00:00:04': {'automatic': True, 'channel': 1},
+                    'essid:one': {'automatic': True, 'channel': 13}}
+        self.daemon.config.sections.return_value = list(profiles)
+        self.daemon.config.get.side_effect = \
+            lambda section, option: profiles[section].get(option)
+        self.assertEqual(self.daemon._profile_frequencies(), [2412, 2437])
+
+    @mock.patch('wicd.wicd_daemon.gobject')
+    def test_autoconnect_scans_profile_channels_first(self, mock_gobject):
+        daemon = self.daemon
+        daemon._scanning = False
+        daemon.hidden_essid = None
+        daemon.wifi = mock.Mock(wireless_interface='wlan0')
+        # The profile read while merging the scan makes it automatic.
+        daemon.wifi.Scan.return_value = [
+            dict(network('00:00:00:00:00:01', 'one'), automatic=True)]
+        for name in ('SendStartScanSignal', 'SendEndScanSignal', 'ScanDelta',
+                     'ConnectWireless', 'ReadWirelessNetworkProfile',
+                     '_profile_frequencies'):
+            setattr(daemon, name, mock.Mock())
+        daemon._profile_frequencies.return_value = [2437]
+        daemon.config.has_section.return_value = True
+
+        daemon._wireless_autoconnect()
+        daemon.wifi.Scan.assert_called_once_with('None', [2437])
+        # The connection is started from the main loop.
+        self.assertFalse(daemon.ConnectWireless.called)
+        self.assertFalse(mock_gobject.idle_add.call_args[0][0]())
+        daemon.ConnectWireless.assert_called_once_with(0)
+
+        # Nothing to connect to on those channels, scan them all.
+        daemon.wifi.Scan.reset_mock()
+        daemon.config.has_section.return_value = False
+        daemon._wireless_autoconnect()
+        self.assertEqual(daemon.wifi.Scan.call_args_list,
+                         [mock.call('None', [2437]), mock.call('None', None)])
+
+    def test_autoconnect_without_limited_scan(self):
+        daemon = self.daemon
+        daemon._scanning = False
+        daemon.hidden_essid = None
+        daemon.wifi = mock.Mock(wireless_interface='wlan0',
+                                limited_scan=False)
+        daemon.wifi.Scan.return_value = [network('00:00:00:00:00:01', 'one')]
+        for name in ('SendStartScanSignal', 'SendEndScanSignal', 'ScanDelta',
+                     '_profile_frequencies'):
+            setattr(daemon, name, mock.Mock())
+        daemon._profile_frequencies.return_value = [2437]
+
+        # All the channels were scanned already, don't do it again.
+        daemon._wireless_autoconnect()
+        daemon.wifi.Scan.assert_called_once_with('None', [2437])
+
+    @mock.patch('wicd.wicd_daemon.gobject')
+    def test_autoconnect_ignores_cached_networks(self, mock_gobject):
+        daemon = self.daemon
+        daemon._scanning = False
+        daemon.hidden_essid = None
+        daemon.wifi = mock.Mock(wireless_interface='wlan0')
+        # Only the scan cache still has the saved network.
+        daemon.wifi.Scan.return_value = [
+            dict(network('00:00:00:00:00:01', 'one'), automatic=True,
+                 last_seen=1.0)]
+        for name in ('SendStartScanSignal', 'SendEndScanSignal', 'ScanDelta',
+                     'ReadWirelessNetworkProfile', '_profile_frequencies'):
+            setattr(daemon, name, mock.Mock())
+        daemon._profile_frequencies.return_value = [2437]
+        daemon.config.has_section.return_value = True
+
+        daemon._wireless_autoconnect()
+        self.assertEqual(daemon.wifi.Scan.call_args_list,
+                         [mock.call('None', [2437]), mock.call('None', None)])
+
+    def test_scan_properties(self):
+        props = wicd_daemon._scan_properties(
+            dict(network('00:00:00:00:00:01', 'one'), key='secret'))
+        self.assertNotIn('key', props)
+        self.assertEqual(props['bitrates'], '')
+
+
+class TestLinkEvents(unittest.TestCase):
+    def setUp(self):
+        self.daemon = wicd_daemon.WicdDaemon.__new__(wicd_daemon.WicdDaemon)
+        self.daemon._debug_mode = False
+        self.daemon._link_update_pending = False
+        self.daemon._link_events = mock.Mock()
+        self.daemon.wired = mock.Mock(wired_interface='eth0')
+        self.daemon.wifi = mock.Mock(wireless_interface='wlan0')
+        self.daemon.UpdateState = mock.Mock()
+
+    @mock.patch('wicd.wicd_daemon.cache.CACHE')
+    @mock.patch('wicd.wicd_daemon.gobject')
+    def test_events_are_coalesced(self, mock_gobject, mock_cache):
+        self.daemon._link_events.read_events.return_value = [
+            {'type': netlink.RTM_NEWADDR, 'ifname': 'wlan0'},
+            {'type': netlink.RTM_NEWADDR, 'ifname': 'docker0'}]
+        self.assertTrue(self.daemon._on_link_event(3, 1))
+        self.assertTrue(self.daemon._on_link_event(3, 1))
+        mock_cache.invalidate.assert_called_with('wlan0')
+        self.assertEqual(mock_gobject.timeout_add.call_count, 1)
+        self.assertFalse(self.daemon._send_link_update())
+        self.daemon.UpdateState.assert_called_once_with()
+
+    @mock.patch('wicd.wicd_daemon.wnettools.InvalidateInterfaceInventory')
+    @mock.patch('wicd.wicd_daemon.gobject')
+    def test_other_interfaces_are_ignored(self, mock_gobject,
+                                          mock_invalidate):
+        self.daemon._link_events.read_events.return_value = [
+            {'type': netlink.RTM_NEWADDR, 'ifname': 'docker0'}]
+        self.daemon._on_link_event(3, 1)
+        self.assertFalse(mock_gobject.timeout_add.called)
+        self.assertFalse(mock_invalidate.called)
+        # But a new interface changes the inventory.
+        self.daemon._link_events.read_events.return_value = [
+            {'type': netlink.RTM_NEWLINK, 'ifname': 'veth1'}]
+        self.daemon._on_link_event(3, 1)
+        self.assertFalse(mock_gobject.timeout_add.called)
+        mock_invalidate.assert_called_once_with()
+
+
+class TestAsyncMethods(unittest.TestCase):
+    @mock.patch('wicd.wicd_daemon.gobject')
+    def test_replies_without_blocking(self, mock_gobject):
+        daemon = wicd_daemon.WicdDaemon.__new__(wicd_daemon.WicdDaemon)
+        daemon._autoconnect = mock.Mock()
+        daemon._threaded_autoconnect = mock.Mock()
+        reply = mock.Mock()
+        daemon.AutoConnect(True, reply_handler=reply, error_handler=None)
+        reply.assert_called_once_with()
+        # Scanning and all happen in another thread.
+        daemon._threaded_autoconnect.assert_called_once_with(True)
+        self.assertFalse(daemon._autoconnect.called)
+
+        wireless = wicd_daemon.WirelessDaemon.__new__(
+            wicd_daemon.WirelessDaemon)
+        wireless.wifi = mock.Mock()
+        reply, error = mock.Mock(), mock.Mock()
+        wireless.GetIwconfig(reply_handler=reply, error_handler=error)
+        self.assertFalse(reply.called)
+        # iwconfig is done.
+        wireless.wifi.GetIwconfigAsync.call_args[0][0]('wlan0  IEEE')
+        reply.assert_called_once_with('wlan0  IEEE')
+        self.assertFalse(error.called)
+
+
+class TestEncryptionCatalog(unittest.TestCase):
+    @mock.patch('wicd.misc._encryption_catalogs', {})
+    def test_clients_refetch_on_new_version(self):
+        daemon = wicd_daemon.WicdDaemon.__new__(wicd_daemon.WicdDaemon)
+        catalog = templates.TemplateCache(ENCRYPTION_DIR)
+        with mock.patch('wicd.templates.TEMPLATES', catalog):
+            methods = misc.GetEncryptionMethods(daemon)
+            self.assertEqual(methods, catalog.methods())
+            # The client has this version, the daemon sends nothing.
+            version = misc._encryption_catalogs[False][0]
+            self.assertEqual(daemon.GetEncryptionCatalog(False, version),
+                             (version, []))
+            self.assertEqual(misc.GetEncryptionMethods(daemon), methods)
+            wired = misc.GetEncryptionMethods(daemon, wired=True)
+            self.assertEqual([method['type'] for method in wired],
+                             ['wired_8021x'])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    for case in (TestWirelessDaemon, TestLinkEvents, TestAsyncMethods,
+                 TestEncryptionCatalog):
+        suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(case))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
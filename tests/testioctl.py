@@ -0,0 +1,83 @@
+import array
+import socket
+import struct
+import unittest
+from unittest import mock
+from wicd.backends import be_ioctl
+
+
+def fake_ioctl(replies):
+    """Return an fcntl.ioctl replacement filling in buffers like the kernel.
+
+    replies maps a request to a function called with the request
+    buffer.
+
+    """
+    def ioctl(fd, request, req, mutate):
+        replies[request](req)
+        return 0
+    return ioctl
+
+
+class TestIoctlSocket(unittest.TestCase):
+    def setUp(self):
+        self.ioctl = be_ioctl.IoctlSocket('wlan0')
+
+    def tearDown(self):
+        self.ioctl.close()
+
+    def test_loopback_address(self):
+        lo = be_ioctl.IoctlSocket('lo')
+        self.assertEqual(socket.inet_ntoa(lo.get_addr()), '127.0.0.1')
+        self.assertTrue(lo.get_flags() & be_ioctl.IFF_UP)
+        lo.close()
+
+    def test_essid(self):
+        def essid(req):
+            self.ioctl._essid[:7] = array.array('B', b'CorpNet')
+            struct.pack_into('H', req, 24, 7)
+        with mock.patch('fcntl.ioctl',
+                        fake_ioctl({be_ioctl.SIOCGIWESSID: essid})):
+            self.assertEqual(self.ioctl.get_essid(), b'CorpNet')
+        # The buffer length is handed to the kernel again.
+        self.assertEqual(struct.unpack_from(
+            'H', self.ioctl._requests[be_ioctl.SIOCGIWESSID], 24)[0], 7)
+
+    def test_stats_and_range(self):
+        def stats(req):
+            self.ioctl._stats[2:6] = array.array('B', [45, 196, 161, 0])
+            struct.pack_into('H', req, 24, 32)
+
+        def iwrange(req):
+            self.ioctl._range[44] = 70
+            self.ioctl._range[52] = 2
+            struct.pack_into('2i', self.ioctl._range, 56, 1000000, 54000000)
+        with mock.patch('fcntl.ioctl',
+                        fake_ioctl({be_ioctl.SIOCGIWSTATS: stats,
+                                    be_ioctl.SIOCGIWRANGE: iwrange})):
+            self.assertEqual(self.ioctl.get_stats()[:2], (45, 196))
+            self.assertEqual(self.ioctl.get_range(),
+                             ((70, 0, 0, 0), [1000000, 54000000]))
+
+    def test_set_iface(self):
+        self.ioctl.set_iface('wlan1')
+        req = self.ioctl._requests[be_ioctl.SIOCGIWAP]
+        self.assertEqual(bytes(req[:6]), b'wlan1\0')
+        address = self.ioctl._essid.buffer_info()[0]
+        self.assertEqual(struct.unpack_from(
+            'P', self.ioctl._requests[be_ioctl.SIOCGIWESSID], 16)[0],
+            address)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [tests.append(test) for test in dir(TestIoctlSocket)
+     if test.startswith('test')]
+    for test in tests:
+        suite.addTest(TestIoctlSocket(test))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+from wicd import cache
+from wicd import netlink
+from wicd.backends import be_netlink
+
+
+NETLINK_DIR = os.path.join(os.path.dirname(__file__), 'data', 'netlink')
+
+
+def load_frames(name):
+    """Load the datagrams recorded in tests/data/netlink/<name>.hex."""
+    frames = []
+    current = []
+    with open(os.path.join(NETLINK_DIR, name + '.hex')) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#') or not line:
+                continue
+            if line == '--':
+                frames.append(bytes.fromhex(''.join(current)))
+                current = []
+            else:
+                current.append(line)
+    return frames
+
+
+class FakeSocket(object):
+    """Replay recorded datagrams and record what gets sent."""
+    def __init__(self, *names):
+        self.frames = []
+        for name in names:
+            self.frames.extend(load_frames(name))
+        self.sent = []
+        self.groups = []
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+    def recv(self, bufsize):
+        return self.frames.pop(0)
+
+    def setsockopt(self, level, option, value):
+        self.groups.append(value)
+
+    def close(self):
+        pass
+
+
+class SlowSocket(object):
+    """Acknowledge every request after a while, spot overlapping ones."""
+    def __init__(self):
+        self.pending = []
+        self.overlaps = 0
+
+    def send(self, data):
+        if self.pending:
+            self.overlaps += 1
+        self.pending.append(next(netlink.unpack_messages(data))[2])
+        return len(data)
+
+    def recv(self, bufsize):
+        time.sleep(0.01)
+        return netlink.pack_message(netlink.NLMSG_ERROR, 0,
+                                    self.pending.pop(0), b'\0' * 20)
+
+
+def nl80211_socket(*names, seq=101):
+    """Return an nl80211 socket with the family already resolved."""
+    nl = netlink.Nl80211Socket(FakeSocket('getfamily', *names))
+    nl.seq = 100
+    nl.get_family(netlink.NL80211_GENL_NAME)
+    nl.seq = seq - 1
+    return nl
+
+
+class TestNetlink(unittest.TestCase):
+    def test_attr_roundtrip(self):
+        data = (netlink.pack_u32(3, 42) + netlink.pack_string(2, 'wlan0') +
+                netlink.pack_nested(5, [netlink.pack_attr(1, b'\x01')]))
+        attrs = netlink.unpack_attrs(data)
+        self.assertEqual(netlink.get_u32(attrs, 3), 42)
+        self.assertEqual(netlink.get_string(attrs, 2), 'wlan0')
+        self.assertEqual(netlink.unpack_attrs(attrs[5]), {1: b'\x01'})
+        self.assertEqual(len(data) % 4, 0)
+
+    def test_concurrent_requests(self):
+        nl = netlink.RouteSocket(SlowSocket())
+        replies = []
+        threads = [threading.Thread(target=lambda: replies.append(
+            nl.request(netlink.RTM_NEWLINK, b''))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(replies, [[]] * 4)
+        self.assertEqual(nl.sock.overlaps, 0)
+
+    def test_get_family(self):
+        nl = nl80211_socket()
+        family_id, groups = nl.get_family(netlink.NL80211_GENL_NAME)
+        self.assertEqual(family_id, 0x1c)
+        self.assertEqual(groups['scan'], 6)
+        self.assertEqual(groups['mlme'], 8)
+        # The family is only resolved once.
+        self.assertEqual(len(nl.sock.sent), 1)
+
+    def test_join_group(self):
+        nl = nl80211_socket()
+        nl.join_group(netlink.NL80211_GENL_NAME, 'scan')
+        self.assertEqual(nl.sock.groups, [6])
+
+    def test_trigger_scan_encoding(self):
+        nl = nl80211_socket(seq=104)
+        nl.sock.frames = [netlink.pack_message(netlink.NLMSG_ERROR, 0, 104,
+                                               b'\0' * 20)]
+        nl.trigger_scan(3, ['hidden-net'], [2412, 2437])
+        self.assertEqual(nl.sock.sent[-1], load_frames('triggerscan')[0])
+
+    def test_trigger_scan_busy(self):
+        nl = nl80211_socket('triggerscan_busy', seq=105)
+        with self.assertRaises(netlink.NetlinkError) as cm:
+            nl.trigger_scan(3)
+        self.assertEqual(cm.exception.errno, 16)
+
+    def test_get_scan(self):
+        nl = nl80211_socket('getscan', seq=102)
+        results = nl.get_scan(3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(netlink.format_mac(results[0][
+            netlink.NL80211_BSS_BSSID]), '00:1A:2B:3C:4D:5E')
+        self.assertEqual(netlink.get_u32(results[0],
+                                         netlink.NL80211_BSS_STATUS), 1)
+
+    def test_get_station(self):
+        nl = nl80211_socket('getstation', seq=103)
+        info = nl.get_station(3, bytes.fromhex('001a2b3c4d5e'))
+        self.assertEqual(info[netlink.NL80211_STA_INFO_SIGNAL], b'\xd6')
+
+    @mock.patch('wicd.netlink.select.select')
+    def test_wait_for_scan(self, mock_select):
+        mock_select.side_effect = lambda r, w, x, t: (r, w, x)
+        nl = netlink.Nl80211Socket(FakeSocket('scanevents'))
+        self.assertTrue(nl.wait_for_scan(3, 5))
+        self.assertEqual(nl.sock.frames, [])
+
+    def test_parse_bss(self):
+        nl = nl80211_socket('getscan', seq=102)
+        aps = [be_netlink.ParseBSS(bss) for bss in nl.get_scan(3)]
+        self.assertEqual(aps[0], {'essid': 'CorpNet', 'hidden': False,
+                                  'channel': 6, 'bssid': '00:1A:2B:3C:4D:5E',
+                                  'bitrates': ['1', '2', '5.5', '6', '9',
+                                               '11', '12', '18', '24', '36',
+                                               '48', '54'],
+                                  'mode': 'Master', 'encryption': True,
+                                  'encryption_method': 'WPA2',
+                                  'quality': 100, 'strength': '-38'})
+        self.assertTrue(aps[1]['hidden'])
+        self.assertEqual(aps[1]['essid'], '<hidden>')
+        self.assertEqual(aps[1]['channel'], 36)
+        self.assertEqual(aps[1]['encryption_method'], 'WPA')
+        self.assertEqual(aps[1]['quality'], 58)
+        self.assertEqual(aps[2]['mode'], 'Ad-Hoc')
+        self.assertFalse(aps[2]['encryption'])
+
+    def test_route_events(self):
+        link = netlink.pack_message(
+            netlink.RTM_NEWLINK, 0, 0,
+            bytes(16) + netlink.pack_string(netlink.IFLA_IFNAME, 'eth0'))
+        # 192.168.1.23/24 on wlan0 (ifindex 3), labelled with an alias.
+        addr = netlink.pack_message(
+            netlink.RTM_DELADDR, 0, 0,
+            bytes([2, 24, 0, 0, 3, 0, 0, 0]) +
+            netlink.pack_attr(netlink.IFA_LOCAL, bytes([192, 168, 1, 23])) +
+            netlink.pack_string(netlink.IFA_LABEL, 'wlan0:1'))
+        sock = FakeSocket()
+        sock.frames = [link + addr]
+        events = netlink.RouteEventSocket(sock).read_events()
+        self.assertEqual(sock.groups, [netlink.RTNLGRP_LINK,
+                                       netlink.RTNLGRP_IPV4_IFADDR,
+                                       netlink.RTNLGRP_IPV6_IFADDR])
+        self.assertEqual(events[0]['ifname'], 'eth0')
+        self.assertEqual(events[0]['type'], netlink.RTM_NEWLINK)
+        self.assertEqual(events[1], {'type': netlink.RTM_DELADDR,
+                                     'ifindex': 3, 'ifname': 'wlan0',
+                                     'family': 2,
+                                     'address': '192.168.1.23'})
+
+    def test_get_addresses(self):
+        # 192.0.2.2/24 on eth0 and fe80::1/64 on eth0 (ifindex 2),
+        # which has no label.
+        dump = netlink.pack_message(
+            netlink.RTM_NEWADDR, netlink.NLM_F_MULTI, 11,
+            bytes([2, 24, 0, 0, 2, 0, 0, 0]) +
+            netlink.pack_attr(netlink.IFA_LOCAL, bytes([192, 0, 2, 2])) +
+            netlink.pack_string(netlink.IFA_LABEL, 'eth0'))
+        dump += netlink.pack_message(
+            netlink.RTM_NEWADDR, netlink.NLM_F_MULTI, 11,
+            bytes([10, 64, 0, 253, 2, 0, 0, 0]) +
+            netlink.pack_attr(netlink.IFA_ADDRESS,
+                              bytes.fromhex('fe80' + '00' * 13 + '01')))
+        sock = FakeSocket()
+        sock.frames = [dump, netlink.pack_message(netlink.NLMSG_DONE,
+                                                  netlink.NLM_F_MULTI, 11,
+                                                  bytes(4))]
+        nl = netlink.RouteSocket(sock)
+        nl.seq = 10
+        self.assertEqual(nl.get_addresses(), {'eth0': [
+            {'family': 2, 'address': '192.0.2.2', 'prefixlen': 24,
+             'scope': 0},
+            {'family': 10, 'address': 'fe80::1', 'prefixlen': 64,
+             'scope': 253}]})
+        # A dump of all families.
+        self.assertEqual(sock.sent[0][16:], bytes(8))
+
+    def test_get_routes(self):
+        nl = netlink.RouteSocket(FakeSocket('getroute'))
+        nl.seq = 199
+        table = nl.get_routes()
+        self.assertEqual(table[0], {'family': 2, 'destination': None,
+                                    'prefixlen': 0, 'gateway': '192.0.2.1',
+                                    'ifindex': 4, 'table': 254})
+        self.assertEqual(table[1]['destination'], '192.0.2.0')
+        self.assertEqual([route['table'] for route in table[2:]], [255] * 5)
+
+    def test_flush_routes(self):
+        sock = FakeSocket('getroute', 'delroute')
+        nl = netlink.RouteSocket(sock)
+        nl.seq = 199
+        # The ESRCH of the second deletion is ignored.
+        nl.flush_routes(4)
+        dump = load_frames('getroute')[0]
+        # Only the main table routes are deleted, as they were dumped.
+        self.assertEqual([msg[1:] for msg in netlink.unpack_messages(
+            b''.join(sock.sent[1:]))],
+            [(netlink.NLM_F_REQUEST | netlink.NLM_F_ACK, seq, payload)
+             for seq, (_, _, _, payload) in zip(
+                 (201, 202), list(netlink.unpack_messages(dump))[:2])])
+        self.assertEqual(netlink._nlmsghdr.unpack_from(sock.sent[1])[1],
+                         netlink.RTM_DELROUTE)
+
+    def test_del_default_route(self):
+        sock = FakeSocket('delroute_esrch')
+        nl = netlink.RouteSocket(sock)
+        nl.seq = 299
+        nl.del_default_route(999)
+        _, msg_type, flags, seq, _ = netlink._nlmsghdr.unpack_from(
+            sock.sent[0])
+        self.assertEqual((msg_type, seq), (netlink.RTM_DELROUTE, 300))
+        sock.frames = load_frames('delroute_esrch')
+        nl.seq = 299
+        self.assertRaises(netlink.NetlinkError, nl.replace_default_route,
+                          999, '192.0.2.1')
+
+    def test_replace_address(self):
+        sock = FakeSocket()
+        sock.frames = [netlink.pack_message(netlink.NLMSG_ERROR, 0, 11,
+                                            bytes(20))]
+        nl = netlink.RouteSocket(sock)
+        nl.seq = 10
+        nl.replace_address(4, '192.0.2.7', 24)
+        _, msg_type, flags, _, _ = netlink._nlmsghdr.unpack_from(sock.sent[0])
+        self.assertEqual(msg_type, netlink.RTM_NEWADDR)
+        self.assertTrue(flags & netlink.NLM_F_REPLACE)
+        family, prefixlen, ifindex, attrs = netlink.unpack_ifaddr(
+            sock.sent[0][16:])
+        self.assertEqual((family, prefixlen, ifindex), (2, 24, 4))
+        self.assertEqual(attrs[netlink.IFA_LOCAL], bytes([192, 0, 2, 7]))
+        self.assertEqual(attrs[netlink.IFA_BROADCAST],
+                         bytes([192, 0, 2, 255]))
+
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    def test_station_info(self, mock_exists):
+        iface = be_netlink.WirelessInterface.__new__(
+            be_netlink.WirelessInterface)
+        iface.iface = 'wlan0'
+        iface.verbose = False
+        iface.nl = nl80211_socket('getscan', 'getstation', seq=102)
+        cache.CACHE.invalidate('wlan0')
+        self.addCleanup(cache.CACHE.invalidate, 'wlan0')
+        with mock.patch('socket.if_nametoindex', return_value=3):
+            self.assertEqual(iface.GetDBMStrength(), '-42')
+            self.assertEqual(iface.GetCurrentBitrate(), '65 Mb/s')
+            self.assertEqual(iface.GetBSSID(), '00:1A:2B:3C:4D:5E')
+        # A single scan dump and station query serve all the getters.
+        self.assertEqual(len(iface.nl.sock.sent), 3)
+
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('socket.if_nametoindex', side_effect=OSError(19, 'ENODEV'))
+    def test_get_networks_without_interface(self, mock_index, mock_exists):
+        iface = be_netlink.WirelessInterface.__new__(
+            be_netlink.WirelessInterface)
+        iface.iface = 'wlan0'
+        iface.verbose = False
+        iface.nl = None
+        with mock.patch('builtins.print'):
+            self.assertEqual(iface.GetNetworks(), [])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [tests.append(test) for test in dir(TestNetlink)
+     if test.startswith('test')]
+    for test in tests:
+        suite.addTest(TestNetlink(test))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
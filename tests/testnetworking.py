@@ -0,0 +1,107 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from wicd import networking
+
+
+class FakeInterface(object):
+    """Record the calls made, some of them taking a while."""
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        def call(*args):
+            time.sleep(self.delays.get(name, 0))
+            with self.lock:
+                self.calls.append(name)
+        return call
+
+
+def connect_thread(iface):
+    return networking.WiredConnectThread(
+        {'profilename': 'home'}, 'eth0', None, None, None, None, None, None,
+        None, None, None, iface, False)
+
+
+class TestConnectStages(unittest.TestCase):
+    def test_requirements(self):
+        order = []
+        networking.run_stages([
+            networking.Stage('last', lambda: order.append('last'),
+                             requires=('slow', 'fast')),
+            networking.Stage('slow', lambda: (time.sleep(0.1),
+                                              order.append('slow'))),
+            networking.Stage('fast', lambda: order.append('fast'))])
+        self.assertEqual(order, ['fast', 'slow', 'last'])
+        self.assertRaises(ValueError, networking.run_stages, [
+            networking.Stage('first', lambda: None, requires=('missing',))])
+
+    @mock.patch('builtins.print')
+    def test_tear_down(self, mock_print):
+        iface = FakeInterface({'ReleaseDHCP': 0.2, 'StopWPA': 0.2,
+                               'FlushDNS': 0.2})
+        thread = connect_thread(iface)
+        start = time.monotonic()
+        thread.tear_down(iface)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(sorted(iface.calls),
+                         ['CommitBatch', 'Down', 'FlushDNS', 'FlushRoutes',
+                          'ReleaseDHCP', 'SetAddress', 'StartBatch',
+                          'StopWPA'])
+        # Addresses are reset once the DHCP client is gone.
+        self.assertLess(iface.calls.index('ReleaseDHCP'),
+                        iface.calls.index('StartBatch'))
+        self.assertEqual(iface.calls[-1], 'CommitBatch')
+
+    @mock.patch('builtins.print')
+    def test_abort(self, mock_print):
+        iface = FakeInterface({'ReleaseDHCP': 0.2})
+        thread = connect_thread(iface)
+        iface.Down = lambda: (time.sleep(0.05),
+                              thread.abort_connection('aborted'))
+        self.assertRaises(SystemExit, thread.tear_down, iface)
+        self.assertTrue(thread.is_aborted)
+        # Running steps finish, the following ones don't start.
+        self.assertIn('ReleaseDHCP', iface.calls)
+        self.assertNotIn('SetAddress', iface.calls)
+
+
+class TestWirelessScan(unittest.TestCase):
+    def setUp(self):
+        self.wireless = networking.Wireless()
+        self.wireless.wiface = mock.Mock(iface='wlan0',
+                                         scans_frequencies=False)
+        self.wireless.wiface.GetNetworks.return_value = []
+
+    @mock.patch('wicd.wpasupplicant.ScanFrequencies', return_value=None)
+    def test_scan_frequencies_without_supplicant(self, mock_scan):
+        wiface = self.wireless.wiface
+        self.wireless.Scan(None, [2437])
+        # iwlist can't limit the scan, so all the channels are scanned.
+        wiface.GetNetworks.assert_called_once_with(None)
+        self.assertFalse(self.wireless.limited_scan)
+        wiface.GetNetworks.reset_mock()
+        wiface.scans_frequencies = True
+        self.wireless.Scan(None, [2437])
+        wiface.GetNetworks.assert_called_once_with(None, [2437])
+        self.assertTrue(self.wireless.limited_scan)
+
+    @mock.patch('wicd.wpasupplicant.ScanFrequencies', return_value=[])
+    def test_scan_frequencies_with_supplicant(self, mock_scan):
+        self.wireless.Scan(None, [2437])
+        self.assertFalse(self.wireless.wiface.GetNetworks.called)
+        self.assertTrue(self.wireless.limited_scan)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    for case in (TestConnectStages, TestWirelessScan):
+        suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(case))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+from wicd import psk
+
+NETWORK_1_PSK = ('d70463014514f4b4ebb8e3aebbdec13f'
+                 '4437ac3a9af084b3433f3710e658a7be')
+
+
+class TestPSK(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'psk_cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_derive_psk(self):
+        self.assertEqual(psk.DerivePSK('Network 1', 'arandompassphrase'),
+                         NETWORK_1_PSK)
+        self.assertIsNone(psk.DerivePSK('Network 1', 'short'))
+        self.assertIsNone(psk.DerivePSK('Network 1', 'x' * 64))
+        self.assertIsNone(psk.DerivePSK('Network 1', 'pass\nphrase'))
+
+    def test_cache(self):
+        cache = psk.PSKCache(self.path)
+        self.assertEqual(cache.get('Network 1', 'arandompassphrase'),
+                         NETWORK_1_PSK)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        with open(self.path) as f:
+            self.assertNotIn('arandompassphrase', f.read())
+        # Another daemon run doesn't derive it again.
+        with mock.patch('wicd.psk.DerivePSK', return_value='0' * 64) as \
+                mock_derive:
+            cache = psk.PSKCache(self.path)
+            self.assertEqual(cache.get('Network 1', 'arandompassphrase'),
+                             NETWORK_1_PSK)
+            self.assertFalse(mock_derive.called)
+            # A new passphrase isn't answered with the old PSK.
+            cache.get('Network 1', 'anotherpassphrase')
+            mock_derive.assert_called_once_with('Network 1',
+                                                'anotherpassphrase')
+
+    def test_forget(self):
+        cache = psk.PSKCache(self.path)
+        cache.get('Network 1', 'arandompassphrase')
+        cache.forget('Network 1')
+        cache.forget('Network 2')
+        with mock.patch('wicd.psk.DerivePSK', return_value=None) as \
+                mock_derive:
+            self.assertIsNone(psk.PSKCache(self.path).get(
+                'Network 1', 'arandompassphrase'))
+            self.assertTrue(mock_derive.called)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [tests.append(test) for test in dir(TestPSK)
+     if test.startswith('test')]
+    for test in tests:
+        suite.addTest(TestPSK(test))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import socket
+import unittest
+from unittest import mock
+from wicd import misc
+from wicd import routes
+from wicd import wnettools
+
+
+ROUTES_DIR = os.path.join(os.path.dirname(__file__), 'data', 'routes')
+PATHS = {'ipv4_path': os.path.join(ROUTES_DIR, 'route'),
+         'ipv6_path': os.path.join(ROUTES_DIR, 'ipv6_route')}
+
+
+class TestRoutes(unittest.TestCase):
+    def test_ipv4_routes(self):
+        table = routes.ReadIPv4Routes(PATHS['ipv4_path'])
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table[2], {
+            'iface': 'eth0', 'family': socket.AF_INET,
+            'destination': '192.0.2.0', 'prefixlen': 24, 'gateway': None,
+            'metric': 100, 'flags': routes.RTF_UP})
+
+    def test_ipv6_routes(self):
+        table = routes.GetRoutes(family=socket.AF_INET6, **PATHS)
+        # The unreachable routes on lo are left out.
+        self.assertEqual([route['iface'] for route in table],
+                         ['eth0', 'eth0', 'eth0', 'lo'])
+        self.assertEqual(table[0]['destination'], '2001:db8:1::')
+        self.assertEqual(table[0]['prefixlen'], 64)
+        self.assertEqual(table[2]['gateway'], 'fe80::1')
+        self.assertEqual(table[2]['metric'], 1024)
+
+    def test_default_gateway(self):
+        # The route with the lowest metric wins.
+        self.assertEqual(routes.GetDefaultGateway(**PATHS), '192.0.2.1')
+        self.assertEqual(
+            [route['iface'] for route in routes.GetDefaultRoutes(**PATHS)],
+            ['eth0', 'wlan0'])
+        self.assertIsNone(routes.GetDefaultGateway(
+            ipv4_path=os.path.join(ROUTES_DIR, 'missing')))
+
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.misc.Run')
+    @mock.patch('wicd.netlink.RouteSocket', side_effect=OSError)
+    def test_flush_skipped_without_routes(self, mock_socket, mock_run,
+                                          mock_exists):
+        get_routes = routes.GetRoutes
+
+        def fixture_routes(*args, **kwargs):
+            return get_routes(*args, **dict(kwargs, **PATHS))
+
+        interface = wnettools.BaseInterface('wlan1')
+        interface.ip_cmd = '/sbin/ip'
+        interface.flush_tool = misc.AUTO
+        with mock.patch('wicd.routes.GetRoutes', fixture_routes):
+            interface.FlushRoutes()
+            interface.DelDefaultRoute()
+            self.assertFalse(mock_run.called)
+            interface.SetInterface('wlan0')
+            interface.FlushRoutes()
+            interface.DelDefaultRoute()
+        self.assertEqual(mock_run.call_args_list, [
+            mock.call('/sbin/ip route flush dev wlan0'),
+            mock.call('/sbin/ip route del default dev wlan0')])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [tests.append(test) for test in dir(TestRoutes)
+     if test.startswith('test')]
+    for test in tests:
+        suite.addTest(TestRoutes(test))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
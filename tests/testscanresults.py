@@ -0,0 +1,109 @@
+import unittest
+from wicd.scanresults import AccessPoint
+from wicd.scanresults import ScanCache
+from wicd.scanresults import ScanResults
+
+
+def network(bssid, essid):
+    return {'bssid': bssid, 'essid': essid, 'hidden': False, 'channel': '6',
+            'mode': 'Master', 'encryption': False, 'quality': 50,
+            'strength': '-70', 'bitrates': ['1', '2']}
+
+
+class TestAccessPoint(unittest.TestCase):
+    def test_behaves_like_a_dict(self):
+        raw = network('00:00:00:00:00:01', 'one')
+        ap = AccessPoint(raw)
+        self.assertEqual(ap, raw)
+        self.assertEqual(dict(ap), raw)
+        self.assertEqual(len(ap), len(raw))
+        self.assertEqual(ap.get('automatic'), None)
+        self.assertNotIn('encryption_method', ap)
+        self.assertRaises(KeyError, lambda: ap['encryption_method'])
+
+    def test_profile_options(self):
+        ap = AccessPoint(network('00:00:00:00:00:01', 'one'))
+        ap['automatic'] = True
+        ap['essid'] = 'renamed'
+        self.assertEqual(ap['automatic'], True)
+        self.assertEqual(ap['essid'], 'renamed')
+        self.assertEqual('%(essid)s/%(automatic)s' % ap, 'renamed/True')
+        del ap['automatic']
+        del ap['quality']
+        self.assertNotIn('automatic', ap)
+        self.assertNotIn('quality', ap)
+        self.assertRaises(KeyError, ap.__delitem__, 'quality')
+
+    def test_copy_is_independent(self):
+        ap = AccessPoint(network('00:00:00:00:00:01', 'one'))
+        copy = ap.copy()
+        copy['quality'] = 10
+        self.assertEqual(ap['quality'], 50)
+
+
+class TestScanResults(unittest.TestCase):
+    def test_index_access(self):
+        results = ScanResults([network('00:00:00:00:00:01', 'one'),
+                               network('00:00:00:00:00:02', 'two')])
+        self.assertEqual(len(results), 2)
+        self.assertIsInstance(results[1], AccessPoint)
+        self.assertEqual([ap['essid'] for ap in results], ['one', 'two'])
+        results.append(network('00:00:00:00:00:03', 'three'))
+        self.assertEqual(results[-1]['essid'], 'three')
+
+    def test_find(self):
+        results = ScanResults([network('00:00:00:00:00:01', 'one'),
+                               network('00:00:00:00:00:02', 'two')])
+        self.assertEqual(results.find('00:00:00:00:00:02'), 1)
+        results.sort(key=lambda ap: ap['essid'], reverse=True)
+        self.assertEqual(results.find('00:00:00:00:00:02'), 0)
+        self.assertEqual(results.find('00:00:00:00:00:09'), -1)
+        results[0]['bssid'] = '00:00:00:00:00:09'
+        self.assertEqual(results.find('00:00:00:00:00:02'), -1)
+        self.assertEqual(results.find('00:00:00:00:00:09'), 0)
+
+
+class TestScanCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = ScanCache(ttl=30, clock=lambda: self.now)
+
+    def test_missed_networks_age_out(self):
+        self.cache.update([network('00:00:00:00:00:01', 'one'),
+                           network('00:00:00:00:00:02', 'two')])
+        self.now = 20
+        results = self.cache.update([network('00:00:00:00:00:02', 'two')])
+        self.assertEqual(sorted(ap['essid'] for ap in results),
+                         ['one', 'two'])
+        self.now = 40
+        results = self.cache.update([network('00:00:00:00:00:02', 'two')])
+        self.assertEqual([ap['essid'] for ap in results], ['two'])
+        self.assertIn('last_seen', results[0])
+
+    def test_signal_is_smoothed(self):
+        self.cache.update([network('00:00:00:00:00:01', 'one')])
+        weaker = dict(network('00:00:00:00:00:01', 'one'), quality=30,
+                      strength='-80')
+        ap = self.cache.update([weaker])[0]
+        self.assertEqual(ap['quality'], 40)
+        self.assertEqual(ap['strength'], '-75')
+        # Results are copies, the cache doesn't see profile options.
+        ap['automatic'] = True
+        self.assertNotIn('automatic', self.cache.update([])[0])
+
+    def test_disabled(self):
+        self.cache.ttl = 0
+        self.cache.update([network('00:00:00:00:00:01', 'one')])
+        self.assertEqual(len(self.cache.update([])), 0)
+        self.assertEqual(len(self.cache), 0)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    for case in (TestAccessPoint, TestScanResults, TestScanCache):
+        suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(case))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
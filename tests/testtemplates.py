@@ -0,0 +1,115 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+from wicd import templates
+
+ENCRYPTION_DIR = os.path.join(os.path.dirname(__file__), '..', 'data',
+                              'encryption')
+
+BROKEN_TEMPLATE = """name = Broken
+require key *Key
+protected password *Password
+-----
+network={
+       ssid="$_ESSID"
+       psk="$_APSK"
+}
+"""
+
+
+class TestTemplates(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ('active', 'wpa-psk'):
+            shutil.copy(os.path.join(ENCRYPTION_DIR, name), self.tmpdir)
+        with open(os.path.join(self.tmpdir, 'active'), 'w') as f:
+            f.write('wpa-psk\nbroken\nmissing\n')
+        self.cache = templates.TemplateCache(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_render(self):
+        template = self.cache.get('wpa-psk')
+        self.assertTrue(template.valid)
+        config = template.render({'essid': 'CorpNet', 'apsk': 'secret 1'})
+        self.assertEqual(config.splitlines()[:4],
+                         ['ap_scan=1',
+                          'ctrl_interface=/var/run/wpa_supplicant',
+                          'network={', '       ssid="CorpNet"'])
+        self.assertIn('       scan_ssid=1\n', config)
+        self.assertIn('       psk="secret 1"\n', config)
+        # A missing value leaves the placeholder, as before.
+        self.assertIn('psk="$_APSK"', template.render({}))
+
+    def test_compiled_once(self):
+        template = self.cache.get('wpa-psk')
+        with mock.patch('wicd.templates.Template') as mock_template:
+            self.assertIs(self.cache.get('wpa-psk'), template)
+            self.assertFalse(mock_template.called)
+        path = os.path.join(self.tmpdir, 'wpa-psk')
+        with open(path, 'a') as f:
+            f.write('# changed\n')
+        self.assertIsNot(self.cache.get('wpa-psk'), template)
+        self.assertRaises(IOError, self.cache.get, 'missing')
+
+    @mock.patch('builtins.print')
+    def test_validation(self, mock_print):
+        with open(os.path.join(self.tmpdir, 'broken'), 'w') as f:
+            f.write(BROKEN_TEMPLATE)
+        methods = self.cache.methods()
+        self.assertEqual([method['type'] for method in methods],
+                         ['wpa-psk', 'broken'])
+        self.assertEqual(methods[0]['required'],
+                         [['apsk', 'Preshared_Key']])
+        printed = [call[0][0] for call in mock_print.call_args_list]
+        self.assertIn('Protected field password of template broken is '
+                      'neither required nor optional', printed)
+        self.assertIn('Template broken uses the undeclared field apsk',
+                      printed)
+        self.assertIn('Failed to open template file missing', printed)
+        # Without a require line the template isn't offered.
+        with open(os.path.join(self.tmpdir, 'broken'), 'w') as f:
+            f.write(BROKEN_TEMPLATE.replace('require', '#'))
+        self.assertEqual(len(self.cache.methods()), 1)
+
+    def test_catalog(self):
+        version, methods = self.cache.catalog()
+        self.assertEqual([method['type'] for method in methods],
+                         ['wpa-psk'])
+        self.assertEqual(self.cache.catalog(), (version, methods))
+        with open(os.path.join(self.tmpdir, 'broken'), 'w') as f:
+            f.write(BROKEN_TEMPLATE)
+        self.assertNotEqual(self.cache.catalog()[0], version)
+
+    def test_write(self):
+        path = os.path.join(self.tmpdir, '001122334455')
+        self.assertTrue(self.cache.write(path, 'ap_scan=1\n'))
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+        self.assertFalse(self.cache.write(path, 'ap_scan=1\n'))
+        self.assertTrue(self.cache.write(path, 'ap_scan=0\n'))
+        # A file changed behind our back is written again.
+        with open(path, 'w') as f:
+            f.write('edited\n')
+        self.assertTrue(self.cache.write(path, 'ap_scan=0\n'))
+        with open(path) as f:
+            self.assertEqual(f.read(), 'ap_scan=0\n')
+        self.assertEqual(os.listdir(self.tmpdir).count('001122334455.tmp'),
+                         0)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [tests.append(test) for test in dir(TestTemplates)
+     if test.startswith('test')]
+    for test in tests:
+        suite.addTest(TestTemplates(test))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
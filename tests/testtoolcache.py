@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from wicd import toolcache
+
+
+class TestToolCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bindir = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(self.bindir)
+        self.program = os.path.join(self.bindir, 'dhclient')
+        with open(self.program, 'w') as f:
+            f.write('#!/bin/sh\necho "isc-dhclient-4.4.3" >&2\n')
+        os.chmod(self.program, 0o755)
+        self.path = os.path.join(self.tmpdir, 'tools.json')
+        self.now = 0
+        self.environ = mock.patch.dict(os.environ, {'PATH': self.bindir})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _cache(self):
+        return toolcache.ToolCache(self.path, clock=lambda: self.now)
+
+    def test_find(self):
+        tools = self._cache()
+        self.assertEqual(tools.find('dhclient'), self.program)
+        self.assertIsNone(tools.find('pump'))
+        # Another daemon run doesn't look again.
+        with mock.patch('os.path.exists') as mock_exists:
+            tools = self._cache()
+            self.assertEqual(tools.find('dhclient'), self.program)
+            self.assertIsNone(tools.find('pump'))
+            self.assertFalse(mock_exists.called)
+        # Installing a program changes the directory.
+        pump = os.path.join(self.bindir, 'pump')
+        open(pump, 'w').close()
+        st = os.stat(self.bindir)
+        os.utime(self.bindir, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertIsNone(tools.find('pump'))
+        self.now += toolcache.CHECK_INTERVAL
+        self.assertEqual(tools.find('pump'), pump)
+
+    @mock.patch('wicd.misc.Run', return_value='isc-dhclient-4.4.3\n')
+    def test_probe(self, mock_run):
+        tools = self._cache()
+        self.assertEqual(tools.probe('dhclient', ['--version']),
+                         'isc-dhclient-4.4.3\n')
+        self.assertEqual(self._cache().probe(self.program, ['--version']),
+                         'isc-dhclient-4.4.3\n')
+        mock_run.assert_called_once_with([self.program, '--version'],
+                                         include_stderr=True)
+        # An upgraded program is asked again.
+        st = os.stat(self.program)
+        os.utime(self.program, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        tools.probe('dhclient', ['--version'])
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertEqual(tools.probe('pump', ['-h']), '')
+
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [tests.append(test) for test in dir(TestToolCache)
+     if test.startswith('test')]
+    for test in tests:
+        suite.addTest(TestToolCache(test))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,128 @@
+import functools
+import glob
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
+from wicd import ieee80211
+from wicd import misc
+from wicd import psk
 from wicd import wnettools
+from wicd.wnettools import (RALINK_DRIVER, altwpa_pattern, ap_mac_pattern,
+                            bitrates_pattern, channel_pattern, essid_pattern,
+                            freq_pattern, mode_pattern, signaldbm_pattern,
+                            wep_pattern, wpa1_pattern, wpa2_pattern)
+
+
+IWLIST_DIR = os.path.join(os.path.dirname(__file__), 'data', 'iwlist')
+
+
+def _parse_access_point(interface, cell, ralink_info):
+    """Parse a single cell from the output of iwlist, the old way.
+
+    Keyword arguments:
+    interface -- the BaseWirelessInterface parsing it
+    cell -- string containing the cell information
+    ralink_info -- string contating network information needed
+                   for ralink cards.
+
+    Returns:
+    A dictionary containing the cell networks properties.
+
+    """
+    ap = {}
+    ap['essid'] = misc.RunRegex(essid_pattern, cell)
+    try:
+        ap['essid'] = misc.to_unicode(ap['essid'])
+    except (UnicodeDecodeError, UnicodeEncodeError):
+        print('Unicode problem with current network essid, ignoring!!')
+        return None
+
+    # We (well, DBus) don't support ESSIDs with null bytes in it.
+    # From some bugreports, it seems like some APs transmit the "hidden"
+    # essid as NULL bytes. Let's strip them off.
+    ap['essid'] = ap['essid'].replace('\x00', '')
+
+    if ap['essid'] in ['Hidden', '<hidden>', "", None]:
+        print('hidden')
+        ap['hidden'] = True
+        ap['essid'] = "<hidden>"
+    else:
+        ap['hidden'] = False
+
+    # Channel - For cards that don't have a channel number,
+    # convert the frequency.
+    ap['channel'] = misc.RunRegex(channel_pattern, cell)
+    if ap['channel'] is None:
+        freq = misc.RunRegex(freq_pattern, cell)
+        ap['channel'] = interface._FreqToChannel(freq)
+
+    # Bit Rate
+    bitrates = cell.split('Bit Rates')[-1].replace('\n', '; ')
+    m = re.findall(bitrates_pattern, bitrates)
+    if m:
+        # numeric sort
+        ap['bitrates'] = sorted(m,
+                                key=functools.
+                                cmp_to_key(lambda x, y:
+                                           int(float(x) - float(y))))
+    else:
+        ap['bitrates'] = None
+
+    # BSSID
+    ap['bssid'] = misc.RunRegex(ap_mac_pattern, cell)
+
+    # Mode
+    ap['mode'] = misc.RunRegex(mode_pattern, cell)
+    if ap['mode'] is None:
+        print('Invalid network mode string, ignoring!')
+        return None
+
+    # Break off here if we're using a ralink card
+    if interface.wpa_driver == RALINK_DRIVER:
+        ap = interface._ParseRalinkAccessPoint(ap, ralink_info, cell)
+    elif misc.RunRegex(wep_pattern, cell) == 'on':
+        # Encryption - Default to WEP
+        ap['encryption'] = True
+        ap['encryption_method'] = 'WEP'
+
+        if misc.RunRegex(wpa1_pattern, cell) == 'WPA Version 1':
+            ap['encryption_method'] = 'WPA'
+
+        if misc.RunRegex(altwpa_pattern, cell) == 'wpa_ie':
+            ap['encryption_method'] = 'WPA'
+
+        if misc.RunRegex(wpa2_pattern, cell) == 'WPA2':
+            ap['encryption_method'] = 'WPA2'
+    else:
+        ap['encryption'] = False
+
+    # Link Quality
+    # Set strength to -1 if the quality is not found
+    ap['quality'] = interface._get_link_quality(cell)
+    if ap['quality'] is None:
+        ap['quality'] = -1
+
+    # Signal Strength (only used if user doesn't want link
+    # quality displayed or it isn't found)
+    if misc.RunRegex(signaldbm_pattern, cell):
+        ap['strength'] = misc.RunRegex(signaldbm_pattern, cell)
+    # This is already set for ralink
+    elif interface.wpa_driver != RALINK_DRIVER:
+        ap['strength'] = -1
+
+    return ap
+
+
+def _parse_cells(interface, results):
+    """Parse iwlist scan output one cell at a time, the old way."""
+    aps = [_parse_access_point(interface, cell, None)
+           for cell in results.split('   Cell ') if 'ESSID:' in cell]
+    return [ap for ap in aps if ap is not None]
 
 
 class TestWnettools(unittest.TestCase):
@@ -13,19 +135,202 @@ class TestWnettools(unittest.TestCase):
         # self.assertTrue('wlan0' in interfaces)
         self.assertTrue(type(interfaces) == list)
 
-    @mock.patch('wicd.wnettools.os')
-    @mock.patch('wicd.wnettools.open')
-    def test_find_wired_interface(self, mock_f, mock_os):
-        mock_os.listdir.return_value = ['eth0']
-        mock_os.path.isdir.return_value = True
-        mock_f.return_value.readlines.return_value = "1"
-        interfaces = wnettools.GetWiredInterfaces()
-        self.assertTrue('eth0' in interfaces)
+    def _make_sysfs(self):
+        """Build a /sys/class/net look-alike, return its path."""
+        sysfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sysfs)
+        devices = os.path.join(sysfs, 'devices')
+        for iface, iftype, driver, extra in (
+                ('eth0', '1', 'e1000e', None),
+                ('wlan0', '1', 'iwlwifi', 'phy80211'),
+                ('veth3f2a', '1', None, None),
+                ('lo', '772', None, None)):
+            path = os.path.join(sysfs, 'net', iface)
+            os.makedirs(path)
+            with open(os.path.join(path, 'type'), 'w') as f:
+                f.write(iftype + '\n')
+            with open(os.path.join(path, 'operstate'), 'w') as f:
+                f.write('up\n' if iface == 'eth0' else 'down\n')
+            if driver:
+                os.makedirs(os.path.join(devices, iface))
+                os.symlink(os.path.join(devices, iface),
+                           os.path.join(path, 'device'))
+                os.symlink(os.path.join(devices, driver),
+                           os.path.join(devices, iface, 'driver'))
+            if extra:
+                os.symlink(devices, os.path.join(path, extra))
+        open(os.path.join(sysfs, 'net', 'bonding_masters'), 'w').close()
+        return os.path.join(sysfs, 'net')
+
+    def test_find_wired_interface(self):
+        with mock.patch('wicd.wnettools.SYS_CLASS_NET', self._make_sysfs()):
+            self.assertEqual(wnettools.GetWiredInterfaces(),
+                             ['eth0', 'veth3f2a'])
+            self.assertEqual(wnettools.GetWirelessInterfaces(), ['wlan0'])
+
+    def test_interface_inventory(self):
+        sysfs = self._make_sysfs()
+        inventory = wnettools.GetInterfaceInventory(sysfs)
+        self.assertEqual(inventory['eth0'], {
+            'kind': 'wired', 'type': '1', 'operstate': 'up',
+            'driver': 'e1000e'})
+        self.assertEqual(
+            dict((iface, info['kind']) for iface, info in inventory.items()),
+            {'eth0': 'wired', 'wlan0': 'wireless', 'veth3f2a': 'virtual',
+             'lo': 'loopback'})
+        # The walk is cached until the inventory is invalidated.
+        shutil.rmtree(os.path.join(sysfs, 'veth3f2a'))
+        self.assertIn('veth3f2a', wnettools.GetInterfaceInventory(sysfs))
+        wnettools.InvalidateInterfaceInventory()
+        self.assertNotIn('veth3f2a', wnettools.GetInterfaceInventory(sysfs))
+
+    @mock.patch('wicd.misc.Run')
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.wnettools.netlink.RouteSocket')
+    def test_addresses(self, mock_socket, mock_exists, mock_run):
+        mock_socket.return_value.get_addresses.return_value = {'eth0': [
+            {'family': 10, 'address': 'fe80::1', 'prefixlen': 64,
+             'scope': 253},
+            {'family': 2, 'address': '192.0.2.2', 'prefixlen': 24,
+             'scope': 0},
+            {'family': 10, 'address': '2001:db8::2', 'prefixlen': 64,
+             'scope': 0}]}
+        wnettools.InvalidateAddresses()
+        self.assertEqual(self.interface.GetIP(), '192.0.2.2')
+        self.assertEqual(self.interface.GetIPv6Addresses(),
+                         ['2001:db8::2/64', 'fe80::1/64'])
+        self.assertIsNone(wnettools.BaseInterface('wlan0').GetIP())
+        # One dump served all the queries.
+        self.assertEqual(mock_socket.call_count, 1)
+        self.interface.SetAddress('192.0.2.3')
+        self.interface.GetIP()
+        self.assertEqual(mock_socket.call_count, 2)
+
+    @mock.patch('wicd.misc.Run')
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.routes.GetRoutes',
+                return_value=[{'iface': 'eth0', 'prefixlen': 0,
+                              'metric': 0}])
+    @mock.patch('wicd.netlink.RouteSocket', side_effect=OSError)
+    def test_batch(self, mock_socket, mock_routes, mock_exists, mock_run):
+        mock_run.return_value = ('RTNETLINK answers: No such process\n'
+                                 'Command failed -:4\n')
+        self.interface.ip_cmd = '/sbin/ip'
+        self.interface.flush_tool = wnettools.misc.AUTO
+        self.interface.StartBatch()
+        self.interface.SetAddress('0.0.0.0')
+        self.interface.SetAddress('192.0.2.2', '255.255.255.0')
+        self.interface.FlushRoutes()
+        self.interface.DelDefaultRoute()
+        self.interface.SetDefaultRoute('192.0.2.1')
+        self.assertFalse(mock_run.called)
+        self.assertEqual(self.interface.CommitBatch(), [
+            ('route del default dev eth0',
+             'RTNETLINK answers: No such process')])
+        mock_run.assert_called_once_with(
+            ['/sbin/ip', '-4', '-force', '-batch', '-'], include_stderr=True,
+            input='addr flush dev eth0\n'
+                  'addr replace 192.0.2.2/24 broadcast + dev eth0\n'
+                  'route flush dev eth0\n'
+                  'route del default dev eth0\n'
+                  'route replace default via 192.0.2.1 dev eth0\n')
+        # Once committed, changes are applied right away again.
+        self.interface.SetAddress('0.0.0.0')
+        self.assertTrue(mock_run.call_args[0][0].startswith('ifconfig eth0'))
+
+    @mock.patch('wicd.misc.Run', return_value='')
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.netlink.RouteSocket', side_effect=OSError)
+    def test_batch_threads(self, mock_socket, mock_exists, mock_run):
+        self.interface.ip_cmd = '/sbin/ip'
+        self.interface.flush_tool = wnettools.misc.AUTO
+        started = threading.Event()
+        commits = []
+
+        def other():
+            # Changes of other threads are applied right away...
+            self.interface.SetAddress('0.0.0.0')
+            # They can't commit it...
+            commits.append(self.interface.CommitBatch())
+            # ...and their batches wait for the one running.
+            self.interface.StartBatch()
+            started.set()
+            self.interface.SetAddress('0.0.0.0')
+            self.interface.CommitBatch()
+
+        self.interface.StartBatch()
+        thread = threading.Thread(target=other)
+        thread.start()
+        self.assertFalse(started.wait(0.2))
+        self.assertTrue(mock_run.call_args[0][0].startswith('ifconfig eth0'))
+        self.interface.FlushRoutes()
+        self.interface.CommitBatch()
+        thread.join()
+        self.assertTrue(started.is_set())
+        self.assertEqual(commits, [[]])
+        self.assertEqual([call[1].get('input') for call in
+                          mock_run.call_args_list[1:]],
+                         ['route flush dev eth0\n', 'addr flush dev eth0\n'])
+
+    @mock.patch('wicd.misc.Run')
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.wnettools.socket.if_nametoindex', return_value=4)
+    @mock.patch('wicd.netlink.RouteSocket')
+    def test_netlink_threads(self, mock_socket, mock_index, mock_exists,
+                             mock_run):
+        self.interface.flush_tool = wnettools.misc.AUTO
+        running = []
+        overlaps = []
+
+        def flush_addresses(ifindex):
+            overlaps.append(bool(running))
+            running.append(ifindex)
+            time.sleep(0.02)
+            running.pop()
+
+        mock_socket.return_value.flush_addresses.side_effect = \
+            flush_addresses
+        threads = [threading.Thread(target=self.interface.SetAddress,
+                                    args=('0.0.0.0',)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [False] * 4)
+        self.assertEqual(mock_socket.call_count, 1)
+        self.assertFalse(mock_run.called)
 
     @mock.patch('wicd.misc.Run')
-    def test_wext_is_valid_wpasupplicant_driver(self, mock_syscall):
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.wnettools.socket.if_nametoindex', return_value=4)
+    @mock.patch('wicd.netlink.RouteSocket')
+    def test_netlink(self, mock_socket, mock_index, mock_exists, mock_run):
+        self.interface.flush_tool = wnettools.misc.AUTO
+        rtnl = mock_socket.return_value
+        self.assertTrue(self.interface.Up())
+        self.interface.SetAddress('192.0.2.2', '255.255.255.0')
+        self.interface.SetDefaultRoute('192.0.2.1')
+        rtnl.set_link_up.assert_called_once_with(4, True)
+        rtnl.replace_address.assert_called_once_with(
+            4, '192.0.2.2', 24, None)
+        rtnl.replace_default_route.assert_called_once_with(4, '192.0.2.1')
+        self.assertFalse(mock_run.called)
+        # The tools take over what the kernel refuses.
+        rtnl.set_link_up.side_effect = wnettools.netlink.NetlinkError(
+            1, 'Operation not permitted')
+        self.interface.Down()
+        mock_run.assert_called_once_with('ifconfig eth0 down')
+        # And everything once the socket is known to be useless.
+        self.interface.SetDefaultRoute('192.0.2.1')
+        self.assertEqual(rtnl.replace_default_route.call_count, 1)
+        self.assertEqual(mock_socket.call_count, 1)
+
+    @mock.patch('wicd.toolcache.TOOLS')
+    def test_wext_is_valid_wpasupplicant_driver(self, mock_tools):
+        mock_tools.probe.return_value = ''
         self.assertTrue(wnettools.IsValidWpaSuppDriver('wext'))
-        mock_syscall.assert_called_once()
+        mock_tools.probe.assert_called_once()
+        self.assertEqual(mock_tools.probe.call_args[1], {'key': '-Dwext'})
 
     def test_needs_external_calls_not_implemented(self):
         self.assertRaises(NotImplementedError, wnettools.NeedsExternalCalls)
@@ -56,13 +361,63 @@ class TestWnettools(unittest.TestCase):
         interface = wnettools.BaseWirelessInterface('wlan0')
         self.assertEqual(interface._FreqToChannel(freq), 14)
 
-    def test_generate_psk(self):
+    def test_channel_to_freq(self):
+        for channel in (1, 6, 13, 14, 36, 149):
+            freq = ieee80211.ChannelToFreq(str(channel))
+            self.assertEqual(ieee80211.FreqToChannel(freq), channel)
+        self.assertIsNone(ieee80211.ChannelToFreq(None))
+
+    @mock.patch('wicd.misc.Run')
+    def test_generate_psk(self, mock_run):
         interface = wnettools.BaseWirelessInterface('wlan0')
-        if 'wlan0' in wnettools.GetWirelessInterfaces():
-            psk = interface.GeneratePSK({'essid': 'Network 1',
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        cache = psk.PSKCache(os.path.join(tmpdir, 'psk_cache'))
+        with mock.patch('wicd.psk.CACHE', cache):
+            key = interface.GeneratePSK({'essid': 'Network 1',
                                          'key': 'arandompassphrase'})
-            self.assertEqual(psk, 'd70463014514f4b4ebb8e3aebbdec13f4437ac3a9a'
-                             'f084b3433f3710e658a7be')
+        self.assertEqual(key, 'd70463014514f4b4ebb8e3aebbdec13f4437ac3a9a'
+                         'f084b3433f3710e658a7be')
+        self.assertFalse(mock_run.called)
+
+    def test_scan_parser_matches_cell_parser(self):
+        interface = wnettools.BaseWirelessInterface('wlan0')
+        for path in sorted(glob.glob(os.path.join(IWLIST_DIR, '*.txt'))):
+            with open(path) as f:
+                results = f.read()
+            self.assertEqual(interface._ParseScanResults(results, None),
+                             _parse_cells(interface, results), path)
+
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.misc.Run')
+    def test_get_networks(self, mock_syscall, mock_exists):
+        with open(os.path.join(IWLIST_DIR, 'ipw2200.txt')) as f:
+            mock_syscall.return_value = f.read()
+        interface = wnettools.BaseWirelessInterface('wlan0')
+        networks = interface.GetNetworks()
+        self.assertEqual([n['essid'] for n in networks],
+                         ['linksys', 'wepnet', 'hiddenreal'])
+        self.assertEqual(networks[2]['encryption_method'], 'WPA')
+        self.assertEqual(networks[0]['quality'], 83)
+        self.assertEqual(networks[0]['strength'], '-47')
+
+    @mock.patch('wicd.misc.Run')
+    @mock.patch('wicd.wnettools.os.path.exists', return_value=True)
+    @mock.patch('wicd.misc.ParseEncryption', return_value='ap_scan=1\n')
+    @mock.patch('wicd.wpasupplicant.ConfigureNetwork')
+    def test_persistent_supplicant(self, mock_configure, mock_parse,
+                                   mock_exists, mock_run):
+        interface = wnettools.BaseWirelessInterface('wlan0')
+        interface.SetPersistentSupplicant(True)
+        network = {'bssid': '00:1A:2B:3C:4D:5E'}
+        interface.Authenticate(network)
+        mock_configure.assert_called_once_with('wlan0', 'ap_scan=1\n')
+        self.assertFalse(mock_run.called)
+        # It gets started when not running yet.
+        mock_configure.return_value = False
+        interface.Authenticate(network)
+        self.assertEqual(mock_run.call_args[0][0][:3],
+                         ['wpa_supplicant', '-B', '-i'])
 
 
 def suite():
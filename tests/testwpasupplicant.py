@@ -0,0 +1,215 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from wicd import wpasupplicant
+
+
+# SSID "CorpNet", rates 1, 2, 5.5 and 11, DS channel 6 and an RSN element.
+CORPNET_IE = ('0007436f72704e6574' '010482848b96' '030106' '30020100')
+BSS_TABLE = [
+    'id=3\nbssid=00:1a:2b:3c:4d:5e\nfreq=2437\nbeacon_int=100\n'
+    'capabilities=0x0411\nqual=0\nnoise=-95\nlevel=-48\ntsf=0\nage=4\n'
+    'ie=' + CORPNET_IE + '\nflags=[WPA2-PSK-CCMP][ESS]\nssid=CorpNet\n',
+    'id=7\nbssid=00:1a:2b:3c:4d:5f\nfreq=5180\nbeacon_int=100\n'
+    'capabilities=0x0001\nqual=0\nnoise=-95\nlevel=-80\ntsf=0\nage=95\n'
+    'ie=0000\nflags=[ESS]\nssid=\n',
+]
+
+# What misc.ParseEncryption makes out of a WPA passphrase template.
+CORPNET_CONFIG = """ap_scan=1
+ctrl_interface=/var/run/wpa_supplicant
+network={
+       ssid="CorpNet"
+       key_mgmt=WPA-PSK
+       psk="secret 1"
+}
+"""
+
+
+class FakeSupplicant(threading.Thread):
+    """Answer control interface requests from a table of replies."""
+    def __init__(self, ctrl_dir, replies):
+        threading.Thread.__init__(self, daemon=True)
+        self.replies = replies
+        self.requests = []
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(os.path.join(ctrl_dir, 'wlan0'))
+
+    def run(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            command = data.decode()
+            self.requests.append(command)
+            if command == 'QUIT':
+                return
+            # Events may arrive before the reply.
+            self.sock.sendto(b'<3>CTRL-EVENT-SCAN-STARTED ', address)
+            reply = self.replies.get(command, 'FAIL\n')
+            # Several datagrams are sent for a list, e.g. a reply and
+            # the events following it.
+            if isinstance(reply, str):
+                reply = [reply]
+            for message in reply:
+                self.sock.sendto(message.encode(), address)
+
+
+class TestWpaSupplicant(unittest.TestCase):
+    def setUp(self):
+        self.ctrl_dir = tempfile.mkdtemp()
+        self.server = FakeSupplicant(self.ctrl_dir, {
+            'PING': 'PONG\n',
+            'BSS FIRST': BSS_TABLE[0],
+            'BSS NEXT-3': BSS_TABLE[1],
+            'BSS NEXT-7': '',
+        })
+        self.server.start()
+
+    def tearDown(self):
+        with wpasupplicant.WpaCtrl('wlan0', self.ctrl_dir) as wpa:
+            wpa.sock.send(b'QUIT')
+        self.server.join()
+        self.server.sock.close()
+        shutil.rmtree(self.ctrl_dir)
+
+    def test_request(self):
+        with wpasupplicant.WpaCtrl('wlan0', self.ctrl_dir) as wpa:
+            self.assertEqual(wpa.request('PING'), 'PONG\n')
+            local_path = wpa.local_path
+        self.assertFalse(os.path.exists(local_path))
+
+    def test_bss_table(self):
+        with wpasupplicant.WpaCtrl('wlan0', self.ctrl_dir) as wpa:
+            table = wpa.bss_table()
+        self.assertEqual([bss['id'] for bss in table], ['3', '7'])
+        self.assertEqual(self.server.requests,
+                         ['BSS FIRST', 'BSS NEXT-3', 'BSS NEXT-7'])
+
+    def test_bss_networks(self):
+        networks = wpasupplicant.GetBSSNetworks('wlan0', 30, self.ctrl_dir)
+        self.assertEqual(networks, [{
+            'bssid': '00:1A:2B:3C:4D:5E', 'essid': 'CorpNet',
+            'hidden': False, 'channel': 6, 'mode': 'Master',
+            'encryption': True, 'encryption_method': 'WPA2',
+            'bitrates': ['1', '2', '5.5', '11'], 'quality': 100,
+            'strength': '-48'}])
+        all_networks = wpasupplicant.GetBSSNetworks('wlan0', 120,
+                                                    self.ctrl_dir)
+        self.assertTrue(all_networks[1]['hidden'])
+        self.assertEqual(all_networks[1]['channel'], 36)
+
+    def test_scan_frequencies(self):
+        self.server.replies.update({
+            'ATTACH': 'OK\n',
+            'SCAN freq=2437,5180': ['OK\n', '<3>CTRL-EVENT-BSS-ADDED 3',
+                                    '<3>CTRL-EVENT-SCAN-RESULTS '],
+            'BSS FIRST': BSS_TABLE[0].replace('age=4', 'age=0'),
+            'BSS NEXT-3': BSS_TABLE[1].replace('age=95', 'age=0'),
+        })
+        networks = wpasupplicant.ScanFrequencies('wlan0', [2437, 5180],
+                                                 ctrl_dir=self.ctrl_dir)
+        self.assertEqual([ap['channel'] for ap in networks], [6, 36])
+        # Only the given frequencies are kept.
+        self.server.replies['SCAN freq=2437'] = \
+            self.server.replies['SCAN freq=2437,5180']
+        networks = wpasupplicant.ScanFrequencies('wlan0', [2437],
+                                                 ctrl_dir=self.ctrl_dir)
+        self.assertEqual([ap['channel'] for ap in networks], [6])
+
+    def test_scan_frequencies_refused(self):
+        self.server.replies['ATTACH'] = 'OK\n'
+        self.assertIsNone(wpasupplicant.ScanFrequencies(
+            'wlan0', [2437], ctrl_dir=self.ctrl_dir))
+        self.assertEqual(self.server.requests[-1], 'SCAN freq=2437')
+
+    def test_validate_authentication(self):
+        self.server.replies.update({
+            'ATTACH': 'OK\n',
+            'STATUS': ['wpa_state=ASSOCIATING\n',
+                       '<3>CTRL-EVENT-CONNECTED - Connection to '
+                       '00:1a:2b:3c:4d:5e completed [id=0 id_str=]'],
+        })
+        start = time.monotonic()
+        self.assertTrue(wpasupplicant.ValidateAuthentication(
+            'wlan0', time.time(), ctrl_dir=self.ctrl_dir))
+        # The event was acted upon, not the next state poll.
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual(self.server.requests, ['ATTACH', 'STATUS'])
+
+    def test_validate_authentication_failed(self):
+        self.server.replies.update({
+            'ATTACH': 'OK\n',
+            'STATUS': ['wpa_state=4WAY_HANDSHAKE\n',
+                       '<3>CTRL-EVENT-SSID-TEMP-DISABLED id=0 ssid="CorpNet" '
+                       'auth_failures=1 duration=10 reason=WRONG_KEY'],
+        })
+        self.assertFalse(wpasupplicant.ValidateAuthentication(
+            'wlan0', time.time(), ctrl_dir=self.ctrl_dir))
+        # No supplicant to ask.
+        self.assertFalse(wpasupplicant.ValidateAuthentication(
+            'wlan1', time.time(), max_time=0.2, ctrl_dir=self.ctrl_dir))
+
+    def test_configure_network(self):
+        self.server.replies.update(dict.fromkeys([
+            'AP_SCAN 1', 'REMOVE_NETWORK all', 'SET_NETWORK 2 ssid "CorpNet"',
+            'SET_NETWORK 2 key_mgmt WPA-PSK', 'SET_NETWORK 2 psk "secret 1"',
+            'SELECT_NETWORK 2'], 'OK\n'))
+        self.server.replies['ADD_NETWORK'] = '2\n'
+        self.assertTrue(wpasupplicant.ConfigureNetwork(
+            'wlan0', CORPNET_CONFIG, self.ctrl_dir))
+        self.assertEqual(self.server.requests, [
+            'AP_SCAN 1', 'REMOVE_NETWORK all', 'ADD_NETWORK',
+            'SET_NETWORK 2 ssid "CorpNet"', 'SET_NETWORK 2 key_mgmt WPA-PSK',
+            'SET_NETWORK 2 psk "secret 1"', 'SELECT_NETWORK 2'])
+        # A refused setting fails the whole network.
+        del self.server.replies['SET_NETWORK 2 psk "secret 1"']
+        self.assertRaises(wpasupplicant.WpaCtrlError,
+                          wpasupplicant.ConfigureNetwork, 'wlan0',
+                          CORPNET_CONFIG, self.ctrl_dir)
+        # Nothing to configure without a running supplicant.
+        self.assertFalse(wpasupplicant.ConfigureNetwork(
+            'wlan1', CORPNET_CONFIG, self.ctrl_dir))
+
+    def test_terminate(self):
+        self.server.replies['TERMINATE'] = 'OK\n'
+        path = os.path.join(self.ctrl_dir, 'wlan0')
+        # Still shutting down.
+        self.assertFalse(wpasupplicant.Terminate('wlan0', 0.2, self.ctrl_dir))
+        self.assertIn('TERMINATE', self.server.requests)
+        # Gone a little later.
+        moved = path + '.gone'
+        timer = threading.Timer(0.2, os.rename, (path, moved))
+        timer.start()
+        try:
+            self.assertTrue(wpasupplicant.Terminate('wlan0', 2,
+                                                    self.ctrl_dir))
+        finally:
+            timer.join()
+            os.rename(moved, path)
+        self.assertTrue(wpasupplicant.Terminate('wlan1', 2, self.ctrl_dir))
+
+    def test_stale_table(self):
+        self.assertIsNone(wpasupplicant.GetBSSNetworks('wlan0', 2,
+                                                       self.ctrl_dir))
+        self.assertIsNone(wpasupplicant.GetBSSNetworks('wlan1', 30,
+                                                       self.ctrl_dir))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [tests.append(test) for test in dir(TestWpaSupplicant)
+     if test.startswith('test')]
+    for test in tests:
+        suite.addTest(TestWpaSupplicant(test))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
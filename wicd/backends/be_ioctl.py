@@ -32,7 +32,6 @@ class WirelessInterface() -- Control a wireless network interface.
 
 import array
 import fcntl
-import os
 import socket
 import struct
 import time
@@ -57,12 +56,6 @@ except ImportError:
     print("WARNING: python-iwscan not found, falling back to using iwlist "
           "scan.")
     IWSCAN_AVAIL = False
-try:
-    import wpactrl
-    WPACTRL_AVAIL = True
-except ImportError:
-    print("WARNING: python-wpactrl not found, falling back to using wpa_cli.")
-    WPACTRL_AVAIL = False
 
 
 NAME = "ioctl"
@@ -74,7 +67,6 @@ network information whenever possible.  This makes it fast,
 but it may not work properly on all systems.
 
 (Optional) Dependencies:
-python-wpactrl (http://projects.otaku42.de/wiki/PythonWpaCtrl)
 python-iwscan (http://projects.otaku42.de/browser/python-iwscan/)"""
 
 RALINK_DRIVER = 'ralink legacy'
@@ -86,6 +78,7 @@ SIOCGIWRANGE = 0x8B0B
 SIOCGIWAP = 0x8B15
 SIOCGIWSTATS = 0x8B0F
 SIOCGIWRATE = 0x8B21
+IW_ESSID_MAX_SIZE = 32
 
 # Got these from /usr/include/sockios.h
 SIOCGIFADDR = 0x8915
@@ -94,29 +87,166 @@ SIOCGMIIPHY = 0x8947
 SIOCETHTOOL = 0x8946
 SIOCGIFFLAGS = 0x8913
 
+# Got these from /usr/include/linux/ethtool.h and mii.h
+ETHTOOL_GLINK = 0x0000000a
+MII_BMSR = 0x01
+BMSR_LSTATUS = 0x0004
+
+IFNAMSIZ = 16
+IFF_UP = 0x1
+
+# struct ifreq and struct iwreq share the 16 byte name; the union after
+# it is 24 bytes at most.
+IFREQ_SIZE = 40
+# struct iw_statistics.
+IW_STATS_SIZE = 32
+# Larger than struct iw_range of any wireless extensions version.
+IW_RANGE_SIZE = 2048
+
+# The parts of the request unions we use, after the interface name.
+_iw_point = struct.Struct('16sPHH')         # pointer, length, flags
+_iw_param = struct.Struct('16siBBH')        # value, fixed, disabled, flags
+_sockaddr = struct.Struct('16sH14s')        # family, data
+_sockaddr_in = struct.Struct('16sHH4s')     # family, port, address
+_ifr_flags = struct.Struct('16sH')
+_ifr_data = struct.Struct('16sP')
+_mii_data = struct.Struct('16sHHHH')        # phy_id, reg_num, val_in, val_out
+_iw_quality = struct.Struct('BBBB')         # qual, level, noise, updated
+# Offsets in struct iw_range.
+_RANGE_MAX_QUAL = 44
+_RANGE_NUM_BITRATES = 52
+_range_bitrates = struct.Struct('32i')
+_RANGE_BITRATES = 56
+
+
+class IoctlSocket(object):
+    """Query an interface through ioctls.
+
+    A single datagram socket and the buffers the kernel fills in are
+    allocated once and reused for every call, and the requests are
+    packed only when the interface changes.  The ioctls run in place on
+    those buffers, so a query neither forks nor allocates much.
 
-def get_iw_ioctl_result(iface, call):
-    """Makes the given ioctl call and returns the results.
+    """
+    def __init__(self, iface):
+        """Open the socket.
 
-    Keyword arguments:
-    call -- The ioctl call to make
+        Keyword arguments:
+        iface -- the name of the interface
 
-    Returns:
-    The results of the ioctl call.
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._essid = array.array('B', bytes(IW_ESSID_MAX_SIZE + 1))
+        self._stats = array.array('B', bytes(IW_STATS_SIZE))
+        self._range = array.array('B', bytes(IW_RANGE_SIZE))
+        self._ethtool = array.array('I', [ETHTOOL_GLINK, 0])
+        self._requests = {}
+        self.iface = None
+        self.set_iface(iface)
+
+    def set_iface(self, iface):
+        """Point the requests at another interface."""
+        self.iface = iface
+        name = (iface or '').encode('utf-8')[:IFNAMSIZ - 1]
+        self._requests = {}
+        for request in (SIOCGIWAP, SIOCGIWRATE, SIOCGIFFLAGS, SIOCGIFADDR,
+                        SIOCGIFHWADDR, SIOCGMIIPHY):
+            req = bytearray(IFREQ_SIZE)
+            req[:len(name)] = name
+            self._requests[request] = req
+        for request, buff in ((SIOCGIWESSID, self._essid),
+                              (SIOCGIWSTATS, self._stats),
+                              (SIOCGIWRANGE, self._range)):
+            req = bytearray(IFREQ_SIZE)
+            address, length = buff.buffer_info()
+            _iw_point.pack_into(req, 0, name, address, length, 0)
+            self._requests[request] = req
+        req = bytearray(IFREQ_SIZE)
+        _ifr_data.pack_into(req, 0, name, self._ethtool.buffer_info()[0])
+        self._requests[SIOCETHTOOL] = req
+
+    def close(self):
+        """Close the socket."""
+        self.sock.close()
+
+    def _ioctl(self, request):
+        """Run an ioctl on its (reused) request buffer.
+
+        Raises OSError if the ioctl fails.
 
-    """
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    buff = array.array('c', '\0' * 32)
-    addr, length = buff.buffer_info()
-    arg = struct.pack('Pi', addr, length)
-    data = (iface + '\0' * 16)[:16] + arg
-    try:
-        result = fcntl.ioctl(s.fileno(), call, data)
-    except IOError:
-        return None
-    except OSError:
-        return None
-    return buff.tostring()
+        Returns:
+        The request buffer, as filled in by the kernel.
+
+        """
+        req = self._requests[request]
+        fcntl.ioctl(self.sock.fileno(), request, req, True)
+        return req
+
+    def _point_ioctl(self, request, buff):
+        """Run an ioctl filling in buff, returning the length used."""
+        # The kernel overwrites the length with the one it used.
+        req = self._requests[request]
+        _iw_point.pack_into(req, 0, req[:IFNAMSIZ], buff.buffer_info()[0],
+                            len(buff), 0)
+        return _iw_point.unpack_from(self._ioctl(request))[2]
+
+    def get_essid(self):
+        """Return the ESSID (as bytes) the interface is associated to."""
+        length = self._point_ioctl(SIOCGIWESSID, self._essid)
+        return memoryview(self._essid)[:length].tobytes().rstrip(b'\0')
+
+    def get_ap(self):
+        """Return the (6 byte) address of the access point."""
+        return _sockaddr.unpack_from(self._ioctl(SIOCGIWAP))[2][:6]
+
+    def get_stats(self):
+        """Return the (quality, level, noise, updated) of the link."""
+        self._point_ioctl(SIOCGIWSTATS, self._stats)
+        # The quality follows the 16 bit status.
+        return _iw_quality.unpack_from(self._stats, 2)
+
+    def get_rate(self):
+        """Return the current bitrate, in bit/s."""
+        return _iw_param.unpack_from(self._ioctl(SIOCGIWRATE))[1]
+
+    def get_range(self):
+        """Return the maximum quality and the bitrates the card supports.
+
+        Returns:
+        A ((quality, level, noise, updated), [bitrate, ...]) tuple, the
+        bitrates in bit/s.
+
+        """
+        self._point_ioctl(SIOCGIWRANGE, self._range)
+        max_qual = _iw_quality.unpack_from(self._range, _RANGE_MAX_QUAL)
+        count = min(self._range[_RANGE_NUM_BITRATES], 32)
+        rates = _range_bitrates.unpack_from(self._range, _RANGE_BITRATES)
+        return max_qual, list(rates[:count])
+
+    def get_flags(self):
+        """Return the IFF_* flags of the interface."""
+        return _ifr_flags.unpack_from(self._ioctl(SIOCGIFFLAGS))[1]
+
+    def get_addr(self):
+        """Return the (4 byte) IPv4 address of the interface."""
+        return _sockaddr_in.unpack_from(self._ioctl(SIOCGIFADDR))[3]
+
+    def get_hwaddr(self):
+        """Return the (6 byte) hardware address of the interface."""
+        return _sockaddr.unpack_from(self._ioctl(SIOCGIFHWADDR))[2][:6]
+
+    def get_ethtool_link(self):
+        """Return True if ethtool reports a link."""
+        self._ethtool[0] = ETHTOOL_GLINK
+        self._ioctl(SIOCETHTOOL)
+        return bool(self._ethtool[1])
+
+    def get_mii_link(self):
+        """Return True if the MII status register reports a link."""
+        req = self._requests[SIOCGMIIPHY]
+        _mii_data.pack_into(req, 0, req[:IFNAMSIZ], 0, MII_BMSR, 0, 0)
+        return bool(_mii_data.unpack_from(self._ioctl(SIOCGMIIPHY))[4] &
+                    BMSR_LSTATUS)
 
 
 def NeedsExternalCalls(*args, **kargs):
@@ -135,13 +265,18 @@ class Interface(BaseInterface):
 
         """
         BaseInterface.__init__(self, iface, verbose)
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.ioctl = IoctlSocket(self.iface)
         self.Check()
 
-    def CheckWirelessTools(self):
-        """Check for the existence needed wireless tools"""
-        if not WPACTRL_AVAIL:
-            BaseInterface.CheckWirelessTools(self)
+    def SetInterface(self, iface):
+        """Sets the interface.
+
+        Keyword arguments:
+        iface -- the name of the interface.
+
+        """
+        BaseInterface.SetInterface(self, iface)
+        self.ioctl.set_iface(self.iface)
 
     @neediface("")
     def GetIP(self, ifconfig=""):
@@ -151,16 +286,11 @@ class Interface(BaseInterface):
         The IP address of the interface in dotted quad form.
 
         """
-        ifstruct = struct.pack('256s', self.iface)
         try:
-            raw_ip = fcntl.ioctl(self.sock.fileno(), SIOCGIFADDR, ifstruct)
-        except IOError:
-            return None
+            return socket.inet_ntoa(self.ioctl.get_addr())
         except OSError:
             return None
 
-        return socket.inet_ntoa(raw_ip[20:24])
-
     @neediface(False)
     def IsUp(self, ifconfig=None):
         """Determines if the interface is up.
@@ -169,16 +299,13 @@ class Interface(BaseInterface):
         True if the interface is up, False otherwise.
 
         """
-        data = (self.iface + '\0' * 16)[:18]
         try:
-            result = fcntl.ioctl(self.sock.fileno(), SIOCGIFFLAGS, data)
-        except IOError as e:
+            flags = self.ioctl.get_flags()
+        except OSError as e:
             if self.verbose:
                 print(("SIOCGIFFLAGS failed: " + str(e)))
             return False
-
-        flags, = struct.unpack('H', result[16:18])
-        return bool(flags & 1)
+        return bool(flags & IFF_UP)
 
 
 class WiredInterface(Interface, BaseWiredInterface):
@@ -226,17 +353,12 @@ class WiredInterface(Interface, BaseWiredInterface):
         if not self.IsUp():
             self.Up()
             time.sleep(5)
-        buff = array.array('i', [0x0000000a, 0x00000000])
-        addr, length = buff.buffer_info()
-        arg = struct.pack('Pi', addr, length)
-        data = (self.iface + '\0' * 16)[:16] + arg
         try:
-            fcntl.ioctl(self.sock.fileno(), SIOCETHTOOL, data)
-        except IOError as e:
+            return self.ioctl.get_ethtool_link()
+        except OSError as e:
             if self.verbose:
                 print(('SIOCETHTOOL failed: ' + str(e)))
             return False
-        return bool(buff.tolist()[1])
 
     def _mii_get_plugged_in(self):
         """Use mii-tool to determine the physical connection state.
@@ -248,16 +370,12 @@ class WiredInterface(Interface, BaseWiredInterface):
         if not self.IsUp():
             self.Up()
             time.sleep(2.5)
-        buff = struct.pack('16shhhh', (self.iface + '\0' * 16)[:16], 0, 1,
-                           0x0004, 0)
         try:
-            result = fcntl.ioctl(self.sock.fileno(), SIOCGMIIPHY, buff)
-        except IOError as e:
+            return self.ioctl.get_mii_link()
+        except OSError as e:
             if self.verbose:
                 print(('SIOCGMIIPHY failed: ' + str(e)))
             return False
-        reg = struct.unpack('16shhhh', result)[-1]
-        return bool(reg & 0x0004)
 
 
 class WirelessInterface(Interface, BaseWirelessInterface):
@@ -276,11 +394,11 @@ class WirelessInterface(Interface, BaseWirelessInterface):
         self.CheckWirelessTools()
 
     @neediface([])
-    def GetNetworks(self, essid=None):
+    def GetNetworks(self, essid=None, freqs=None):
         """Get a list of available wireless networks.
 
-        NOTE: the essid parameter is not used here,
-        it was added for the iwlist scan for hidden networks.
+        NOTE: the essid and freqs parameters are not used here,
+        they were added for the iwlist and nl80211 scans.
 
         Returns:
         A list containing available wireless networks.
@@ -357,97 +475,6 @@ class WirelessInterface(Interface, BaseWirelessInterface):
 
         return ap
 
-    def _connect_to_wpa_ctrl_iface(self):
-        """Connect to the wpa ctrl interface."""
-        ctrl_iface = '/var/run/wpa_supplicant'
-        socket_loc = os.path.join(ctrl_iface, self.iface)
-        if os.path.exists(socket_loc):
-            try:
-                return wpactrl.WPACtrl(socket_loc)
-            except wpactrl.error as e:
-                print(("Couldn't open ctrl_interface: %s" % e))
-                return None
-        else:
-            print(f"Couldn't find a wpa_supplicant ctrl_interface for iface "
-                  f"{self.iface}")
-            return None
-
-    def ValidateAuthentication(self, auth_time):
-        """Validate WPA authentication.
-
-            Validate that the wpa_supplicant authentication
-            process was successful.
-
-            NOTE: It's possible this could return False,
-            though in reality wpa_supplicant just isn't
-            finished yet.
-
-            Keyword arguments:
-            auth_time -- The time at which authentication began.
-
-            Returns:
-            True if wpa_supplicant authenticated succesfully,
-            False otherwise.
-
-        """
-        if not WPACTRL_AVAIL:
-            # If we don't have python-wpactrl, use the slow version.
-            return BaseWirelessInterface.ValidateAuthentication(self,
-                                                                auth_time)
-
-        # Right now there's no way to do this for ralink drivers
-        if self.wpa_driver == RALINK_DRIVER:
-            return True
-
-        wpa = self._connect_to_wpa_ctrl_iface()
-        if not wpa:
-            print("Failed to open ctrl interface")
-            return False
-
-        MAX_TIME = 35
-        MAX_DISCONNECTED_TIME = 3
-        disconnected_time = 0
-        while (time.time() - auth_time) < MAX_TIME:
-            try:
-                status = wpa.request("STATUS").split("\n")
-            except Exception:
-                print("wpa_supplicant status query failed.")
-                return False
-
-            if self.verbose:
-                print(f'wpa_supplicant ctrl_interface status query is '
-                      f'{status}')
-
-            try:
-                [result] = [s for s in status if s.startswith("wpa_state=")]
-            except ValueError:
-                return False
-
-            if result.endswith("COMPLETED"):
-                return True
-            elif result.endswith("DISCONNECTED"):
-                disconnected_time += 1
-                if disconnected_time > MAX_DISCONNECTED_TIME:
-                    # Force a rescan to get wpa_supplicant moving again.
-                    wpa.request("SCAN")
-                    MAX_TIME += 5
-            else:
-                disconnected_time = 0
-            time.sleep(1)
-
-        print('wpa_supplicant authentication may have failed.')
-        return False
-
-    @neediface(False)
-    def StopWPA(self):
-        """Terminates wpa_supplicant using its ctrl interface."""
-        if not WPACTRL_AVAIL:
-            return BaseWirelessInterface.StopWPA(self)
-        wpa = self._connect_to_wpa_ctrl_iface()
-        if not wpa:
-            return
-        wpa.request("TERMINATE")
-
     def _AuthenticateRalinkLegacy(self, network):
         """Authenticate with the specified wireless network.
 
@@ -512,30 +539,45 @@ class WirelessInterface(Interface, BaseWirelessInterface):
     @neediface("")
     def GetBSSID(self, iwconfig=None):
         """Get the MAC address for the interface."""
-        data = (self.iface + '\0' * 32)[:32]
         try:
-            result = fcntl.ioctl(self.sock.fileno(), SIOCGIWAP, data)[16:]
-        except IOError as e:
+            raw_addr = self.ioctl.get_ap()
+        except OSError as e:
             if self.verbose:
                 print(("SIOCGIWAP failed: " + str(e)))
             return ""
-        raw_addr = struct.unpack("xxBBBBBB", result[:8])
-        return "%02X:%02X:%02X:%02X:%02X:%02X" % raw_addr
+        return "%02X:%02X:%02X:%02X:%02X:%02X" % tuple(raw_addr)
 
     @neediface("")
     def GetCurrentBitrate(self, iwconfig=None):
         """Get the current bitrate for the interface."""
-        data = (self.iface + '\0' * 32)[:32]
-        fmt = "ihbb"
-        size = struct.calcsize(fmt)
         try:
-            result = fcntl.ioctl(self.sock.fileno(), SIOCGIWRATE, data)[16:]
-        except IOError as e:
+            rate = self.ioctl.get_rate()
+        except OSError as e:
             if self.verbose:
                 print(("SIOCGIWRATE failed: " + str(e)))
             return ""
-        f, e, x, x = struct.unpack(fmt, result[:size])
-        return "%s %s" % ((f / 1000000), 'Mb/s')
+        return "%g %s" % ((rate / 1000000), 'Mb/s')
+
+    @neediface([])
+    def GetAvailableBitrates(self):
+        """Get the available bitrates the wifi card can use."""
+        try:
+            rates = self.ioctl.get_range()[1]
+        except OSError as e:
+            if self.verbose:
+                print(("SIOCGIWRANGE failed: " + str(e)))
+            return BaseWirelessInterface.GetAvailableBitrates(self)
+        return ['%g' % (rate / 1000000) for rate in rates]
+
+    def GetAvailableBitratesAsync(self, callback):
+        """Get the available bitrates without blocking."""
+        try:
+            rates = self.ioctl.get_range()[1]
+        except OSError:
+            # Falls back to iwlist, or answers '' without an interface.
+            BaseWirelessInterface.GetAvailableBitratesAsync(self, callback)
+            return
+        callback(['%g' % (rate / 1000000) for rate in rates])
 
     # def GetOperationalMode(self, iwconfig=None):
     #     """ Get the operational mode for the interface."""
@@ -555,35 +597,25 @@ class WirelessInterface(Interface, BaseWirelessInterface):
         The signal strength.
 
         """
-        buff = get_iw_ioctl_result(self.iface, SIOCGIWSTATS)
-        strength = ord(buff[2])
-        max_strength = self._get_max_strength()
-        if strength not in ['', None] and max_strength:
-            return 100 * int(strength) // int(max_strength)
-        elif strength not in ['', None]:
-            return int(strength)
-        else:
+        try:
+            strength = self.ioctl.get_stats()[0]
+        except OSError as e:
+            if self.verbose:
+                print(("SIOCGIWSTATS failed: " + str(e)))
             return None
+        max_strength = self._get_max_strength()
+        if max_strength:
+            return 100 * strength // max_strength
+        return strength
 
     def _get_max_strength(self):
         """Gets the maximum possible strength from the wireless driver."""
-        buff = array.array('c', '\0' * 700)
-        addr, length = buff.buffer_info()
-        arg = struct.pack('Pi', addr, length)
-        iwfreq = (self.iface + '\0' * 16)[:16] + arg
         try:
-            result = fcntl.ioctl(self.sock.fileno(), SIOCGIWRANGE, iwfreq)
-        except IOError as e:
+            return self.ioctl.get_range()[0][0]
+        except OSError as e:
             if self.verbose:
                 print(("SIOCGIWRANGE failed: " + str(e)))
             return None
-        # This defines the iwfreq struct, used to get signal strength.
-        fmt = "iiihb6ii4B4Bi32i2i2i2i2i3h8h2b2bhi8i2b3h2i2ihB17x" + 32 * "ihbb"
-        size = struct.calcsize(fmt)
-        data = buff.tostring()
-        data = data[0:size]
-        values = struct.unpack(fmt, data)
-        return values[12]
 
     @neediface(-100)
     def GetDBMStrength(self, iwconfig=None):
@@ -593,11 +625,12 @@ class WirelessInterface(Interface, BaseWirelessInterface):
         The dBm signal strength.
 
         """
-        buff = get_iw_ioctl_result(self.iface, SIOCGIWSTATS)
-        if not buff:
+        try:
+            level = self.ioctl.get_stats()[1]
+        except OSError:
             return None
-
-        return str((ord(buff[3]) - 256))
+        # The level is a signed dBm value stored in an unsigned byte.
+        return str(level - 256)
 
     @neediface("")
     def GetCurrentNetwork(self, iwconfig=None):
@@ -607,8 +640,8 @@ class WirelessInterface(Interface, BaseWirelessInterface):
         The current network essid.
 
         """
-        buff = get_iw_ioctl_result(self.iface, SIOCGIWESSID)
-        if not buff:
+        try:
+            essid = self.ioctl.get_essid()
+        except OSError:
             return None
-
-        return buff.strip('\x00')
+        return essid.decode('utf-8', 'replace')
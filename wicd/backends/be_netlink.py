@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""netlink Network interface control tools for wicd.
+
+This module implements functions to control and obtain information from
+network interfaces.  Scanning and wireless status queries go straight to
+the kernel over nl80211 instead of running iwlist and iwconfig.
+
+class Interface() -- Control a network interface.
+class WiredInterface() -- Control a wired network interface.
+class WirelessInterface() -- Control a wireless network interface.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import errno
+import socket
+import struct
+
+from wicd import misc
+from wicd import netlink
+from wicd.ieee80211 import DbmToQuality
+from wicd.ieee80211 import MakeAccessPoint
+from wicd.wnettools import BaseInterface
+from wicd.wnettools import BaseWiredInterface
+from wicd.wnettools import BaseWirelessInterface
+from wicd.wnettools import GetDefaultGateway
+from wicd.wnettools import GetWiredInterfaces
+from wicd.wnettools import GetWirelessInterfaces
+from wicd.wnettools import GetWpaSupplicantDrivers
+from wicd.wnettools import IWCONFIG_TTL
+from wicd.wnettools import IsValidWpaSuppDriver
+from wicd.wnettools import neediface
+from wicd.wnettools import timedcache
+
+
+NAME = "netlink"
+UPDATE_INTERVAL = 4
+DESCRIPTION = """Netlink backend
+
+This backend talks to the kernel over nl80211 to scan for
+wireless networks and to query the signal strength, bitrate
+and access point of the current connection, so no iwlist or
+iwconfig process is started for scans and status polls.
+It needs a driver using the cfg80211 stack, which covers
+all in-tree drivers.
+"""
+
+# How long to wait for the kernel to finish a scan.
+SCAN_TIMEOUT = 15
+
+_IFTYPE_MODES = {netlink.NL80211_IFTYPE_ADHOC: 'Ad-Hoc',
+                 netlink.NL80211_IFTYPE_STATION: 'Managed',
+                 netlink.NL80211_IFTYPE_AP: 'Master',
+                 netlink.NL80211_IFTYPE_MONITOR: 'Monitor'}
+
+
+def NeedsExternalCalls(*args, **kargs):
+    """Return False, since this backend doesn't use iwconfig/ifconfig."""
+    return False
+
+
+def ParseBSS(bss):
+    """Turn the NL80211_BSS_* attributes of a scan result into an AP dict.
+
+    Keyword arguments:
+    bss -- dict containing the attributes of a single BSS
+
+    Returns:
+    A dictionary containing the network properties, or None if the
+    result lacks a BSSID.
+
+    """
+    if netlink.NL80211_BSS_BSSID not in bss:
+        return None
+    ies = bss.get(netlink.NL80211_BSS_INFORMATION_ELEMENTS,
+                  bss.get(netlink.NL80211_BSS_BEACON_IES, b''))
+    mbm = netlink.get_s32(bss, netlink.NL80211_BSS_SIGNAL_MBM)
+    dbm = mbm // 100 if mbm is not None else None
+    quality = netlink.get_u8(bss, netlink.NL80211_BSS_SIGNAL_UNSPEC)
+    return MakeAccessPoint(netlink.format_mac(bss[netlink.NL80211_BSS_BSSID]),
+                           netlink.get_u32(bss, netlink.NL80211_BSS_FREQUENCY,
+                                           0),
+                           netlink.get_u16(bss, netlink.NL80211_BSS_CAPABILITY,
+                                           0),
+                           ies, dbm, quality)
+
+
+class Interface(BaseInterface):
+    """Control a network interface."""
+    def __init__(self, iface, verbose=False):
+        """Initialise the object.
+
+        Keyword arguments:
+        iface -- the name of the interface
+        verbose -- whether to print every command run
+
+        """
+        BaseInterface.__init__(self, iface, verbose)
+        self.Check()
+
+
+class WiredInterface(Interface, BaseWiredInterface):
+    """Control a wired network interface."""
+    def __init__(self, iface, verbose=False):
+        """Initialise the wired network interface class.
+
+        Keyword arguments:
+        iface -- name of the interface
+        verbose -- print all commands
+
+        """
+        BaseWiredInterface.__init__(self, iface, verbose)
+        Interface.__init__(self, iface, verbose)
+
+
+class WirelessInterface(Interface, BaseWirelessInterface):
+    """Control a wireless network interface."""
+    def __init__(self, iface, verbose=False, wpa_driver='nl80211'):
+        """Initialise the wireless network interface class.
+
+        Keyword arguments:
+        iface -- name of the interface
+        verbose -- print all commands
+
+        """
+        BaseWirelessInterface.__init__(self, iface, verbose, wpa_driver)
+        Interface.__init__(self, iface, verbose)
+        self.nl = None
+        self.scans_frequencies = True
+
+    def _nl80211(self):
+        """Return the nl80211 socket, opening it if needed."""
+        if self.nl is None:
+            self.nl = netlink.Nl80211Socket()
+        return self.nl
+
+    def _ifindex(self):
+        """Return the index of the interface."""
+        return socket.if_nametoindex(self.iface)
+
+    @timedcache(IWCONFIG_TTL)
+    def _GetAssociatedBSS(self):
+        """Return the scan entry of the BSS we are associated with.
+
+        Finding it means dumping the whole scan table, so it is cached
+        like the output of iwconfig, for the status getters of a poll
+        to share.
+
+        Returns:
+        A dict containing the NL80211_BSS_* attributes, or None.
+
+        """
+        try:
+            results = self._nl80211().get_scan(self._ifindex())
+        except OSError as e:
+            if self.verbose:
+                print("NL80211_CMD_GET_SCAN failed: " + str(e))
+            return None
+        for bss in results:
+            if netlink.get_u32(bss, netlink.NL80211_BSS_STATUS) in \
+               (netlink.NL80211_BSS_STATUS_ASSOCIATED,
+                    netlink.NL80211_BSS_STATUS_IBSS_JOINED):
+                return bss
+        return None
+
+    @timedcache(IWCONFIG_TTL)
+    def _GetStationInfo(self):
+        """Return the station information of the current access point.
+
+        Returns:
+        A dict containing the NL80211_STA_INFO_* attributes.
+
+        """
+        bss = self._GetAssociatedBSS()
+        if bss is None or netlink.NL80211_BSS_BSSID not in bss:
+            return {}
+        try:
+            return self._nl80211().get_station(
+                self._ifindex(), bss[netlink.NL80211_BSS_BSSID])
+        except OSError as e:
+            if self.verbose:
+                print("NL80211_CMD_GET_STATION failed: " + str(e))
+            return {}
+
+    @neediface([])
+    def GetNetworks(self, essid=None, freqs=None):
+        """Get a list of available wireless networks.
+
+        Keyword arguments:
+        essid -- hidden essid to probe for, if any
+        freqs -- frequencies (MHz) to limit the scan to, all if None
+
+        Returns:
+        A list containing available wireless networks.
+
+        """
+        essid = misc.Noneify(essid)
+        ssids = [essid] if essid is not None else []
+        try:
+            ifindex = self._ifindex()
+            nl = self._nl80211()
+            # Subscribe before triggering the scan, so that the end of
+            # the scan can't slip by.
+            events = netlink.Nl80211Socket()
+        except OSError as e:
+            print('GetNetworks caught an exception: ' + str(e))
+            return []
+        try:
+            events.join_group(netlink.NL80211_GENL_NAME,
+                              netlink.NL80211_MULTICAST_GROUP_SCAN)
+            if self.verbose:
+                print('NL80211_CMD_TRIGGER_SCAN on ' + self.iface)
+            try:
+                nl.trigger_scan(ifindex, ssids, freqs or ())
+            except OSError as e:
+                # EBUSY means a scan is already running, so just wait
+                # for it; anything else is fatal.
+                if e.errno != errno.EBUSY:
+                    print('Failed to trigger a scan: ' + str(e))
+                    return []
+            if not events.wait_for_scan(ifindex, SCAN_TIMEOUT):
+                print('Scan was aborted or timed out, using cached results.')
+            results = nl.get_scan(ifindex)
+        except OSError as e:
+            print('GetNetworks caught an exception: ' + str(e))
+            return []
+        finally:
+            events.close()
+
+        access_points = {}
+        for bss in results:
+            entry = ParseBSS(bss)
+            if entry is None:
+                continue
+            # Normally we only get duplicate bssids with hidden
+            # networks.  If we hit this, we only want the entry
+            # with the real essid to be in the network list.
+            if entry['bssid'] not in access_points or not entry['hidden']:
+                access_points[entry['bssid']] = entry
+        return list(access_points.values())
+
+    @neediface("")
+    def GetBSSID(self, iwconfig=None):
+        """Get the MAC address of the current access point."""
+        bss = self._GetAssociatedBSS()
+        if bss is None or netlink.NL80211_BSS_BSSID not in bss:
+            return ""
+        return netlink.format_mac(bss[netlink.NL80211_BSS_BSSID])
+
+    @neediface("")
+    def GetCurrentNetwork(self, iwconfig=None):
+        """Get the essid of the current network.
+
+        Returns:
+        The current network essid.
+
+        """
+        bss = self._GetAssociatedBSS()
+        if bss is None:
+            return ""
+        ap = ParseBSS(bss)
+        if ap is None or ap['hidden']:
+            return ""
+        return ap['essid']
+
+    @neediface("")
+    def GetCurrentBitrate(self, iwconfig=None):
+        """Get the current bitrate for the interface."""
+        info = self._GetStationInfo()
+        if netlink.NL80211_STA_INFO_TX_BITRATE not in info:
+            return ""
+        rate = netlink.unpack_attrs(info[netlink.NL80211_STA_INFO_TX_BITRATE])
+        bitrate = netlink.get_u32(rate, netlink.NL80211_RATE_INFO_BITRATE32)
+        if bitrate is None:
+            bitrate = netlink.get_u16(rate, netlink.NL80211_RATE_INFO_BITRATE)
+        if not bitrate:
+            return ""
+        # The kernel reports the rate in units of 100 kbit/s.
+        return '%g Mb/s' % (bitrate / 10)
+
+    @neediface("")
+    def GetOperationalMode(self, iwconfig=None):
+        """Get the operational mode for the interface."""
+        try:
+            attrs = self._nl80211().get_interface(self._ifindex())
+        except OSError as e:
+            if self.verbose:
+                print("NL80211_CMD_GET_INTERFACE failed: " + str(e))
+            return ""
+        iftype = netlink.get_u32(attrs, netlink.NL80211_ATTR_IFTYPE)
+        return _IFTYPE_MODES.get(iftype, "")
+
+    @neediface(-1)
+    def GetSignalStrength(self, iwconfig=None):
+        """Get the signal strength of the current network.
+
+        Returns:
+        The signal strength.
+
+        """
+        dbm = self.GetDBMStrength()
+        if dbm is None:
+            return None
+        return DbmToQuality(dbm)
+
+    @neediface(-100)
+    def GetDBMStrength(self, iwconfig=None):
+        """Get the dBm signal strength of the current network.
+
+        Returns:
+        The dBm signal strength.
+
+        """
+        info = self._GetStationInfo()
+        if netlink.NL80211_STA_INFO_SIGNAL not in info:
+            return None
+        # The signal is a signed 8 bit value.
+        return str(struct.unpack('=b', info[netlink.NL80211_STA_INFO_SIGNAL]
+                                 [:1])[0])
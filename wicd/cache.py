@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Bounded cache for the output of slow interface queries.
+
+Querying an interface (iwconfig, ifconfig, ...) means running a program,
+and the monitor and the clients ask for the same information many times
+a second.  Results are therefore cached for a short while, per
+interface, and methods that change the state of an interface drop what
+was cached for it.
+
+class TimedCache() -- A size bounded LRU cache with expiring entries.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import threading
+import time
+from collections import OrderedDict
+
+COUNTERS = ('hits', 'misses', 'expired', 'evictions', 'invalidations')
+
+# Returned by get() on a miss, as None is a perfectly valid value.
+MISSING = object()
+
+
+class TimedCache(object):
+    """A size bounded LRU cache with expiring entries.
+
+    Entries live in a namespace (the interface they belong to), have a
+    name (the method that produced them) and a key (its arguments).
+    Once maxsize entries are stored, the least recently used one is
+    evicted.
+
+    """
+    def __init__(self, maxsize=256, clock=time.monotonic):
+        """Initialize the cache.
+
+        Keyword arguments:
+        maxsize -- maximum number of entries kept
+        clock -- function returning the current (monotonic) time
+
+        """
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _count(self, name, counter):
+        """Bump a counter of name (and the total)."""
+        for stats in (self._stats.setdefault(name, dict.fromkeys(COUNTERS, 0)),
+                      self._stats.setdefault(None,
+                                             dict.fromkeys(COUNTERS, 0))):
+            stats[counter] += 1
+
+    def get(self, namespace, name, key, ttl):
+        """Return a cached value, or MISSING.
+
+        Keyword arguments:
+        namespace -- the namespace of the entry
+        name -- the name of the entry
+        key -- hashable key, e.g. the arguments of the call
+        ttl -- seconds the value is good for
+
+        """
+        full_key = (namespace, name, key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is None:
+                self._count(name, 'misses')
+                return MISSING
+            if self._clock() - entry[0] >= ttl:
+                del self._entries[full_key]
+                self._count(name, 'expired')
+                self._count(name, 'misses')
+                return MISSING
+            self._entries.move_to_end(full_key)
+            self._count(name, 'hits')
+            return entry[1]
+
+    def set(self, namespace, name, key, value):
+        """Store a value, evicting the least recently used if full."""
+        full_key = (namespace, name, key)
+        with self._lock:
+            self._entries[full_key] = (self._clock(), value)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.maxsize:
+                evicted = self._entries.popitem(last=False)[0]
+                self._count(evicted[1], 'evictions')
+
+    def invalidate(self, namespace=None, names=None):
+        """Drop cached entries.
+
+        Keyword arguments:
+        namespace -- only drop the entries of this namespace
+        names -- only drop the entries with one of these names
+
+        """
+        with self._lock:
+            for full_key in list(self._entries):
+                if namespace is not None and full_key[0] != namespace:
+                    continue
+                if names is not None and full_key[1] not in names:
+                    continue
+                del self._entries[full_key]
+                self._count(full_key[1], 'invalidations')
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+
+    def stats(self):
+        """Return the cache counters.
+
+        Returns:
+        A dict with the total hits, misses, expired, evictions and
+        invalidations, the same counters per entry name (as
+        'name.counter') and the current and maximum size.
+
+        """
+        with self._lock:
+            stats = {'size': len(self._entries), 'maxsize': self.maxsize}
+            for name, counters in self._stats.items():
+                for counter, value in counters.items():
+                    if name is None:
+                        stats[counter] = value
+                    else:
+                        stats['%s.%s' % (name, counter)] = value
+            for counter in COUNTERS:
+                stats.setdefault(counter, 0)
+            return stats
+
+
+# The cache shared by all interfaces.
+CACHE = TimedCache()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Execution of external commands for wicd.
+
+All the programs wicd runs (ifconfig, iwlist, wpa_cli, dhcp clients...)
+are started from here, with a C locale so their output can be parsed,
+a time limit so a hung tool can't block the daemon forever, a bound on
+how many run at once and counters telling which ones cost the most.
+Read-only queries asked for while the same one runs share its output.
+Commands can also be run without blocking, their output being collected
+by the GLib main loop.
+
+class CommandExecutor() -- Run external commands.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import functools
+import os
+import shutil
+import signal
+import threading
+import time
+from subprocess import Popen, PIPE, STDOUT, TimeoutExpired
+
+from gi.repository import GLib as gobject
+
+# Seconds a command may run for, unless listed in TIMEOUTS.
+DEFAULT_TIMEOUT = 30
+TIMEOUTS = {
+    'iwlist': 60,
+    'ping': 15,
+    'wpa_cli': 10,
+}
+# Seconds between SIGTERM and SIGKILL for a command out of time.
+KILL_GRACE = 2
+# Commands run by run() at the same time.
+MAX_CONCURRENT = 4
+
+COUNTERS = ('calls', 'coalesced', 'failures', 'timeouts', 'time')
+
+
+@functools.lru_cache(maxsize=256)
+def _split(cmd):
+    """Split a command line, the split is cached as most are repeated."""
+    return tuple(cmd.split())
+
+
+def _exit_code(status):
+    """Turn a wait status into a returncode, as Popen sets it."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _call_once(callback, *args):
+    """Call callback from an idle handler, which mustn't repeat."""
+    callback(*args)
+    return False
+
+
+class _Flight(object):
+    """A command run whose output is awaited by other callers."""
+    __slots__ = ('done', 'output')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.output = ""
+
+
+class _AsyncRun(object):
+    """A command run whose output is collected by the GLib main loop."""
+    def __init__(self, executor, argv, process, callback, timeout):
+        """Watch the output and the exit of process.
+
+        Keyword arguments:
+        executor -- the CommandExecutor which started the command
+        argv -- the arguments the command was started with
+        process -- the Popen object of the command
+        callback -- function called with the output once it exited
+        timeout -- seconds the command may run for
+
+        """
+        self.executor = executor
+        self.argv = argv
+        self.process = process
+        self.callback = callback
+        self.start = time.monotonic()
+        self.chunks = []
+        self.timed_out = False
+        self.fd = process.stdout.fileno()
+        os.set_blocking(self.fd, False)
+        self._output_id = gobject.io_add_watch(
+            self.fd, gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR,
+            self._on_output)
+        self._timeout_id = gobject.timeout_add(int(timeout * 1000),
+                                               self._on_timeout, timeout)
+        gobject.child_watch_add(gobject.PRIORITY_DEFAULT, process.pid,
+                                self._on_exit)
+
+    def _read(self):
+        """Read the output available, return False once it's closed."""
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return True
+            if not data:
+                return False
+            self.chunks.append(data)
+
+    def _on_output(self, fd, condition):
+        """Collect the output of the command."""
+        if self._read():
+            return True
+        self._output_id = None
+        return False
+
+    def _on_timeout(self, timeout):
+        """Terminate the command, kill it after the grace period."""
+        print("Command %s didn't finish in %s seconds, killing it" %
+              (str(self.argv), timeout))
+        self.executor._account(self.argv, 'timeouts')
+        self.timed_out = True
+        self._signal(signal.SIGTERM)
+        self._timeout_id = gobject.timeout_add(
+            int(self.executor.kill_grace * 1000), self._on_kill)
+        return False
+
+    def _on_kill(self):
+        """Kill the command if it survived SIGTERM."""
+        self._timeout_id = None
+        self._signal(signal.SIGKILL)
+        return False
+
+    def _signal(self, signum):
+        """Send a signal to the command.
+
+        Popen.send_signal would reap the process, which is left to the
+        GLib child watch.
+
+        """
+        try:
+            os.kill(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _on_exit(self, pid, status):
+        """Hand the output of the command to the callback."""
+        # GLib reaped the process, Popen must not try again.
+        self.process.returncode = _exit_code(status)
+        # Its children may still hold the pipe, don't wait for them.
+        self._read()
+        for source in (self._output_id, self._timeout_id):
+            if source is not None:
+                gobject.source_remove(source)
+        self.process.stdout.close()
+        self.executor._account(self.argv, 'time',
+                               time.monotonic() - self.start)
+        if self.timed_out:
+            output = ""
+        else:
+            output = b''.join(self.chunks).decode('utf-8', 'replace')
+        try:
+            self.callback(output)
+        except Exception as e:
+            print("Handling the output of %s failed: %s" %
+                  (str(self.argv), str(e)))
+
+
+class CommandExecutor(object):
+    """Run external commands.
+
+    The environment (with LC_ALL and LANG set to C) is built once.
+    Programs are looked up in its PATH and started by absolute path
+    without changing directory, which lets subprocess use posix_spawn
+    instead of fork and exec.
+
+    """
+    def __init__(self, max_concurrent=MAX_CONCURRENT, timeouts=None,
+                 default_timeout=DEFAULT_TIMEOUT, kill_grace=KILL_GRACE):
+        """Initialize the executor.
+
+        Keyword arguments:
+        max_concurrent -- commands run() runs at the same time
+        timeouts -- dict of seconds each program may run for
+        default_timeout -- seconds other programs may run for
+        kill_grace -- seconds between SIGTERM and SIGKILL
+
+        """
+        # We need to make sure that the results of the commands we run
+        # are in English.
+        self.env = os.environ.copy()
+        self.env["LC_ALL"] = "C"
+        self.env["LANG"] = "C"
+        self.timeouts = dict(TIMEOUTS if timeouts is None else timeouts)
+        self.default_timeout = default_timeout
+        self.kill_grace = kill_grace
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._stats = {}
+        self._in_flight = {}
+
+    def _which(self, program):
+        """Return the absolute path of program, or program itself."""
+        if os.path.dirname(program):
+            return program
+        path = self._paths.get(program)
+        if path is None:
+            path = shutil.which(program, path=self.env.get('PATH'))
+            if path is None:
+                # Not installed (yet), let Popen complain.
+                return program
+            self._paths[program] = path
+        return path
+
+    def _prepare(self, cmd):
+        """Return the argument list to start cmd with."""
+        if isinstance(cmd, (list, tuple)):
+            argv = [str(arg) for arg in cmd]
+        else:
+            argv = list(_split(str(cmd)))
+        if argv:
+            argv[0] = self._which(argv[0])
+        return argv
+
+    def _account(self, argv, counter, value=1):
+        """Add value to a counter of the program argv runs."""
+        name = os.path.basename(argv[0]) if argv else ''
+        with self._lock:
+            stats = self._stats.setdefault(name, dict.fromkeys(COUNTERS, 0))
+            stats[counter] += value
+
+    def _start(self, argv, include_stderr, stdin):
+        """Start argv, return the Popen object or None on failure."""
+        self._account(argv, 'calls')
+        try:
+            return Popen(argv, shell=False,
+                         stdin=PIPE if stdin else None, stdout=PIPE,
+                         stderr=STDOUT if include_stderr else None,
+                         close_fds=False, env=self.env, encoding='utf-8',
+                         errors='replace')
+        except (OSError, ValueError) as e:
+            self._account(argv, 'failures')
+            print("Running command %s failed: %s" % (str(argv), str(e)))
+            return None
+
+    def _stop(self, process):
+        """Terminate an overrunning process, kill it if it insists."""
+        process.terminate()
+        try:
+            process.wait(self.kill_grace)
+        except TimeoutExpired:
+            process.kill()
+            process.wait()
+        # Its children may still hold the pipe, don't wait for them.
+        process.stdout.close()
+
+    def timeout_for(self, argv):
+        """Return the seconds the program argv runs may run for."""
+        name = os.path.basename(argv[0]) if argv else ''
+        return self.timeouts.get(name, self.default_timeout)
+
+    def run(self, cmd, include_stderr=False, input=None, timeout=None,
+            coalesce=False):
+        """Run a command and return its output.
+
+        With coalesce, when the same command line is already running
+        (e.g. iwconfig for the monitor and for a client), the output of
+        that run is waited for and shared instead of starting it again.
+        Only read-only queries may ask for it: a command changing the
+        state of an interface must run even if an identical one is.
+
+        Keyword arguments:
+        cmd -- the command, as a list or a string to split on whitespace
+        include_stderr -- whether stderr should be part of the output
+        input -- string to send to the standard input of the command
+        timeout -- seconds the command may run for (see timeout_for)
+        coalesce -- whether to share the output of an identical run
+
+        Returns:
+        The output of the command, or an empty string if it couldn't
+        be started or ran out of time and got killed.
+
+        """
+        argv = self._prepare(cmd)
+        if timeout is None:
+            timeout = self.timeout_for(argv)
+        if not coalesce or input is not None:
+            return self._run(argv, include_stderr, input, timeout)
+        key = (tuple(argv), include_stderr)
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+        if not leader:
+            self._account(argv, 'coalesced')
+            flight.done.wait()
+            return flight.output
+        try:
+            flight.output = self._run(argv, include_stderr, input, timeout)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
+        return flight.output
+
+    def _run(self, argv, include_stderr, input, timeout):
+        """Run argv in one of the slots, return its output."""
+        with self._slots:
+            start = time.monotonic()
+            process = self._start(argv, include_stderr, input is not None)
+            if process is None:
+                return ""
+            try:
+                output = process.communicate(input, timeout=timeout)[0]
+            except TimeoutExpired:
+                print("Command %s didn't finish in %s seconds, killing it" %
+                      (str(argv), timeout))
+                self._account(argv, 'timeouts')
+                self._stop(process)
+                output = ""
+            self._account(argv, 'time', time.monotonic() - start)
+        return output or ""
+
+    def run_async(self, cmd, callback, include_stderr=False, timeout=None):
+        """Run a command without blocking.
+
+        The output is collected by the GLib main loop, which calls
+        callback once the command exited.  Such commands don't count
+        against the concurrency limit and aren't shared.
+
+        Keyword arguments:
+        cmd -- the command, as a list or a string to split on whitespace
+        callback -- function called with the output of the command, or
+                    an empty string if it couldn't be started or ran
+                    out of time
+        include_stderr -- whether stderr should be part of the output
+        timeout -- seconds the command may run for (see timeout_for)
+
+        """
+        argv = self._prepare(cmd)
+        if timeout is None:
+            timeout = self.timeout_for(argv)
+        process = self._start(argv, include_stderr, False)
+        if process is None:
+            # Still answer from the main loop, as callers expect.
+            gobject.idle_add(_call_once, callback, "")
+            return
+        _AsyncRun(self, argv, process, callback, timeout)
+
+    def spawn(self, cmd, include_stderr=False, stdin=False):
+        """Start a command and return it without waiting for it.
+
+        The command is counted but neither limited in time nor in
+        concurrency, as it is up to the caller to read its output and
+        to wait for it.
+
+        Keyword arguments:
+        cmd -- the command, as a list or a string to split on whitespace
+        include_stderr -- whether stderr should go to the stdout pipe
+        stdin -- whether to open a pipe to the standard input
+
+        Returns:
+        The Popen object of the command, or None if it couldn't be
+        started.
+
+        """
+        return self._start(self._prepare(cmd), include_stderr, stdin)
+
+    def stats(self):
+        """Return the counters of the commands run.
+
+        Returns:
+        A dict with the number of calls, failures (the command couldn't
+        be started), timeouts and calls which shared the output of an
+        identical run instead of starting the command ('coalesced') and
+        the seconds spent waiting for the commands ('time'), per program
+        as 'program.counter'.  The forks saved by sharing outputs are
+        also totalled as 'coalesced'.
+
+        """
+        with self._lock:
+            stats = dict(('%s.%s' % (name, counter), value)
+                         for name, counters in self._stats.items()
+                         for counter, value in counters.items())
+            stats['coalesced'] = sum(counters['coalesced']
+                                     for counters in self._stats.values())
+            return stats
+
+
+# The executor used by misc.Run.
+EXECUTOR = CommandExecutor()
@@ -327,7 +327,7 @@ class WiredSettingsDialog(AdvancedSettingsDialog):
         self._listbox.body.append(self.encryption_chkbox)
         # pylint: disable-msg=E1103
         self._listbox.body.append(self.encryption_combo)
-        self.encrypt_types = misc.LoadEncryptionMethods(wired=True)
+        self.encrypt_types = misc.GetEncryptionMethods(daemon, wired=True)
         self.set_values()
 
         self.prof_name = name
@@ -490,7 +490,7 @@ class WirelessSettingsDialog(AdvancedSettingsDialog):
         self._listbox.body.append(self.encryption_chkbox)
         # pylint: disable-msg=E1103
         self._listbox.body.append(self.encryption_combo)
-        self.encrypt_types = misc.LoadEncryptionMethods()
+        self.encrypt_types = misc.GetEncryptionMethods(daemon)
         self.set_values()
 
         title = (_('Configuring preferences for wireless network "$A" ($B)')
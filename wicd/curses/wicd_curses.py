@@ -179,18 +179,34 @@ def check_for_wireless(iwconfig, wireless_ip, set_status):
 # Mostly borrowed/stolen from wpa_cli, since I had no clue what all of those
 # DBUS interfaces do. :P
 # Whatever calls this must be exception-wrapped if it is run if the UI is up
-def gen_network_list():
-    """Generate the list of networks."""
+def gen_network_list(networks=None, labels=None):
+    """Generate the list of networks.
+
+    networks -- list of the scan properties of the networks, as kept up to
+                date with the ScanDelta signal; fetched by property if None
+    labels -- dict of NetLabels by bssid which can be reused if their
+              network did not change
+
+    """
     wiredL = wired.GetWiredProfileList()
     wlessL = []
+    if (wireless.GetCurrentSignalStrength("") != 0 and
+            wireless.GetWirelessIP('') is not None):
+        active_id = wireless.GetCurrentNetworkID(wireless.GetIwconfig())
+    else:
+        active_id = None
+    display_type = daemon.GetSignalDisplayType()
+    if networks is None:
+        networks = [None] * wireless.GetNumberOfNetworks()
+    labels = labels or {}
     # This one makes a list of NetLabels
-    for network_id in range(0, wireless.GetNumberOfNetworks()):
-        is_active = (wireless.GetCurrentSignalStrength("") != 0 and
-                     wireless.GetCurrentNetworkID(wireless.GetIwconfig()) ==
-                     network_id and
-                     wireless.GetWirelessIP('') is not None)
-
-        label = NetLabel(network_id, is_active)
+    for network_id, props in enumerate(networks):
+        is_active = network_id == active_id
+        label = labels.get(props['bssid']) if props else None
+        if (label is None or label.id != network_id or
+                label.is_active != is_active or label.props is not props or
+                label.display_type != display_type):
+            label = NetLabel(network_id, is_active, props, display_type)
         wlessL.append(label)
     return (wiredL, wlessL)
 
@@ -386,31 +402,47 @@ def handle_sigquit(signal_number, stack_frame):
 class NetLabel(urwid.WidgetWrap):
     """Wireless network label."""
     # pylint: disable-msg=W0231
-    def __init__(self, i, is_active):
+    def __init__(self, i, is_active, props=None, display_type=None):
+        """Build the label of a network.
+
+        props -- dict with the scan properties of the network; they are
+                 fetched from the daemon one by one if None
+        display_type -- the signal display type of the daemon, fetched
+                        if None
+
+        """
+        if display_type is None:
+            display_type = daemon.GetSignalDisplayType()
+        if props is None:
+            def get_property(prop):
+                return wireless.GetWirelessProperty(self.id, prop)
+        else:
+            get_property = props.get
         # Pick which strength measure to use based on what the daemon says
         # gap allocates more space to the first module
-        if daemon.GetSignalDisplayType() == 0:
+        if display_type == 0:
             strenstr = 'quality'
             gap = 4  # Allow for 100%
         else:
             strenstr = 'strength'
             gap = 7  # -XX dbm = 7
         self.id = i
+        self.is_active = is_active
+        self.props = props
+        self.display_type = display_type
         # All of that network property stuff
         self.stren = daemon.FormatSignalForPrinting(
-                str(wireless.GetWirelessProperty(self.id, strenstr)))
-        self.essid = wireless.GetWirelessProperty(self.id, 'essid')
-        self.bssid = wireless.GetWirelessProperty(self.id, 'bssid')
+                str(get_property(strenstr)))
+        self.essid = get_property('essid')
+        self.bssid = get_property('bssid')
 
-        if wireless.GetWirelessProperty(self.id, 'encryption'):
-            self.encrypt = \
-                wireless.GetWirelessProperty(self.id, 'encryption_method')
+        if get_property('encryption'):
+            self.encrypt = get_property('encryption_method')
         else:
             self.encrypt = _('Unsecured')
 
-        self.mode = \
-            wireless.GetWirelessProperty(self.id, 'mode')  # Master, Ad-Hoc
-        self.channel = wireless.GetWirelessProperty(self.id, 'channel')
+        self.mode = get_property('mode')  # Master, Ad-Hoc
+        self.channel = get_property('channel')
         theString = '  %-*s %25s %9s %17s %6s %4s' % \
             (gap, self.stren, self.essid, self.encrypt, self.bssid, self.mode,
                 self.channel)
@@ -709,6 +741,11 @@ class appGUI():
         # These are empty to make sure that things go my way.
         wiredL, wlessL = [], []
 
+        # Scan properties of the wireless networks, kept up to date with
+        # the ScanDelta signal, and the labels built out of them.
+        self.networks = None
+        self.labels = {}
+
         self.frame = None
         self.diag = None
 
@@ -844,7 +881,10 @@ class appGUI():
         if not state:
             state, trash = daemon.GetConnectionStatus()
         if force_check or self.prev_state != state:
-            wiredL, wlessL = gen_network_list()
+            if self.networks is None:
+                self.networks = wireless.GetScanResults()
+            wiredL, wlessL = gen_network_list(self.networks, self.labels)
+            self.labels = dict((label.bssid, label) for label in wlessL)
 
             self.wiredCB.get_body().set_list(wiredL)
             self.wiredCB.get_body().build_combobox(self.frame, ui, 3)
@@ -983,6 +1023,25 @@ class appGUI():
         self.unlock_screen()
         self.scanning = False
 
+    def dbus_scan_delta(self, added, changed, removed, order):
+        """Handle DBus scan delta, updating the networks in place."""
+        if self.networks is None:
+            return
+        networks = dict((props['bssid'], props) for props in self.networks)
+        for props in added:
+            networks[props['bssid']] = dict(props)
+        for props in changed:
+            # Replace rather than update, so that the label gets rebuilt.
+            networks[props['bssid']] = dict(networks.get(props['bssid'], {}),
+                                            **props)
+        for bssid in removed:
+            networks.pop(bssid, None)
+        if set(order) - set(networks):
+            # Out of sync, start over.
+            self.networks = None
+        else:
+            self.networks = [networks[bssid] for bssid in order]
+
     def dbus_scan_started(self):
         """Handle DBus scan start."""
         self.scanning = True
@@ -1139,6 +1198,8 @@ class appGUI():
                 # might be used to it.
                 if k == 'f10' or k == 'S' or k == 's':
                     self.diag.save_settings()
+                    # The settings may rename a hidden network.
+                    self.networks = None
                     self.restore_primary()
                     break
             if k == "window resize":
@@ -1240,6 +1301,8 @@ def run():
                             'org.wicd.daemon.wireless')
     bus.add_signal_receiver(app.dbus_scan_started, 'SendStartScanSignal',
                             'org.wicd.daemon.wireless')
+    bus.add_signal_receiver(app.dbus_scan_delta, 'ScanDelta',
+                            'org.wicd.daemon.wireless')
     # I've left this commented out many times.
     bus.add_signal_receiver(app.update_netlist, 'StatusChanged',
                             'org.wicd.daemon')
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""802.11 helpers for wicd.
+
+Scan results read straight from the kernel (nl80211) or from
+wpa_supplicant carry the raw 802.11 capability field and information
+elements of each BSS; this module turns them into the access point
+dicts wicd uses, the same shape as the ones parsed from iwlist output.
+
+FreqToChannel() -- Translate a frequency to a channel number.
+ChannelToFreq() -- Translate a channel number to a frequency.
+DbmToQuality() -- Translate a signal level to a link quality.
+ParseInformationElements() -- Split a buffer of information elements.
+MakeAccessPoint() -- Build an access point dict from raw fields.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# 802.11 capability bits and information element ids.
+WLAN_CAPABILITY_ESS = 0x0001
+WLAN_CAPABILITY_IBSS = 0x0002
+WLAN_CAPABILITY_PRIVACY = 0x0010
+WLAN_EID_SSID = 0
+WLAN_EID_SUPP_RATES = 1
+WLAN_EID_DS_PARAMS = 3
+WLAN_EID_RSN = 48
+WLAN_EID_EXT_SUPP_RATES = 50
+WLAN_EID_VENDOR_SPECIFIC = 221
+WPA_IE_PREFIX = b'\x00\x50\xf2\x01'
+
+
+def FreqToChannel(freq):
+    """Translate a frequency in MHz to a channel number.
+
+    Keyword arguments:
+    freq -- integer containing the frequency in MHz
+
+    Returns:
+    The channel number, or None if the frequency is unknown.
+
+    """
+    if freq == 2484:
+        return 14
+    elif 2412 <= freq < 2484:
+        return (freq - 2407) // 5
+    elif 4910 <= freq <= 4980:
+        return (freq - 4000) // 5
+    elif 5000 < freq < 5950:
+        return (freq - 5000) // 5
+    elif 5955 <= freq <= 7115:
+        return (freq - 5950) // 5
+    elif 58320 <= freq <= 70200:
+        return (freq - 56160) // 2160
+    return None
+
+
+def ChannelToFreq(channel):
+    """Translate a 2.4 or 5 GHz channel number to its frequency in MHz.
+
+    Keyword arguments:
+    channel -- integer (or string) containing the channel number
+
+    Returns:
+    The frequency in MHz, or None if the channel is unknown.
+
+    """
+    try:
+        channel = int(channel)
+    except (TypeError, ValueError):
+        return None
+    if channel == 14:
+        return 2484
+    elif 1 <= channel < 14:
+        return 2407 + channel * 5
+    elif 32 <= channel <= 177:
+        return 5000 + channel * 5
+    return None
+
+
+def DbmToQuality(dbm):
+    """Translate a signal level in dBm to a 0-100 link quality."""
+    return min(max(2 * (int(dbm) + 100), 0), 100)
+
+
+def ParseInformationElements(data):
+    """Split a buffer of 802.11 information elements.
+
+    Keyword arguments:
+    data -- bytes containing the information elements of a beacon or
+            probe response
+
+    Returns:
+    A list of (element id, payload) tuples.
+
+    """
+    elements = []
+    pos = 0
+    while pos + 2 <= len(data):
+        eid, length = data[pos], data[pos + 1]
+        if pos + 2 + length > len(data):
+            break
+        elements.append((eid, data[pos + 2:pos + 2 + length]))
+        pos += 2 + length
+    return elements
+
+
+def MakeAccessPoint(bssid, freq, capability, ies, dbm=None, quality=None):
+    """Build an access point dict out of raw scan result fields.
+
+    The result has the same shape as the ones GetNetworks builds from
+    iwlist output, so backends that get the scan results straight from
+    the kernel or from wpa_supplicant can hand them to Wireless.Scan.
+
+    Keyword arguments:
+    bssid -- string containing the BSSID
+    freq -- integer containing the frequency in MHz
+    capability -- integer containing the 802.11 capability field
+    ies -- bytes containing the information elements
+    dbm -- signal level in dBm, if known
+    quality -- link quality (0-100), if known; derived from dbm otherwise
+
+    Returns:
+    A dictionary containing the network properties.
+
+    """
+    ap = {}
+    ssid = b''
+    rates = []
+    channel = None
+    rsn = wpa = False
+    for eid, payload in ParseInformationElements(ies):
+        if eid == WLAN_EID_SSID:
+            ssid = payload
+        elif eid in (WLAN_EID_SUPP_RATES, WLAN_EID_EXT_SUPP_RATES):
+            rates.extend(rate & 0x7f for rate in payload)
+        elif eid == WLAN_EID_DS_PARAMS and payload:
+            channel = payload[0]
+        elif eid == WLAN_EID_RSN:
+            rsn = True
+        elif (eid == WLAN_EID_VENDOR_SPECIFIC
+              and payload.startswith(WPA_IE_PREFIX)):
+            wpa = True
+
+    # We (well, DBus) don't support ESSIDs with null bytes in it.
+    essid = ssid.decode('utf-8', 'replace').replace('\x00', '')
+    if essid in ['Hidden', '<hidden>', ""]:
+        ap['hidden'] = True
+        ap['essid'] = "<hidden>"
+    else:
+        ap['hidden'] = False
+        ap['essid'] = essid
+
+    ap['channel'] = FreqToChannel(freq) if freq else channel
+    if rates:
+        ap['bitrates'] = ['%g' % (rate / 2) for rate in sorted(set(rates))]
+    else:
+        ap['bitrates'] = None
+    ap['bssid'] = bssid.upper()
+
+    if capability & WLAN_CAPABILITY_IBSS:
+        ap['mode'] = 'Ad-Hoc'
+    else:
+        ap['mode'] = 'Master'
+
+    if capability & WLAN_CAPABILITY_PRIVACY:
+        ap['encryption'] = True
+        if rsn:
+            ap['encryption_method'] = 'WPA2'
+        elif wpa:
+            ap['encryption_method'] = 'WPA'
+        else:
+            ap['encryption_method'] = 'WEP'
+    else:
+        ap['encryption'] = False
+
+    if quality is None:
+        quality = DbmToQuality(dbm) if dbm is not None else 101
+    ap['quality'] = quality
+    ap['strength'] = str(dbm) if dbm is not None else -1
+    return ap
@@ -22,6 +22,7 @@ throughout wicd.
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import copy
 import itertools
 import locale
 import os
@@ -41,6 +42,8 @@ from wicd.translations import _
 
 # wicd imports
 from wicd.config import CFG
+from wicd import commands
+from wicd import templates
 
 
 CFG.load()
@@ -114,11 +117,13 @@ class WicdError(Exception):
 
 
 def Run(cmd, include_stderr=False, return_pipe=False,
-        return_obj=False, return_retcode=True):
+        return_obj=False, return_retcode=True, timeout=None, input=None,
+        coalesce=False):
     """Run a command.
 
     Runs the given command, returning either the output
-    of the program, or a pipe to read output from.
+    of the program, or a pipe to read output from.  Commands are run
+    by commands.EXECUTOR, see CommandExecutor.run for the time limit.
 
     keyword arguments --
     cmd - The command to execute
@@ -130,42 +135,37 @@ def Run(cmd, include_stderr=False, return_pipe=False,
                   one output string from the command.
     return_obj - If True, Run will return the Popen object
                  for the command that was run.
+    timeout - Seconds the command may run for before it is killed,
+              ignored if a pipe or the Popen object is returned.
+    input - String to send to the standard input of the command,
+            ignored if a pipe or the Popen object is returned.
+    coalesce - Boolean specifying if the output of an identical
+               command already running may be shared, only for
+               read-only queries (see CommandExecutor.run).
 
     """
-    if not isinstance(cmd, list):
-        cmd = to_unicode(str(cmd))
-        cmd = cmd.split()
-    if include_stderr:
-        err = STDOUT
-        fds = True
-    else:
-        err = None
-        fds = False
-    if return_obj:
-        std_in = PIPE
-    else:
-        std_in = None
+    if return_obj or return_pipe:
+        f = commands.EXECUTOR.spawn(cmd, include_stderr, stdin=return_obj)
+        if f is None:
+            return ""
+        return f if return_obj else f.stdout
+    return commands.EXECUTOR.run(cmd, include_stderr, input=input,
+                                 timeout=timeout, coalesce=coalesce)
 
-    # We need to make sure that the results of the command we run
-    # are in English, so we set up a temporary environment.
-    tmpenv = os.environ.copy()
-    tmpenv["LC_ALL"] = "C"
-    tmpenv["LANG"] = "C"
 
-    try:
-        f = Popen(cmd, shell=False, stdout=PIPE, stdin=std_in, stderr=err,
-                  close_fds=fds, cwd='/', env=tmpenv,
-                  encoding=sys.getdefaultencoding())
-    except OSError as e:
-        print(("Running command %s failed: %s" % (str(cmd), str(e))))
-        return ""
+def RunAsync(cmd, callback, include_stderr=False, timeout=None):
+    """Run a command without blocking the main loop.
 
-    if return_obj:
-        return f
-    if return_pipe:
-        return f.stdout
-    else:
-        return f.communicate()[0]
+    keyword arguments --
+    cmd - The command to execute
+    callback - Function called with the output of the command once
+               it is done (an empty string if it failed)
+    include_stderr - Boolean specifying if stderr should be
+                     included in the output.
+    timeout - Seconds the command may run for before it is killed.
+
+    """
+    commands.EXECUTOR.run_async(cmd, callback, include_stderr, timeout)
 
 
 def LaunchAndWait(cmd):
@@ -306,59 +306,23 @@ def ParseEncryption(network):
     """Parse through an encryption template file
 
     Parses an encryption template, reading in a network's info
-    and creating a config file for it
+    and creating a config file for it.  The file is only written
+    again when its contents changed (see wicd.templates).
+
+    Returns:
+    The contents of the config file
 
     """
-    with open(os.path.join(CFG.encryption, network["enctype"])) as fobj:
-        template = fobj.readlines()
+    config_file = templates.TEMPLATES.get(network["enctype"]).render(network)
 
-    if network.get('essid'):
-        config_file = "ap_scan=1\n"
-    else:
-        config_file = "ap_scan=0\n"
-    should_replace = False
-    for index, line in enumerate(template):
-        if not should_replace:
-            if line.strip().startswith('---'):
-                should_replace = True
-        else:
-            if line.strip().startswith("}"):
-                # This is the last line, so we just write it.
-                config_file = ''.join([config_file, line])
-            elif "$_" in line:
-                for cur_val in re.findall(r'\$_([A-Z0-9_]+)', line):
-                    if cur_val:
-                        rep_val = network.get(cur_val.lower())
-                        if not rep_val:
-                            # hardcode some default values
-                            if cur_val == 'SCAN':
-                                rep_val = '1'
-                            elif cur_val == 'KEY_INDEX':
-                                rep_val = '0'
-                        if rep_val:
-                            line = line.replace("$_%s" % cur_val, str(rep_val))
-                        else:
-                            print(("Ignoring template line: '%s'" % line))
-                    else:
-                        print("Weird parsing error occurred")
-                config_file = ''.join([config_file, line])
-            else:  # Just a regular entry.
-                config_file = ''.join([config_file, line])
-
-    # Write the data to the files then chmod them so they can't be read
-    # by normal users.
+    # Write the data to the files, which can't be read by normal users.
     if network.get('bssid'):
         file_name = network['bssid'].replace(":", "").lower()
     else:
         file_name = 'wired'
-    file_loc = os.path.join(CFG.networks, file_name)
-    f = open(file_loc, "w")
-    os.chmod(file_loc, 0o600)
-    os.chown(file_loc, 0, 0)
-    # We could do this above, but we'd like to read protect
-    # them before we write, so that it can't be read.
-    f.write(config_file)
-    f.close()
+    templates.TEMPLATES.write(os.path.join(CFG.networks, file_name),
+                              config_file)
+    return config_file
 
 
 def LoadEncryptionMethods(wired=False):
@@ -367,101 +331,47 @@ def LoadEncryptionMethods(wired=False):
     Loads all the encryption methods from the template files
     in /encryption/templates into a data structure.  To be
     loaded, the template must be listed in the "active" file.
+    The templates are only parsed again once they changed.
 
     """
-    if wired:
-        active_fname = "active_wired"
-    else:
-        active_fname = "active"
     try:
-        with open(os.path.join(CFG.encryption, active_fname), "r") as fobj:
-            enctypes = fobj.readlines()
+        return templates.TEMPLATES.methods(wired)
     except IOError as e:
         print("Fatal Error: template index file is missing.")
         raise IOError(e)
 
-    # Parse each encryption method
-    encryptionTypes = []
-    for enctype in enctypes:
-        parsed_template = _parse_enc_template(enctype.strip())
-        if parsed_template:
-            encryptionTypes.append(parsed_template)
-    return encryptionTypes
 
+# The encryption catalogs received from the daemon, per wired flag.
+_encryption_catalogs = {}
 
-def __parse_field_ent(fields, field_type='require'):
-    fields = fields.split(" ")
-    ret = []
-    # We need an even number of entries in the line for it to be valid.
-    if (len(fields) % 2) != 0:
-        return None
-    else:
-        for val, disp_val in grouper(2, fields, fillvalue=None):
-            if val.startswith("*") or not disp_val.startswith("*"):
-                return None
-            ret.append([val, disp_val[1:]])
-        return ret
 
+def GetEncryptionMethods(daemon, wired=False):
+    """Get the encryption methods from the daemon
 
-def _parse_enc_template(enctype):
-    """Parse an encryption template."""
-    def parse_ent(line, key):
-        return line.replace(key, "").replace("=", "").strip()
+    Returns the same data structures as LoadEncryptionMethods, but
+    out of the template catalog of the daemon, which clients may not
+    be able to read themselves.  The catalog is kept and only sent
+    again by the daemon once its version changed.
 
-    try:
-        f = open(os.path.join(CFG.encryption, enctype), "r")
-    except IOError:
-        print(("Failed to open template file %s" % enctype))
-        return None
+    Keyword arguments:
+    daemon -- the org.wicd.daemon D-Bus interface
+    wired -- whether to get the methods for wired networks
 
-    cur_type = {}
-    cur_type["type"] = enctype
-    cur_type["fields"] = []
-    cur_type['optional'] = []
-    cur_type['required'] = []
-    cur_type['protected'] = []
-    cur_type['name'] = ""
-    for index, line in enumerate(f):
-        if line.startswith("name") and not cur_type["name"]:
-            cur_type["name"] = parse_ent(line, "name")
-        elif line.startswith("require"):
-            cur_type["required"] = __parse_field_ent(parse_ent(line,
-                                                               "require"))
-            if not cur_type["required"]:
-                # An error occured parsing the require line.
-                print("Invalid 'required' line found in template %s" %
-                      enctype)
-                continue
-        elif line.startswith("optional"):
-            cur_type["optional"] = __parse_field_ent(parse_ent(line,
-                                                               "optional"),
-                                                     field_type="optional")
-            if not cur_type["optional"]:
-                # An error occured parsing the optional line.
-                print("Invalid 'optional' line found in template %s" %
-                      enctype)
-                continue
-        elif line.startswith("protected"):
-            cur_type["protected"] = __parse_field_ent(parse_ent(line,
-                                                                "protected"),
-                                                      field_type="protected")
-            if not cur_type["protected"]:
-                # An error occured parsing the protected line.
-                print("Invalid 'protected' line found in template %s" %
-                      enctype)
-                continue
-        elif line.startswith("----"):
-            # We're done.
-            break
-    f.close()
-    if not cur_type["required"]:
-        print("Failed to find a 'require' line in template %s" % enctype)
-        return None
-    if not cur_type["name"]:
-        print("Failed to find a 'name' line in template %s" % enctype)
-        return None
-    else:
-        return cur_type
+    """
+    version, methods = _encryption_catalogs.get(wired, (0, []))
+    current, entries = daemon.GetEncryptionCatalog(wired, version)
+    if current != version:
+        methods = [{'type': str(enctype), 'name': str(name), 'fields': [],
+                    'required': [[str(f) for f in field]
+                                 for field in required],
+                    'optional': [[str(f) for f in field]
+                                 for field in optional],
+                    'protected': [[str(f) for f in field]
+                                  for field in protected]}
+                   for enctype, name, required, optional, protected
+                   in entries]
+        _encryption_catalogs[wired] = (current, methods)
+    return copy.deepcopy(methods)
 
 
 def noneToString(text):
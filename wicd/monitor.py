@@ -41,6 +41,10 @@ wireless = dbus_dict["wireless"]
 
 mainloop = None
 
+# Seconds between polls when the daemon signals link and address changes;
+# polling then only catches what the notifications can't tell us about.
+SAFETY_NET_INTERVAL = 30
+
 
 def diewithdbus(func):
     """
@@ -86,6 +90,8 @@ class ConnectionStatus(object):
         self.trigger_reconnect = False
         self.__lost_dbus_count = 0
         self._to_time = daemon.GetBackendUpdateInterval()
+        self._link_events = daemon.GetLinkEventsEnabled()
+        self._poll_time = None
         self.update_callback = None
 
         self.add_poll_callback()
@@ -98,7 +104,7 @@ class ConnectionStatus(object):
     def _update_timeout_interval(self, interval):
         """Update the callback interval when signaled by the daemon."""
         self._to_time = interval
-        gobject.source_remove(self.update_callback)
+        self.remove_poll_callback()
         self.add_poll_callback()
 
     def _force_update_connection_status(self):
@@ -109,19 +115,35 @@ class ConnectionStatus(object):
         it.
 
         """
-        gobject.source_remove(self.update_callback)
+        self.remove_poll_callback()
         self.update_connection_status()
         self.add_poll_callback()
 
-    def add_poll_callback(self):
-        """Registers a polling call at a predetermined interval.
+    def _get_poll_interval(self):
+        """Return the number of seconds between two polls.
 
-        The polling interval is determined by the backend in use.
+        The polling interval is determined by the backend in use.  When
+        the daemon signals link and address changes, polling is only a
+        safety net, except while connected to a wireless network, as
+        the signal strength can only be polled for.
 
         """
-        self.update_callback = misc.timeout_add(self._to_time,
+        if self._link_events and self.last_state != misc.WIRELESS:
+            return max(self._to_time, SAFETY_NET_INTERVAL)
+        return self._to_time
+
+    def add_poll_callback(self):
+        """Registers a polling call at a predetermined interval."""
+        self._poll_time = self._get_poll_interval()
+        self.update_callback = misc.timeout_add(self._poll_time,
                                                 self.update_connection_status)
 
+    def remove_poll_callback(self):
+        """Unregisters the polling call."""
+        if self.update_callback is not None:
+            gobject.source_remove(self.update_callback)
+            self.update_callback = None
+
     def check_for_wired_connection(self, wired_ip):
         """Checks for a wired connection.
 
@@ -308,6 +330,13 @@ class ConnectionStatus(object):
             # so we'll revert that
             daemon.SetForcedDisconnect(False)
         self.last_state = state
+
+        # Poll at the pace the new state needs (unless a forced update is
+        # running, which reschedules the poll itself).
+        if (self.update_callback is not None and
+                self._get_poll_interval() != self._poll_time):
+            self.remove_poll_callback()
+            self.add_poll_callback()
         return True
 
     def _get_printable_sig_strength(self, always_positive=False):
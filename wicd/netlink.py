@@ -0,0 +1,815 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Netlink socket helpers for wicd.
+
+This module implements just enough of the netlink protocol to talk to the
+kernel without going through external programs: message and attribute
+encoding/decoding, generic netlink family resolution and the nl80211
+requests used for scanning and station information.
+
+class NetlinkSocket() -- Send requests and receive replies over netlink.
+class GenericNetlinkSocket() -- Resolve and talk to generic netlink families.
+class Nl80211Socket() -- Scan and query wireless devices through nl80211.
+class RouteSocket() -- Query and change links, addresses and routes.
+class RouteEventSocket() -- Receive link and address change notifications.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import errno
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+# Got these from /usr/include/linux/netlink.h
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x001
+NLM_F_MULTI = 0x002
+NLM_F_ACK = 0x004
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_CREATE = 0x400
+
+NLA_TYPE_MASK = 0x3fff
+
+# Got these from /usr/include/linux/genetlink.h
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+CTRL_ATTR_MCAST_GROUPS = 7
+CTRL_ATTR_MCAST_GRP_NAME = 1
+CTRL_ATTR_MCAST_GRP_ID = 2
+
+# Got these from /usr/include/linux/nl80211.h
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_GET_STATION = 17
+NL80211_CMD_GET_SCAN = 32
+NL80211_CMD_TRIGGER_SCAN = 33
+NL80211_CMD_NEW_SCAN_RESULTS = 34
+NL80211_CMD_SCAN_ABORTED = 35
+
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_IFTYPE = 5
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_STA_INFO = 21
+NL80211_ATTR_SCAN_FREQUENCIES = 44
+NL80211_ATTR_SCAN_SSIDS = 45
+NL80211_ATTR_BSS = 47
+
+NL80211_BSS_BSSID = 1
+NL80211_BSS_FREQUENCY = 2
+NL80211_BSS_CAPABILITY = 5
+NL80211_BSS_INFORMATION_ELEMENTS = 6
+NL80211_BSS_SIGNAL_MBM = 7
+NL80211_BSS_SIGNAL_UNSPEC = 8
+NL80211_BSS_STATUS = 9
+NL80211_BSS_SEEN_MS_AGO = 10
+NL80211_BSS_BEACON_IES = 11
+
+NL80211_BSS_STATUS_ASSOCIATED = 1
+NL80211_BSS_STATUS_IBSS_JOINED = 2
+
+NL80211_STA_INFO_SIGNAL = 7
+NL80211_STA_INFO_TX_BITRATE = 8
+NL80211_RATE_INFO_BITRATE = 1
+NL80211_RATE_INFO_BITRATE32 = 5
+
+NL80211_IFTYPE_ADHOC = 1
+NL80211_IFTYPE_STATION = 2
+NL80211_IFTYPE_AP = 3
+NL80211_IFTYPE_MONITOR = 6
+
+# Got these from /usr/include/linux/rtnetlink.h and if_link.h
+RTNLGRP_LINK = 1
+RTNLGRP_IPV4_IFADDR = 5
+RTNLGRP_IPV6_IFADDR = 9
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_TABLE = 15
+
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_NOWHERE = 255
+RTN_UNICAST = 1
+
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+IFF_LOWER_UP = 0x10000
+
+NL80211_GENL_NAME = 'nl80211'
+NL80211_MULTICAST_GROUP_SCAN = 'scan'
+
+RECV_BUFSIZE = 65536
+
+_nlmsghdr = struct.Struct('=LHHLL')
+_nlattr = struct.Struct('=HH')
+_genlmsghdr = struct.Struct('=BBH')
+_ifinfomsg = struct.Struct('=BxHiII')
+_ifaddrmsg = struct.Struct('=BBBBI')
+_rtmsg = struct.Struct('=BBBBBBBBI')
+_u8 = struct.Struct('=B')
+_u16 = struct.Struct('=H')
+_u32 = struct.Struct('=L')
+_s32 = struct.Struct('=l')
+
+
+class NetlinkError(OSError):
+    """An error reported by the kernel in a netlink reply."""
+    pass
+
+
+def _align(length):
+    """Round length up to the netlink alignment of 4 bytes."""
+    return (length + 3) & ~3
+
+
+def pack_attr(attr_type, payload):
+    """Encode a single netlink attribute.
+
+    Keyword arguments:
+    attr_type -- integer containing the attribute type
+    payload -- bytes containing the attribute payload
+
+    Returns:
+    The encoded attribute, padded to the netlink alignment.
+
+    """
+    length = _nlattr.size + len(payload)
+    return (_nlattr.pack(length, attr_type) + payload +
+            b'\0' * (_align(length) - length))
+
+
+def pack_u32(attr_type, value):
+    """Encode an unsigned 32 bit integer attribute."""
+    return pack_attr(attr_type, _u32.pack(value))
+
+
+def pack_string(attr_type, value):
+    """Encode a NUL terminated string attribute."""
+    return pack_attr(attr_type, value.encode('utf-8') + b'\0')
+
+
+def pack_nested(attr_type, attrs):
+    """Encode a nested attribute out of a list of encoded attributes."""
+    return pack_attr(attr_type, b''.join(attrs))
+
+
+def pack_message(msg_type, flags, seq, payload, pid=0):
+    """Encode a netlink message.
+
+    Keyword arguments:
+    msg_type -- integer containing the message type (or the family id)
+    flags -- integer containing the NLM_F_* flags
+    seq -- integer containing the sequence number
+    payload -- bytes containing the message payload
+    pid -- integer containing the port id of the sender
+
+    Returns:
+    The encoded message.
+
+    """
+    return _nlmsghdr.pack(_nlmsghdr.size + len(payload), msg_type, flags,
+                          seq, pid) + payload
+
+
+def pack_genl(cmd, attrs=(), version=1):
+    """Encode a generic netlink payload out of a command and attributes."""
+    return _genlmsghdr.pack(cmd, version, 0) + b''.join(attrs)
+
+
+def unpack_messages(data):
+    """Split a buffer received from a netlink socket into messages.
+
+    Keyword arguments:
+    data -- bytes received from the socket
+
+    Returns:
+    A generator of (type, flags, seq, payload) tuples.
+
+    """
+    pos = 0
+    while pos + _nlmsghdr.size <= len(data):
+        length, msg_type, flags, seq, _ = _nlmsghdr.unpack_from(data, pos)
+        if length < _nlmsghdr.size or pos + length > len(data):
+            break
+        yield msg_type, flags, seq, data[pos + _nlmsghdr.size:pos + length]
+        pos += _align(length)
+
+
+def unpack_attrs(data):
+    """Decode a buffer of netlink attributes.
+
+    Keyword arguments:
+    data -- bytes containing the attributes
+
+    Returns:
+    A dict mapping attribute types to their payloads.
+
+    """
+    attrs = {}
+    pos = 0
+    while pos + _nlattr.size <= len(data):
+        length, attr_type = _nlattr.unpack_from(data, pos)
+        if length < _nlattr.size or pos + length > len(data):
+            break
+        attrs[attr_type & NLA_TYPE_MASK] = data[pos + _nlattr.size:
+                                                pos + length]
+        pos += _align(length)
+    return attrs
+
+
+def unpack_genl(payload):
+    """Decode a generic netlink payload.
+
+    Returns:
+    A (command, attributes) tuple.
+
+    """
+    cmd, _, _ = _genlmsghdr.unpack_from(payload)
+    return cmd, unpack_attrs(payload[_genlmsghdr.size:])
+
+
+def unpack_ifinfo(payload):
+    """Decode the payload of an RTM_NEWLINK/RTM_DELLINK message.
+
+    Returns:
+    A (ifindex, flags, attributes) tuple.
+
+    """
+    _, _, ifindex, flags, _ = _ifinfomsg.unpack_from(payload)
+    return ifindex, flags, unpack_attrs(payload[_ifinfomsg.size:])
+
+
+def unpack_ifaddr(payload):
+    """Decode the payload of an RTM_NEWADDR/RTM_DELADDR message.
+
+    Returns:
+    A (family, prefixlen, ifindex, attributes) tuple.
+
+    """
+    family, prefixlen, _, _, ifindex = _ifaddrmsg.unpack_from(payload)
+    return family, prefixlen, ifindex, unpack_attrs(payload[_ifaddrmsg.size:])
+
+
+def unpack_route(payload):
+    """Decode the payload of an RTM_NEWROUTE/RTM_DELROUTE message.
+
+    Returns:
+    A dict with the 'family', the destination ('destination' and
+    'prefixlen', the destination is None for default routes), the
+    'gateway' (None for direct routes), the output interface index
+    ('ifindex') and the routing 'table'.
+
+    """
+    family, prefixlen, _, _, table, _, _, _, _ = _rtmsg.unpack_from(payload)
+    attrs = unpack_attrs(payload[_rtmsg.size:])
+    destination = attrs.get(RTA_DST)
+    gateway = attrs.get(RTA_GATEWAY)
+    return {
+        'family': family,
+        'destination': (socket.inet_ntop(family, destination)
+                        if destination else None),
+        'prefixlen': prefixlen,
+        'gateway': socket.inet_ntop(family, gateway) if gateway else None,
+        'ifindex': get_u32(attrs, RTA_OIF),
+        # Tables past 255 only fit in the attribute.
+        'table': get_u32(attrs, RTA_TABLE, table),
+    }
+
+
+def get_u8(attrs, attr_type, default=None):
+    """Return an unsigned 8 bit integer attribute, or default."""
+    if attr_type not in attrs:
+        return default
+    return _u8.unpack_from(attrs[attr_type])[0]
+
+
+def get_u16(attrs, attr_type, default=None):
+    """Return an unsigned 16 bit integer attribute, or default."""
+    if attr_type not in attrs:
+        return default
+    return _u16.unpack_from(attrs[attr_type])[0]
+
+
+def get_u32(attrs, attr_type, default=None):
+    """Return an unsigned 32 bit integer attribute, or default."""
+    if attr_type not in attrs:
+        return default
+    return _u32.unpack_from(attrs[attr_type])[0]
+
+
+def get_s32(attrs, attr_type, default=None):
+    """Return a signed 32 bit integer attribute, or default."""
+    if attr_type not in attrs:
+        return default
+    return _s32.unpack_from(attrs[attr_type])[0]
+
+
+def get_string(attrs, attr_type, default=None):
+    """Return a NUL terminated string attribute, or default."""
+    if attr_type not in attrs:
+        return default
+    return attrs[attr_type].split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def get_address(attrs, family):
+    """Return the (local) address of an RTM_*ADDR message, or None."""
+    address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+    if not address:
+        return None
+    return socket.inet_ntop(family, address)
+
+
+def get_label(attrs):
+    """Return the interface name of an RTM_*ADDR message, or ''."""
+    # IPv4 labels can be aliases like eth0:1, IPv6 has none.
+    return get_string(attrs, IFA_LABEL, '').partition(':')[0]
+
+
+def format_mac(data):
+    """Format a 6 byte hardware address the way iwconfig does."""
+    return ':'.join('%02X' % octet for octet in data[:6])
+
+
+class NetlinkSocket(object):
+    """Send requests and receive replies over a netlink socket."""
+    def __init__(self, protocol, sock=None):
+        """Open the socket.
+
+        Keyword arguments:
+        protocol -- the netlink protocol (NETLINK_ROUTE, NETLINK_GENERIC...)
+        sock -- an already opened socket-like object, mainly for testing
+
+        """
+        if sock is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                 protocol)
+            sock.bind((0, 0))
+        self.sock = sock
+        self.seq = int(time.time()) & 0xffff
+        # Serializes requests, whose replies would otherwise be mixed up.
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close the socket."""
+        self.sock.close()
+
+    def fileno(self):
+        """Return the file descriptor of the socket."""
+        return self.sock.fileno()
+
+    def add_membership(self, group):
+        """Subscribe the socket to a multicast group."""
+        self.sock.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, group)
+
+    def request(self, msg_type, payload, flags=0):
+        """Send a request and collect the replies.
+
+        Dump requests are read until NLMSG_DONE, anything else is sent
+        with NLM_F_ACK and read until the acknowledgement.  A request made
+        from another thread meanwhile waits for the replies to be read.
+
+        Keyword arguments:
+        msg_type -- integer containing the message type (or the family id)
+        payload -- bytes containing the request payload
+        flags -- extra NLM_F_* flags (e.g. NLM_F_DUMP)
+
+        Returns:
+        A list of (type, payload) tuples.
+
+        """
+        with self._lock:
+            return self._request(msg_type, payload, flags)
+
+    def _request(self, msg_type, payload, flags):
+        """Send a request and collect the replies, see request."""
+        self.seq = (self.seq + 1) & 0xffffffff
+        seq = self.seq
+        flags |= NLM_F_REQUEST
+        if not flags & NLM_F_DUMP:
+            flags |= NLM_F_ACK
+        self.sock.send(pack_message(msg_type, flags, seq, payload))
+
+        replies = []
+        while True:
+            data = self.sock.recv(RECV_BUFSIZE)
+            if not data:
+                raise NetlinkError(errno.EIO, 'netlink socket closed')
+            for reply_type, _, reply_seq, reply in unpack_messages(data):
+                if reply_seq != seq:
+                    # Stray reply or multicast message, not for us.
+                    continue
+                if reply_type in (NLMSG_ERROR, NLMSG_DONE):
+                    error = _s32.unpack_from(reply)[0] if reply else 0
+                    if error < 0:
+                        raise NetlinkError(-error, os.strerror(-error))
+                    return replies
+                replies.append((reply_type, reply))
+
+    def receive(self, timeout=None):
+        """Wait for unsolicited (multicast) messages.
+
+        Keyword arguments:
+        timeout -- seconds to wait for, or None to block
+
+        Returns:
+        A list of (type, payload) tuples, empty if the timeout expired.
+
+        """
+        if timeout is not None:
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if not readable:
+                return []
+        data = self.sock.recv(RECV_BUFSIZE)
+        return [(msg_type, payload)
+                for msg_type, _, _, payload in unpack_messages(data)]
+
+
+class GenericNetlinkSocket(NetlinkSocket):
+    """Resolve and talk to generic netlink families."""
+    def __init__(self, sock=None):
+        """Open the socket.
+
+        Keyword arguments:
+        sock -- an already opened socket-like object, mainly for testing
+
+        """
+        NetlinkSocket.__init__(self, NETLINK_GENERIC, sock)
+        self._families = {}
+
+    def get_family(self, name):
+        """Look up a generic netlink family.
+
+        Keyword arguments:
+        name -- string containing the name of the family
+
+        Returns:
+        A (family id, {multicast group name: group id}) tuple.
+
+        """
+        if name not in self._families:
+            payload = pack_genl(CTRL_CMD_GETFAMILY,
+                                [pack_string(CTRL_ATTR_FAMILY_NAME, name)])
+            [(_, reply)] = self.request(GENL_ID_CTRL, payload)
+            _, attrs = unpack_genl(reply)
+            groups = {}
+            for group in unpack_attrs(attrs.get(CTRL_ATTR_MCAST_GROUPS,
+                                                b'')).values():
+                group = unpack_attrs(group)
+                groups[get_string(group, CTRL_ATTR_MCAST_GRP_NAME)] = \
+                    get_u32(group, CTRL_ATTR_MCAST_GRP_ID)
+            self._families[name] = (get_u16(attrs, CTRL_ATTR_FAMILY_ID),
+                                    groups)
+        return self._families[name]
+
+    def genl_request(self, family, cmd, attrs=(), flags=0):
+        """Send a generic netlink request.
+
+        Keyword arguments:
+        family -- string containing the name of the family
+        cmd -- integer containing the command
+        attrs -- list of encoded attributes
+        flags -- extra NLM_F_* flags (e.g. NLM_F_DUMP)
+
+        Returns:
+        A list of (command, attributes) tuples.
+
+        """
+        family_id, _ = self.get_family(family)
+        return [unpack_genl(reply)
+                for _, reply in self.request(family_id, pack_genl(cmd, attrs),
+                                             flags)]
+
+    def join_group(self, family, group):
+        """Subscribe the socket to a multicast group of a family."""
+        _, groups = self.get_family(family)
+        self.add_membership(groups[group])
+
+
+class Nl80211Socket(GenericNetlinkSocket):
+    """Scan and query wireless devices through nl80211."""
+    def trigger_scan(self, ifindex, ssids=(), freqs=()):
+        """Ask the kernel to start a scan.
+
+        Keyword arguments:
+        ifindex -- integer containing the interface index
+        ssids -- list of SSIDs to probe for, besides the wildcard one
+        freqs -- list of frequencies (MHz) to limit the scan to
+
+        """
+        # The empty (wildcard) SSID makes the scan an active one.
+        ssid_attrs = [pack_attr(index + 1, ssid.encode('utf-8'))
+                      for index, ssid in enumerate([''] + list(ssids))]
+        attrs = [pack_u32(NL80211_ATTR_IFINDEX, ifindex),
+                 pack_nested(NL80211_ATTR_SCAN_SSIDS, ssid_attrs)]
+        if freqs:
+            attrs.append(pack_nested(NL80211_ATTR_SCAN_FREQUENCIES,
+                                     [pack_u32(index + 1, freq)
+                                      for index, freq in enumerate(freqs)]))
+        self.genl_request(NL80211_GENL_NAME, NL80211_CMD_TRIGGER_SCAN, attrs)
+
+    def wait_for_scan(self, ifindex, timeout):
+        """Wait for the scan started on an interface to finish.
+
+        The socket has to be subscribed to the scan multicast group
+        before the scan is triggered.
+
+        Keyword arguments:
+        ifindex -- integer containing the interface index
+        timeout -- seconds to wait for
+
+        Returns:
+        True if new scan results are available, False otherwise.
+
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for _, payload in self.receive(max(deadline - time.time(), 0)):
+                cmd, attrs = unpack_genl(payload)
+                if get_u32(attrs, NL80211_ATTR_IFINDEX) != ifindex:
+                    continue
+                if cmd == NL80211_CMD_NEW_SCAN_RESULTS:
+                    return True
+                if cmd == NL80211_CMD_SCAN_ABORTED:
+                    return False
+        return False
+
+    def get_scan(self, ifindex):
+        """Dump the scan results of an interface.
+
+        Returns:
+        A list of dicts containing the NL80211_BSS_* attributes.
+
+        """
+        replies = self.genl_request(NL80211_GENL_NAME, NL80211_CMD_GET_SCAN,
+                                    [pack_u32(NL80211_ATTR_IFINDEX, ifindex)],
+                                    NLM_F_DUMP)
+        return [unpack_attrs(attrs[NL80211_ATTR_BSS])
+                for _, attrs in replies if NL80211_ATTR_BSS in attrs]
+
+    def get_station(self, ifindex, mac):
+        """Get the station information for a peer.
+
+        Keyword arguments:
+        ifindex -- integer containing the interface index
+        mac -- bytes containing the hardware address of the peer
+
+        Returns:
+        A dict containing the NL80211_STA_INFO_* attributes.
+
+        """
+        replies = self.genl_request(NL80211_GENL_NAME,
+                                    NL80211_CMD_GET_STATION,
+                                    [pack_u32(NL80211_ATTR_IFINDEX, ifindex),
+                                     pack_attr(NL80211_ATTR_MAC, mac)])
+        for _, attrs in replies:
+            if NL80211_ATTR_STA_INFO in attrs:
+                return unpack_attrs(attrs[NL80211_ATTR_STA_INFO])
+        return {}
+
+    def get_interface(self, ifindex):
+        """Get the nl80211 attributes of an interface."""
+        replies = self.genl_request(NL80211_GENL_NAME,
+                                    NL80211_CMD_GET_INTERFACE,
+                                    [pack_u32(NL80211_ATTR_IFINDEX, ifindex)])
+        return replies[0][1] if replies else {}
+
+
+class RouteSocket(NetlinkSocket):
+    """Query and change links, addresses and routes through rtnetlink.
+
+    The changing requests are those of ip link set, ip addr flush and
+    replace and ip route flush, replace and del, for a single interface.
+    They raise NetlinkError when the kernel refuses them.
+
+    """
+    def __init__(self, sock=None):
+        """Open the socket."""
+        NetlinkSocket.__init__(self, NETLINK_ROUTE, sock)
+
+    def _dump(self, msg_type, payload):
+        """Dump objects, return the payloads of the replies."""
+        return [reply for _, reply in self.request(msg_type, payload,
+                                                   NLM_F_DUMP)]
+
+    def set_link_up(self, ifindex, up=True):
+        """Bring an interface up or down.
+
+        Keyword arguments:
+        ifindex -- integer containing the interface index
+        up -- whether to bring the interface up
+
+        """
+        self.request(RTM_NEWLINK, _ifinfomsg.pack(socket.AF_UNSPEC, 0,
+                                                  ifindex, IFF_UP if up else 0,
+                                                  IFF_UP))
+
+    def flush_addresses(self, ifindex, family=socket.AF_INET):
+        """Remove all the addresses of a family from an interface."""
+        for payload in self._dump(RTM_GETADDR,
+                                  _ifaddrmsg.pack(family, 0, 0, 0, 0)):
+            if _ifaddrmsg.unpack_from(payload)[4] != ifindex:
+                continue
+            # The dumped address is exactly what deleting it takes.
+            try:
+                self.request(RTM_DELADDR, payload)
+            except NetlinkError as e:
+                # Secondary addresses go away with their primary one.
+                if e.errno != errno.EADDRNOTAVAIL:
+                    raise
+
+    def replace_address(self, ifindex, address, prefixlen, broadcast=None):
+        """Add an IPv4 address to an interface, or update it.
+
+        Keyword arguments:
+        ifindex -- integer containing the interface index
+        address -- the address in dotted quad form
+        prefixlen -- integer containing the length of the netmask
+        broadcast -- the broadcast address in dotted quad form, derived
+                     from the netmask if not given
+
+        """
+        local = socket.inet_aton(address)
+        attrs = [pack_attr(IFA_LOCAL, local), pack_attr(IFA_ADDRESS, local)]
+        if broadcast:
+            attrs.append(pack_attr(IFA_BROADCAST,
+                                   socket.inet_aton(broadcast)))
+        elif prefixlen < 31:
+            # Like ip's "broadcast +", /31 and /32 have none.
+            host_bits = (1 << (32 - prefixlen)) - 1
+            attrs.append(pack_attr(IFA_BROADCAST, _u32.pack(
+                _u32.unpack(local)[0] | socket.htonl(host_bits))))
+        self.request(RTM_NEWADDR,
+                     _ifaddrmsg.pack(socket.AF_INET, prefixlen, 0,
+                                     RT_SCOPE_UNIVERSE, ifindex) +
+                     b''.join(attrs),
+                     NLM_F_CREATE | NLM_F_REPLACE)
+
+    def get_routes(self, family=socket.AF_INET):
+        """Dump the routes of a family, see unpack_route."""
+        return [unpack_route(payload) for payload in
+                self._dump(RTM_GETROUTE, _rtmsg.pack(family, 0, 0, 0, 0, 0,
+                                                     0, 0, 0))]
+
+    def flush_routes(self, ifindex, family=socket.AF_INET):
+        """Remove the routes of the main table through an interface."""
+        for payload in self._dump(RTM_GETROUTE,
+                                  _rtmsg.pack(family, 0, 0, 0, 0, 0, 0, 0,
+                                              0)):
+            route = unpack_route(payload)
+            if (route['ifindex'] != ifindex or
+                    route['table'] != RT_TABLE_MAIN):
+                continue
+            try:
+                self.request(RTM_DELROUTE, payload)
+            except NetlinkError as e:
+                # Already gone along with another one.
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def replace_default_route(self, ifindex, gateway):
+        """Set the IPv4 default route through a gateway on an interface."""
+        self.request(RTM_NEWROUTE,
+                     _rtmsg.pack(socket.AF_INET, 0, 0, 0, RT_TABLE_MAIN,
+                                 RTPROT_BOOT, RT_SCOPE_UNIVERSE, RTN_UNICAST,
+                                 0) +
+                     pack_attr(RTA_GATEWAY, socket.inet_aton(gateway)) +
+                     pack_u32(RTA_OIF, ifindex),
+                     NLM_F_CREATE | NLM_F_REPLACE)
+
+    def del_default_route(self, ifindex):
+        """Remove the IPv4 default route of an interface, if any."""
+        # RT_SCOPE_NOWHERE matches the route whatever its scope.
+        try:
+            self.request(RTM_DELROUTE,
+                         _rtmsg.pack(socket.AF_INET, 0, 0, 0, RT_TABLE_MAIN,
+                                     0, RT_SCOPE_NOWHERE, 0, 0) +
+                         pack_u32(RTA_OIF, ifindex))
+        except NetlinkError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def get_addresses(self, family=socket.AF_UNSPEC):
+        """Dump the addresses of all interfaces.
+
+        Keyword arguments:
+        family -- only dump the addresses of this family
+
+        Returns:
+        A dict mapping interface names to lists of dicts with the
+        address 'family', 'address', 'prefixlen' and 'scope' (0 for
+        global addresses), in the order the kernel reports them.
+
+        """
+        table = {}
+        names = {}
+        for payload in self._dump(RTM_GETADDR,
+                                  _ifaddrmsg.pack(family, 0, 0, 0, 0)):
+            family, prefixlen, _, scope, ifindex = \
+                _ifaddrmsg.unpack_from(payload)
+            attrs = unpack_attrs(payload[_ifaddrmsg.size:])
+            ifname = get_label(attrs) or names.get(ifindex)
+            if not ifname:
+                try:
+                    ifname = socket.if_indextoname(ifindex)
+                except OSError:
+                    continue
+            names[ifindex] = ifname
+            table.setdefault(ifname, []).append({
+                'family': family,
+                'address': get_address(attrs, family),
+                'prefixlen': prefixlen,
+                'scope': scope,
+            })
+        return table
+
+
+class RouteEventSocket(NetlinkSocket):
+    """Receive link and address change notifications from the kernel."""
+    def __init__(self, sock=None):
+        """Open the socket and subscribe to link and address changes."""
+        NetlinkSocket.__init__(self, NETLINK_ROUTE, sock)
+        for group in (RTNLGRP_LINK, RTNLGRP_IPV4_IFADDR, RTNLGRP_IPV6_IFADDR):
+            self.add_membership(group)
+
+    def read_events(self):
+        """Read the notifications waiting on the socket.
+
+        Only call this when the socket is readable, it blocks otherwise.
+
+        Returns:
+        A list of dicts, one per notification, with the message type
+        ('type'), the interface index and name ('ifindex', 'ifname')
+        and either the interface flags ('flags') for link messages or
+        the address family and address ('family', 'address') for
+        address messages.
+
+        """
+        events = []
+        for msg_type, payload in self.receive():
+            if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+                ifindex, flags, attrs = unpack_ifinfo(payload)
+                event = {'flags': flags,
+                         'ifname': get_string(attrs, IFLA_IFNAME)}
+            elif msg_type in (RTM_NEWADDR, RTM_DELADDR):
+                family, _, ifindex, attrs = unpack_ifaddr(payload)
+                event = {'family': family,
+                         'address': get_address(attrs, family),
+                         'ifname': get_label(attrs)}
+            else:
+                continue
+            event['type'] = msg_type
+            event['ifindex'] = ifindex
+            if not event['ifname']:
+                try:
+                    event['ifname'] = socket.if_indextoname(ifindex)
+                except OSError:
+                    # The interface is gone already.
+                    pass
+            events.append(event)
+        return events
@@ -12,6 +12,7 @@ class WirelessConnectThread() -- Connection thread for wireless
     interface
 class WiredConnectThread() -- Connection thread for wired
     interface
+class Stage() -- A connection step, see run_stages()
 
 """
 
@@ -44,6 +45,7 @@ import re
 import time
 import threading
 import os
+from concurrent import futures
 from signal import SIGTERM
 from functools import cmp_to_key
 
@@ -51,11 +53,15 @@ from functools import cmp_to_key
 from wicd.config import CFG
 from wicd import misc
 from wicd.backend import BackendManager
+from wicd.scanresults import ScanCache
+from wicd import wpasupplicant
 
 
 CFG.load()
 BACKEND = None
 BACKEND_MGR = BackendManager()
+# Workers running the connection steps which don't depend on each other.
+STAGE_WORKERS = 4
 
 
 def abortable(func):
@@ -76,6 +82,63 @@ def abortable(func):
     return wrapper
 
 
+class Stage(object):
+    """A step of a connection, run once the steps it requires are done."""
+    def __init__(self, name, func, requires=()):
+        """Initialize the stage.
+
+        Keyword arguments:
+        name -- the name other stages require it by
+        func -- function called without arguments to run the stage
+        requires -- names of the stages which must be done first
+
+        """
+        self.name = name
+        self.func = func
+        self.requires = frozenset(requires)
+
+
+def run_stages(stages, workers=STAGE_WORKERS):
+    """Run stages, at the same time where their requirements allow it.
+
+    Once a stage failed, e.g. with the SystemExit raised when the
+    connection is aborted, no other stage is started.  The running
+    ones are waited for, then the exception is raised again, so the
+    calling thread stops as if it had run the failed stage itself.
+
+    Keyword arguments:
+    stages -- list of Stage objects, started in order when ready
+    workers -- how many stages may run at once
+
+    """
+    pending = list(stages)
+    done = set()
+    running = {}
+    error = None
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            if error is None:
+                for stage in [stage for stage in pending
+                              if stage.requires <= done]:
+                    pending.remove(stage)
+                    running[pool.submit(stage.func)] = stage
+            if not running:
+                break
+            finished = futures.wait(running,
+                                    return_when=futures.FIRST_COMPLETED)[0]
+            for future in finished:
+                stage = running.pop(future)
+                if future.exception() is None:
+                    done.add(stage.name)
+                elif error is None:
+                    error = future.exception()
+    if error is not None:
+        raise error
+    if pending:
+        raise ValueError('Unknown or circular stage requirements: %s' %
+                         ', '.join(stage.name for stage in pending))
+
+
 def get_backend_list():
     """Returns a list of available backends."""
     if BACKEND_MGR:
@@ -218,6 +281,15 @@ class Controller(object):
         """
         return self.iface.GetIP(ifconfig)
 
+    def GetIPv6Addresses(self):
+        """Get the IPv6 addresses of the interface.
+
+        Returns:
+        A list of addresses in address/prefixlen form.
+
+        """
+        return self.iface.GetIPv6Addresses()
+
     def Disconnect(self, nettype, name, mac):
         """Disconnect from the network."""
         iface = self.iface
@@ -235,8 +307,12 @@ class Controller(object):
                                                     mac, name),
                                self.debug)
         iface.ReleaseDHCP()
-        iface.SetAddress('0.0.0.0')
-        iface.FlushRoutes()
+        iface.StartBatch()
+        try:
+            iface.SetAddress('0.0.0.0')
+            iface.FlushRoutes()
+        finally:
+            iface.CommitBatch()
         iface.FlushDNS()
         iface.Down()
         iface.Up()
@@ -442,6 +518,41 @@ class ConnectThread(threading.Thread):
             misc.ExecuteScript(expand_script_macros(script, msg, bssid, essid),
                                self.debug)
 
+    def tear_down(self, iface):
+        """Take down the interface and clean up previous connections.
+
+        Releasing the DHCP leases, stopping wpa_supplicant and flushing
+        the DNS servers don't depend on each other nor on the interface
+        being down, so they run at the same time.  Addresses and routes
+        are reset once the interface is down and the DHCP client gone,
+        so it can't configure them again.
+
+        """
+        def reset_addresses():
+            iface.StartBatch()
+            try:
+                self.reset_ip_addresses(iface)
+                self.flush_routes(iface)
+            finally:
+                self.commit_batch(iface)
+
+        run_stages([
+            Stage('down', lambda: self.put_iface_down(iface)),
+            Stage('dhcp', lambda: self.release_dhcp_clients(iface)),
+            Stage('wpa', lambda: self.stop_wpa(iface)),
+            Stage('dns', lambda: self.flush_dns_addresses(iface)),
+            Stage('addresses', reset_addresses, requires=('down', 'dhcp')),
+        ])
+
+    def commit_batch(self, iface):
+        """Apply the address and route changes queued on iface.
+
+        Not abortable, so changes queued before an abort still get
+        applied.
+
+        """
+        iface.CommitBatch()
+
     @abortable
     def flush_routes(self, iface):
         """Flush the routes for both wired/wireless interfaces."""
@@ -468,10 +579,15 @@ class ConnectThread(threading.Thread):
         if self.network.get('ip'):
             self.SetStatus('setting_static_ip')
             print(('Setting static IP : ' + self.network['ip']))
-            iface.SetAddress(self.network['ip'], self.network['netmask'])
-            if self.network.get('gateway'):
-                print(('Setting default gateway : ' + self.network['gateway']))
-                iface.SetDefaultRoute(self.network['gateway'])
+            iface.StartBatch()
+            try:
+                iface.SetAddress(self.network['ip'], self.network['netmask'])
+                if self.network.get('gateway'):
+                    print(('Setting default gateway : ' +
+                           self.network['gateway']))
+                    iface.SetDefaultRoute(self.network['gateway'])
+            finally:
+                self.commit_batch(iface)
         else:
             # Run dhcp...
             self.SetStatus('running_dhcp')
@@ -597,13 +713,19 @@ class Wireless(Controller):
         """Initialize the class."""
         Controller.__init__(self, debug=debug)
         self._wpa_driver = None
+        self._persistent_supplicant = False
         self._wireless_interface = None
         self.wiface = None
         self.should_verify_ap = True
+        self.scan_cache = ScanCache()
+        self.passive_scan_max_age = 30
+        # Whether the last scan only covered the frequencies asked for.
+        self.limited_scan = False
 
     def set_wireless_iface(self, value):
         """Setter for wireless_interface property."""
         self._wireless_interface = value
+        self.scan_cache.clear()
         if self.wiface:
             self.wiface.SetInterface(value)
 
@@ -623,6 +745,18 @@ class Wireless(Controller):
         return self._wpa_driver
     wpa_driver = property(get_wpa_driver, set_wpa_driver)
 
+    def set_persistent_supplicant(self, value):
+        """Setter for persistent_supplicant property."""
+        self._persistent_supplicant = value
+        if self.wiface:
+            self.wiface.SetPersistentSupplicant(value)
+
+    def get_persistent_supplicant(self):
+        """Getter for persistent_supplicant property."""
+        return self._persistent_supplicant
+    persistent_supplicant = property(get_persistent_supplicant,
+                                     set_persistent_supplicant)
+
     def set_iface(self, value):
         """Setter for iface property."""
         self.wiface = value
@@ -645,15 +779,23 @@ class Wireless(Controller):
             self.wiface = backend.WirelessInterface(self.wireless_interface,
                                                     self.debug,
                                                     self.wpa_driver)
+            self.wiface.SetPersistentSupplicant(self.persistent_supplicant)
 
-    def Scan(self, essid=None):
+    def Scan(self, essid=None, freqs=None):
         """Scan for available wireless networks.
 
         Keyword arguments:
         essid -- The essid of a hidden network
+        freqs -- Frequencies (MHz) to limit the scan to, all if None
+
+        When neither wpa_supplicant nor the backend can limit the scan
+        to freqs, all the channels are scanned and limited_scan is set
+        to False.
 
         Returns:
-        A list of available networks sorted by strength.
+        A ScanResults list of available networks sorted by strength.
+        Networks missed by this scan are kept in the list until they
+        haven't been seen for scan_cache.ttl seconds.
 
         """
         def comp(x, y):
@@ -684,7 +826,27 @@ class Wireless(Controller):
             # sleep for a bit; scanning to fast will result in nothing
             time.sleep(1)
 
-        aps = wiface.GetNetworks(essid)
+        networks = None
+        if freqs:
+            # Scanning a few channels is much quicker than scanning all
+            # of them; wpa_supplicant can do that with any driver.
+            networks = wpasupplicant.ScanFrequencies(wiface.iface, freqs)
+            if networks is None and wiface.scans_frequencies:
+                networks = wiface.GetNetworks(essid, freqs)
+        elif essid is None and self.passive_scan_max_age:
+            # wpa_supplicant keeps scanning in the background while it
+            # runs; when its results are recent enough, use them instead
+            # of an active scan, which stalls traffic on the link.
+            networks = wpasupplicant.GetBSSNetworks(
+                wiface.iface, self.passive_scan_max_age)
+            if networks is not None and self.debug:
+                print('using the wpa_supplicant BSS table (%d networks)' %
+                      len(networks))
+        self.limited_scan = bool(freqs) and networks is not None
+        if networks is None:
+            networks = wiface.GetNetworks(essid)
+
+        aps = self.scan_cache.update(networks)
         aps.sort(key=cmp_to_key(comp), reverse=True)
 
         return aps
@@ -788,10 +950,28 @@ class Wireless(Controller):
         """
         return self.wiface.GetAvailableBitrates()
 
+    def GetAvailableBitratesAsync(self, callback):
+        """Get the available bitrates without blocking.
+
+        Keyword arguments:
+        callback -- function called with the bitrates
+
+        """
+        self.wiface.GetAvailableBitratesAsync(callback)
+
     def GetIwconfig(self):
         """Get the out of iwconfig."""
         return self.wiface.GetIwconfig()
 
+    def GetIwconfigAsync(self, callback):
+        """Get the output of iwconfig without blocking.
+
+        Keyword arguments:
+        callback -- function called with the output
+
+        """
+        self.wiface.GetIwconfigAsync(callback)
+
     def GetWpaSupplicantDrivers(self):
         """Returns all valid wpa_supplicant drivers on the system."""
         return BACKEND.GetWpaSupplicantDrivers()
@@ -878,7 +1058,21 @@ class Wireless(Controller):
         True if rfkill (soft-)switch is enabled.
         """
         cmd = 'rfkill list'
-        rfkill_out = misc.Run(cmd)
+        return self._parse_rfkill(misc.Run(cmd, coalesce=True))
+
+    def GetRfKillStatusAsync(self, callback):
+        """Determines if the rfkill switch is active without blocking.
+
+        Keyword arguments:
+        callback -- function called with True if rfkill (soft-)switch
+                    is enabled
+
+        """
+        misc.RunAsync('rfkill list',
+                      lambda output: callback(self._parse_rfkill(output)))
+
+    def _parse_rfkill(self, rfkill_out):
+        """Return True if rfkill list output shows a soft block."""
         soft_blocks = [x for x in rfkill_out.split('\t')
                        if x.startswith('Soft')]
         for line in [x.strip() for x in soft_blocks]:
@@ -971,12 +1165,7 @@ class WirelessConnectThread(ConnectThread):
                                   self.network['bssid'], self.network['essid'])
 
         # Take down interface and clean up previous connections.
-        self.put_iface_down(wiface)
-        self.release_dhcp_clients(wiface)
-        self.reset_ip_addresses(wiface)
-        self.stop_wpa(wiface)
-        self.flush_routes(wiface)
-        self.flush_dns_addresses(wiface)
+        self.tear_down(wiface)
         wiface.SetMode(self.network['mode'])
         wiface.SetBitrate(self.bitrate, self.allow_lower_bitrates)
 
@@ -1049,8 +1238,12 @@ class WirelessConnectThread(ConnectThread):
             if retcode:
                 print("Connection Failed: Failed to ping the access point!")
                 # Clean up before aborting.
-                iface.SetAddress('0.0.0.0')
-                iface.FlushRoutes()
+                iface.StartBatch()
+                try:
+                    iface.SetAddress('0.0.0.0')
+                    iface.FlushRoutes()
+                finally:
+                    self.commit_batch(iface)
                 iface.FlushDNS()
                 if hasattr(iface, "StopWPA"):
                     iface.StopWPA()
@@ -1241,12 +1434,7 @@ class WiredConnectThread(ConnectThread):
                                   'wired', 'wired')
 
         # Take down interface and clean up previous connections.
-        self.put_iface_down(liface)
-        self.release_dhcp_clients(liface)
-        self.reset_ip_addresses(liface)
-        self.stop_wpa(liface)
-        self.flush_routes(liface)
-        self.flush_dns_addresses(liface)
+        self.tear_down(liface)
 
         # Bring up interface.
         self.put_iface_up(liface)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""WPA pre-shared key derivation for wicd.
+
+The PSK of a WPA passphrase is PBKDF2-SHA1 of the passphrase, salted
+with the ESSID, over 4096 iterations, which is what wpa_passphrase
+computes.  It is derived here instead of running wpa_passphrase, and
+kept in a root-only cache so reconnecting to a network doesn't derive
+it again.
+
+Cached keys are looked up by ESSID and checked against a digest of the
+passphrase, so changing the key of a profile makes the cached PSK
+useless; the daemon also forgets it right away (see forget).
+
+DerivePSK() -- Compute the PSK of a passphrase.
+class PSKCache() -- Remember the PSKs already derived.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import json
+import os
+import threading
+
+from wicd.config import CFG
+
+CACHE_FILE = 'psk_cache'
+ITERATIONS = 4096
+
+
+def DerivePSK(essid, passphrase):
+    """Compute the PSK of a passphrase, like wpa_passphrase does.
+
+    Keyword arguments:
+    essid -- the ESSID of the network
+    passphrase -- the passphrase, 8 to 63 printable ASCII characters
+
+    Returns:
+    The PSK as 64 hex digits, or None if the passphrase isn't valid
+    (a 64 hex digits key is already a PSK).
+
+    """
+    if not 8 <= len(passphrase) <= 63:
+        return None
+    if any(not 32 <= ord(char) <= 126 for char in passphrase):
+        return None
+    return hashlib.pbkdf2_hmac('sha1', passphrase.encode('ascii'),
+                               essid.encode('utf-8'), ITERATIONS, 32).hex()
+
+
+def _digest(essid, passphrase):
+    """Return the digest a cached PSK is checked against."""
+    return hashlib.sha256(('%s\0%s' % (essid, passphrase)).encode(
+        'utf-8')).hexdigest()
+
+
+class PSKCache(object):
+    """Remember the PSKs already derived, in a root-only file."""
+    def __init__(self, path=None):
+        """Initialize the cache, which is loaded on first use.
+
+        Keyword arguments:
+        path -- the file the cache is saved to, CACHE_FILE in the wicd
+                state directory by default
+
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _file(self):
+        """Return the path of the cache file."""
+        return self.path or os.path.join(CFG.varlib, CACHE_FILE)
+
+    def _load(self):
+        """Read the saved cache, if any."""
+        if self._entries is not None:
+            return
+        try:
+            with open(self._file()) as f:
+                self._entries = json.load(f)
+        except (IOError, ValueError):
+            self._entries = {}
+        if not isinstance(self._entries, dict):
+            self._entries = {}
+
+    def _save(self):
+        """Write the cache, readable by its owner only."""
+        path = self._file()
+        tmp = path + '.tmp'
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, path)
+        except (IOError, OSError) as e:
+            print("Couldn't save the PSK cache to %s: %s" % (path, e))
+
+    def get(self, essid, passphrase):
+        """Return the PSK of a passphrase, deriving it if needed.
+
+        Keyword arguments:
+        essid -- the ESSID of the network
+        passphrase -- the passphrase
+
+        Returns:
+        The PSK as 64 hex digits, or None (see DerivePSK).
+
+        """
+        digest = _digest(essid, passphrase)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(essid)
+            if entry and entry.get('digest') == digest:
+                return entry['psk']
+        psk = DerivePSK(essid, passphrase)
+        if psk is None:
+            return None
+        with self._lock:
+            self._entries[essid] = {'digest': digest, 'psk': psk}
+            self._save()
+        return psk
+
+    def forget(self, essid):
+        """Drop the PSK cached for a network, e.g. when its key changed."""
+        with self._lock:
+            self._load()
+            if self._entries.pop(essid, None) is not None:
+                self._save()
+
+
+# The cache used by the interfaces.
+CACHE = PSKCache()
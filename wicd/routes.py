@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Routing table reader for wicd.
+
+This module reads the kernel routing tables from /proc/net/route and
+/proc/net/ipv6_route, so finding the default gateway or checking whether
+an interface has routes to flush doesn't need to run route or ip.
+
+GetRoutes() -- Return a snapshot of the IPv4 and IPv6 routes.
+GetDefaultGateway() -- Return the gateway of the best IPv4 default route.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import socket
+import struct
+
+IPV4_ROUTES = '/proc/net/route'
+IPV6_ROUTES = '/proc/net/ipv6_route'
+
+# Got these from /usr/include/linux/route.h
+RTF_UP = 0x0001
+RTF_GATEWAY = 0x0002
+RTF_HOST = 0x0004
+RTF_REJECT = 0x0200
+
+
+def _read_lines(path):
+    """Return the lines of path."""
+    with open(path) as f:
+        return f.readlines()
+
+
+def _ipv4(value):
+    """Decode an address of /proc/net/route (hex, host byte order)."""
+    return socket.inet_ntoa(struct.pack('=I', int(value, 16)))
+
+
+def _ipv6(value):
+    """Decode an address of /proc/net/ipv6_route (hex, network order)."""
+    return socket.inet_ntop(socket.AF_INET6, bytes.fromhex(value))
+
+
+def ReadIPv4Routes(path=IPV4_ROUTES):
+    """Parse the IPv4 routing table.
+
+    Keyword arguments:
+    path -- the file to read, in the format of /proc/net/route
+
+    Returns:
+    A list of route dicts, see GetRoutes.
+
+    """
+    routes = []
+    # The first line holds the column names.
+    for line in _read_lines(path)[1:]:
+        fields = line.split()
+        if len(fields) < 11:
+            continue
+        flags = int(fields[3], 16)
+        if not flags & RTF_UP:
+            continue
+        routes.append({
+            'iface': fields[0],
+            'family': socket.AF_INET,
+            'destination': _ipv4(fields[1]),
+            'prefixlen': bin(int(fields[7], 16)).count('1'),
+            'gateway': _ipv4(fields[2]) if flags & RTF_GATEWAY else None,
+            'metric': int(fields[6]),
+            'flags': flags,
+        })
+    return routes
+
+
+def ReadIPv6Routes(path=IPV6_ROUTES):
+    """Parse the IPv6 routing table.
+
+    Keyword arguments:
+    path -- the file to read, in the format of /proc/net/ipv6_route
+
+    Returns:
+    A list of route dicts, see GetRoutes.  Unreachable routes (as the
+    kernel puts on lo) are left out.
+
+    """
+    routes = []
+    for line in _read_lines(path):
+        fields = line.split()
+        if len(fields) < 10:
+            continue
+        flags = int(fields[8], 16)
+        if not flags & RTF_UP or flags & RTF_REJECT:
+            continue
+        routes.append({
+            'iface': fields[9],
+            'family': socket.AF_INET6,
+            'destination': _ipv6(fields[0]),
+            'prefixlen': int(fields[1], 16),
+            'gateway': _ipv6(fields[4]) if flags & RTF_GATEWAY else None,
+            'metric': int(fields[5], 16),
+            'flags': flags,
+        })
+    return routes
+
+
+def GetRoutes(iface=None, family=None, ipv4_path=IPV4_ROUTES,
+              ipv6_path=IPV6_ROUTES):
+    """Return a snapshot of the routing tables.
+
+    Keyword arguments:
+    iface -- only return the routes through this interface
+    family -- only return the routes of this address family
+    ipv4_path -- the IPv4 routing table to read
+    ipv6_path -- the IPv6 routing table to read
+
+    Returns:
+    A list of dicts, one per route, with the interface ('iface'), the
+    address family ('family'), the destination network ('destination'
+    and 'prefixlen'), the gateway ('gateway', None for direct routes),
+    the 'metric' and the RTF_* 'flags'.
+
+    Raises IOError if a routing table can't be read.
+
+    """
+    routes = []
+    if family in (None, socket.AF_INET):
+        routes.extend(ReadIPv4Routes(ipv4_path))
+    if family in (None, socket.AF_INET6):
+        routes.extend(ReadIPv6Routes(ipv6_path))
+    if iface is not None:
+        routes = [route for route in routes if route['iface'] == iface]
+    return routes
+
+
+def GetDefaultRoutes(iface=None, family=socket.AF_INET, **paths):
+    """Return the default routes, best (lowest metric) first.
+
+    Takes the same arguments as GetRoutes.
+
+    """
+    routes = [route for route in GetRoutes(iface, family, **paths)
+              if route['prefixlen'] == 0]
+    return sorted(routes, key=lambda route: route['metric'])
+
+
+def GetDefaultGateway(**paths):
+    """Return the gateway of the best IPv4 default route, or None."""
+    try:
+        default_routes = GetDefaultRoutes(**paths)
+    except IOError as e:
+        print("Couldn't read the routing table: %s" % e)
+        return None
+    for route in default_routes:
+        if route['gateway']:
+            return route['gateway']
+    return None
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compact storage for wireless scan results.
+
+Every scanned network used to be a plain dict, which then grew all the
+options of its profile.  With lots of networks around, the per dict
+overhead dominates the memory used by the daemon, so scan results are
+kept in records with a fixed slot per scan field instead, and profile
+options go to a (lazily created) overflow dict.
+
+class AccessPoint() -- A scanned network, usable as a dict.
+class ScanResults() -- An ordered list of AccessPoints.
+class ScanCache() -- Merges consecutive scans, aging out old networks.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import sys
+import time
+from collections.abc import MutableMapping
+from collections.abc import MutableSequence
+
+# The fields every backend fills in for a scanned network, and the time
+# the ScanCache last saw it.
+FIELDS = ('bssid', 'essid', 'hidden', 'channel', 'mode', 'encryption',
+          'encryption_method', 'quality', 'strength', 'bitrates',
+          'last_seen')
+_FIELD_SET = frozenset(FIELDS)
+
+# Fields with only a handful of possible values, shared between records.
+_INTERNED = frozenset(('channel', 'mode', 'encryption_method'))
+
+
+class AccessPoint(MutableMapping):
+    """A scanned network, usable as a dict.
+
+    Unset fields behave like missing keys, just as they did with plain
+    dicts.
+
+    """
+    __slots__ = FIELDS + ('_extra',)
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the record, taking the same arguments as dict()."""
+        self._extra = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            if key in _INTERNED and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            # Option names repeat in every profile, share them.
+            self._extra[sys.intern(str(key))] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __iter__(self):
+        for key in FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        length = sum(1 for key in FIELDS if hasattr(self, key))
+        if self._extra is not None:
+            length += len(self._extra)
+        return length
+
+    def __repr__(self):
+        return 'AccessPoint(%r)' % dict(self)
+
+    def copy(self):
+        """Return a shallow copy of the record."""
+        return AccessPoint(self)
+
+
+class ScanResults(MutableSequence):
+    """An ordered list of AccessPoints.
+
+    Networks are addressed by their position, as the network ids used
+    over D-Bus always were, and can be looked up by bssid too.
+
+    """
+    __slots__ = ('_aps', '_by_bssid')
+
+    def __init__(self, aps=()):
+        """Initialize the list, turning the given networks into records."""
+        self._aps = [_record(ap) for ap in aps]
+        self._by_bssid = None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ScanResults(self._aps[index])
+        return self._aps[index]
+
+    def __setitem__(self, index, ap):
+        if isinstance(index, slice):
+            self._aps[index] = [_record(x) for x in ap]
+        else:
+            self._aps[index] = _record(ap)
+        self._by_bssid = None
+
+    def __delitem__(self, index):
+        del self._aps[index]
+        self._by_bssid = None
+
+    def __len__(self):
+        return len(self._aps)
+
+    def __repr__(self):
+        return 'ScanResults(%r)' % self._aps
+
+    def insert(self, index, ap):
+        """Insert a network before index."""
+        self._aps.insert(index, _record(ap))
+        self._by_bssid = None
+
+    def sort(self, key=None, reverse=False):
+        """Sort the networks in place, like list.sort()."""
+        self._aps.sort(key=key, reverse=reverse)
+        self._by_bssid = None
+
+    def find(self, bssid):
+        """Return the network id of the network with bssid, or -1."""
+        if self._by_bssid is not None:
+            index = self._by_bssid.get(bssid, -1)
+            if index == -1 or self._aps[index].get('bssid') == bssid:
+                return index
+        # Build the index (again, in case a bssid was edited).
+        self._by_bssid = dict((ap.get('bssid'), index)
+                              for index, ap in enumerate(self._aps))
+        return self._by_bssid.get(bssid, -1)
+
+
+class ScanCache(object):
+    """Merges consecutive scans, aging out old networks.
+
+    A single scan regularly misses networks which are around (5 GHz DFS
+    channels are only scanned passively), so networks are remembered
+    for ttl seconds after they were last seen.  Their quality and
+    strength are smoothed over the scans they show up in, which keeps
+    the network list from jumping around.
+
+    """
+    # Weight of the newest sample in the smoothed quality and strength.
+    SMOOTHING = 0.5
+
+    def __init__(self, ttl=30, clock=time.monotonic):
+        """Initialize the cache.
+
+        Keyword arguments:
+        ttl -- seconds a network is kept after it was last seen, 0
+               disables the cache
+        clock -- function returning the current (monotonic) time
+
+        """
+        self.ttl = ttl
+        self._clock = clock
+        # bssid -> [AccessPoint, time last seen, quality, strength]
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Forget all cached networks."""
+        self._entries.clear()
+
+    def update(self, scan):
+        """Merge a scan into the cache.
+
+        Keyword arguments:
+        scan -- list of networks returned by the backend
+
+        Returns:
+        A ScanResults list holding copies of the networks of the scan
+        and those seen during the last ttl seconds.
+
+        """
+        if not self.ttl:
+            self._entries.clear()
+            return ScanResults(scan)
+        now = self._clock()
+        last_seen = time.time()
+        for network in scan:
+            ap = AccessPoint(network)
+            ap['last_seen'] = last_seen
+            entry = self._entries.get(ap.get('bssid'))
+            quality = _number(ap.get('quality'), 0, 100)
+            strength = _number(ap.get('strength'), -200, -1)
+            if entry is not None:
+                quality = self._smooth(entry[2], quality)
+                strength = self._smooth(entry[3], strength)
+                if quality is not None:
+                    ap['quality'] = int(round(quality))
+                if strength is not None:
+                    ap['strength'] = type(ap['strength'])(
+                        int(round(strength)))
+            self._entries[ap.get('bssid')] = [ap, now, quality, strength]
+
+        for bssid, entry in list(self._entries.items()):
+            if now - entry[1] > self.ttl:
+                del self._entries[bssid]
+        return ScanResults(entry[0].copy()
+                           for entry in self._entries.values())
+
+    def _smooth(self, old, new):
+        """Return the exponentially weighted average of old and new."""
+        if old is None or new is None:
+            return new
+        return self.SMOOTHING * new + (1 - self.SMOOTHING) * old
+
+
+def _number(value, low, high):
+    """Return value as a float if it is a number in [low, high]."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if low <= value <= high:
+        return value
+    return None
+
+
+def _record(ap):
+    """Return ap as an AccessPoint."""
+    if isinstance(ap, AccessPoint):
+        return ap
+    return AccessPoint(ap)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Encryption templates for wicd.
+
+A template (see the files in the encryption directory) starts with a
+header naming the fields it needs, followed by the wpa_supplicant
+configuration in which $_FIELD is replaced with the value of the field.
+
+Templates are compiled once into a list of literal strings and
+placeholders, and compiled again only when their file changes.  The
+placeholders are checked against the fields the header declares when
+compiling, so a broken template is reported when it is loaded rather
+than when connecting.  The configuration files rendered from them are
+written atomically, and not written again when their content is the
+same.
+
+class Template() -- A compiled encryption template.
+class TemplateCache() -- Load the templates, write the configurations.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import copy
+import hashlib
+import os
+import re
+import threading
+import zlib
+
+from wicd.config import CFG
+
+PLACEHOLDER = re.compile(r'\$_([A-Z0-9_]+)')
+# Fields filled in by wicd rather than by the user.
+IMPLICIT_FIELDS = ('essid', 'bssid', 'psk', 'scan', 'key_index')
+# Values used for the fields a network leaves empty.
+DEFAULTS = {'scan': '1', 'key_index': '0'}
+
+
+def _stamp(path):
+    """Return what tells whether a file changed, or None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _parse_fields(fields):
+    """Parse a list of 'field *Display_Name' pairs.
+
+    Returns:
+    A list of [field, display name] lists, or None if the line is
+    malformed.
+
+    """
+    fields = fields.split(" ")
+    # We need an even number of entries in the line for it to be valid.
+    if (len(fields) % 2) != 0:
+        return None
+    ret = []
+    for val, disp_val in zip(fields[::2], fields[1::2]):
+        if val.startswith("*") or not disp_val.startswith("*"):
+            return None
+        ret.append([val, disp_val[1:]])
+    return ret
+
+
+class Template(object):
+    """A compiled encryption template."""
+    def __init__(self, enctype, lines):
+        """Compile a template.
+
+        Keyword arguments:
+        enctype -- the name of the template file
+        lines -- the lines of the template file
+
+        """
+        self.enctype = enctype
+        self.info = {'type': enctype, 'fields': [], 'optional': [],
+                     'required': [], 'protected': [], 'name': ""}
+        self.valid = False
+        # Literal strings, and lists alternating literal strings and
+        # placeholder names, as made by PLACEHOLDER.split().
+        self.plan = []
+        body = self._parse_header(lines)
+        self._compile(body)
+        self._validate()
+
+    def _parse_header(self, lines):
+        """Read the fields the template declares.
+
+        Returns:
+        The lines of the configuration.
+
+        """
+        def parse_ent(line, key):
+            return line.replace(key, "").replace("=", "").strip()
+
+        info = self.info
+        for line in lines:
+            if line.startswith("name") and not info["name"]:
+                info["name"] = parse_ent(line, "name")
+            elif line.startswith(("require", "optional", "protected")):
+                key = [key for key in ("require", "optional", "protected")
+                       if line.startswith(key)][0]
+                section = 'required' if key == 'require' else key
+                fields = _parse_fields(parse_ent(line, key))
+                if not fields:
+                    # An error occured parsing the line.
+                    print("Invalid '%s' line found in template %s" %
+                          (section, self.enctype))
+                    continue
+                info[section] = fields
+            elif line.startswith("----"):
+                # We're done.
+                break
+        for index, line in enumerate(lines):
+            if line.strip().startswith('---'):
+                return lines[index + 1:]
+        return []
+
+    def _compile(self, body):
+        """Turn the configuration into the render plan."""
+        literal = []
+        for line in body:
+            parts = PLACEHOLDER.split(line)
+            if len(parts) == 1:
+                literal.append(line)
+                continue
+            if literal:
+                self.plan.append(''.join(literal))
+                literal = []
+            self.plan.append(parts)
+        if literal:
+            self.plan.append(''.join(literal))
+
+    def _validate(self):
+        """Check the fields used and declared, set valid."""
+        info = self.info
+        if not info["required"]:
+            print("Failed to find a 'require' line in template %s" %
+                  self.enctype)
+            return
+        if not info["name"]:
+            print("Failed to find a 'name' line in template %s" %
+                  self.enctype)
+            return
+        declared = set(field for field, name in
+                       info["required"] + info["optional"])
+        for field, name in info["protected"]:
+            if field not in declared:
+                print("Protected field %s of template %s is neither "
+                      "required nor optional" % (field, self.enctype))
+        for step in self.plan:
+            if isinstance(step, str):
+                continue
+            for placeholder in step[1::2]:
+                field = placeholder.lower()
+                if field not in declared and field not in IMPLICIT_FIELDS:
+                    print("Template %s uses the undeclared field %s" %
+                          (self.enctype, field))
+        self.valid = True
+
+    def render(self, network):
+        """Make the configuration of a network.
+
+        Keyword arguments:
+        network -- dictionary containing network info
+
+        Returns:
+        The contents of the configuration file.
+
+        """
+        if network.get('essid'):
+            config = ["ap_scan=1\n"]
+        else:
+            config = ["ap_scan=0\n"]
+        for step in self.plan:
+            if isinstance(step, str):
+                config.append(step)
+                continue
+            line = list(step)
+            ignored = False
+            for index in range(1, len(line), 2):
+                field = line[index].lower()
+                value = network.get(field) or DEFAULTS.get(field)
+                if value:
+                    line[index] = str(value)
+                else:
+                    line[index] = '$_' + line[index]
+                    ignored = True
+            line = ''.join(line)
+            if ignored:
+                print("Ignoring template line: '%s'" % line)
+            config.append(line)
+        return ''.join(config)
+
+
+class TemplateCache(object):
+    """Load the encryption templates, write the configurations."""
+    def __init__(self, directory=None):
+        """Initialize the cache.
+
+        Keyword arguments:
+        directory -- where the templates are, the wicd encryption
+                     directory by default
+
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._active = {}
+        self._written = {}
+
+    def _path(self, name):
+        """Return the path of a file of the template directory."""
+        return os.path.join(self.directory or CFG.encryption, name)
+
+    def get(self, enctype):
+        """Return the compiled template enctype.
+
+        Raises:
+        IOError if the template file can't be read.
+
+        """
+        path = self._path(enctype)
+        stamp = _stamp(path)
+        with self._lock:
+            entry = self._templates.get(enctype)
+            if entry and stamp is not None and entry[0] == stamp:
+                return entry[1]
+        with open(path) as f:
+            template = Template(enctype, f.readlines())
+        with self._lock:
+            self._templates[enctype] = (stamp, template)
+        return template
+
+    def active(self, wired=False):
+        """Return the names of the templates listed as active.
+
+        Raises:
+        IOError if the list is missing.
+
+        """
+        path = self._path("active_wired" if wired else "active")
+        stamp = _stamp(path)
+        with self._lock:
+            entry = self._active.get(path)
+            if entry and stamp is not None and entry[0] == stamp:
+                return list(entry[1])
+        with open(path) as f:
+            enctypes = [line.strip() for line in f]
+        with self._lock:
+            self._active[path] = (stamp, enctypes)
+        return list(enctypes)
+
+    def methods(self, wired=False):
+        """Return the descriptions of the valid active templates.
+
+        Raises:
+        IOError if the list of the active templates is missing.
+
+        """
+        methods = []
+        for enctype in self.active(wired):
+            try:
+                template = self.get(enctype)
+            except IOError:
+                print("Failed to open template file %s" % enctype)
+                continue
+            if template.valid:
+                methods.append(copy.deepcopy(template.info))
+        return methods
+
+    def catalog(self, wired=False):
+        """Return the valid active templates with their version.
+
+        The version only depends on the descriptions of the templates,
+        so it stays the same across daemon restarts and changes when a
+        template is added, removed or changed.
+
+        Returns:
+        A tuple of the version, a non-zero integer, and the list of
+        the descriptions (see methods).
+
+        """
+        methods = self.methods(wired)
+        version = zlib.crc32(repr(methods).encode('utf-8')) or 1
+        return version, methods
+
+    def write(self, path, config):
+        """Write a configuration file, readable by root only.
+
+        The file is replaced atomically, and left alone if it already
+        holds config.
+
+        Returns:
+        True if the file was written.
+
+        """
+        digest = hashlib.sha256(config.encode('utf-8')).hexdigest()
+        with self._lock:
+            if self._written.get(path) == (digest, _stamp(path)):
+                return False
+            tmp = path + '.tmp'
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                # Protect the file before writing the secrets in it.
+                os.fchmod(fd, 0o600)
+                os.fchown(fd, 0, 0)
+                f.write(config)
+            os.replace(tmp, path)
+            self._written[path] = (digest, _stamp(path))
+            return True
+
+
+# The templates used by the daemon and the clients.
+TEMPLATES = TemplateCache()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Discovery cache for the external tools wicd uses.
+
+Every interface object looks for about fifteen programs on the PATH and
+asks some of them what they support (dhclient --version, wpa_supplicant
+-h...).  What was found is kept here, shared by all the interface
+objects and saved under /var/lib/wicd, so starting the daemon or
+switching interfaces runs nothing as long as nothing changed on disk.
+
+Lookups stay valid as long as the PATH and the modification times of
+its directories are the same, which change when programs are installed
+or removed.  Probe outputs are keyed by the path and the modification
+time of the program, so an upgraded program is asked again.
+
+class ToolCache() -- Find programs and remember what they report.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import threading
+import time
+
+from wicd.config import CFG
+from wicd import misc
+
+CACHE_FILE = 'tools.json'
+# Bumped when the layout of the cache file changes.
+VERSION = 1
+# Seconds during which the PATH directories aren't checked again.
+CHECK_INTERVAL = 2
+DEFAULT_PATH = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+
+
+def _mtime(path):
+    """Return the modification time of path in ns, or None."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ToolCache(object):
+    """Find programs and remember what they report."""
+    def __init__(self, path=None, clock=time.monotonic):
+        """Initialize the cache, which is loaded on first use.
+
+        Keyword arguments:
+        path -- the file the cache is saved to, CACHE_FILE in the wicd
+                state directory by default
+        clock -- function returning the current (monotonic) time
+
+        """
+        self.path = path
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._data = None
+        self._checked = None
+
+    def _file(self):
+        """Return the path of the cache file."""
+        return self.path or os.path.join(CFG.varlib, CACHE_FILE)
+
+    def _load(self):
+        """Read the saved cache, or start an empty one."""
+        data = None
+        try:
+            with open(self._file()) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            pass
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            data = {'version': VERSION}
+        data.setdefault('search_path', None)
+        data.setdefault('dirs', {})
+        data.setdefault('programs', {})
+        data.setdefault('probes', {})
+        return data
+
+    def _save(self):
+        """Write the cache, atomically."""
+        path = self._file()
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self._data, f, indent=1, sort_keys=True)
+            os.replace(tmp, path)
+        except (IOError, OSError) as e:
+            print("Couldn't save the tool cache to %s: %s" % (path, e))
+
+    def _search_path(self):
+        """Return the directories programs are looked for in."""
+        return (os.getenv("PATH") or DEFAULT_PATH).split(':')
+
+    def _validate(self):
+        """Forget the lookups if the PATH or its directories changed."""
+        if self._data is None:
+            self._data = self._load()
+        now = self._clock()
+        if self._checked is not None and \
+           now - self._checked < CHECK_INTERVAL:
+            return
+        self._checked = now
+        search_path = self._search_path()
+        dirs = dict((directory, _mtime(directory))
+                    for directory in search_path)
+        if (self._data['search_path'] != search_path or
+                self._data['dirs'] != dirs):
+            self._data['search_path'] = search_path
+            self._data['dirs'] = dirs
+            self._data['programs'] = {}
+
+    def find(self, program):
+        """Return the full path of program, or None if not found."""
+        with self._lock:
+            self._validate()
+            programs = self._data['programs']
+            if program not in programs:
+                programs[program] = None
+                for directory in self._data['search_path']:
+                    path = os.path.join(directory, program)
+                    if os.path.exists(path):
+                        programs[program] = path
+                        break
+                self._save()
+            return programs[program]
+
+    def probe(self, program, args, key=None):
+        """Return the output of a program, stderr included.
+
+        The output is saved and only asked for again once the program
+        changed.
+
+        Keyword arguments:
+        program -- the name or the full path of the program
+        args -- list of arguments to run it with
+        key -- string identifying the probe, the arguments by default
+
+        Returns:
+        The output, or an empty string if the program isn't available.
+
+        """
+        with self._lock:
+            self._validate()
+            path = program if os.path.isabs(program) else self.find(program)
+            if not path:
+                return ""
+            stamp = _mtime(path)
+            if stamp is None:
+                return ""
+            name = '%s %s' % (path, key if key is not None
+                              else ' '.join(args))
+            entry = self._data['probes'].get(name)
+            if entry and entry['mtime'] == stamp:
+                return entry['output']
+            output = misc.Run([path] + list(args), include_stderr=True)
+            self._data['probes'][name] = {'mtime': stamp, 'output': output}
+            self._save()
+            return output
+
+
+# The cache shared by all the interface objects.
+TOOLS = ToolCache()
@@ -299,7 +299,7 @@ def str_properties(prop):
 
 
 if options.wireless and options.list_encryption_types:
-    et = misc.LoadEncryptionMethods()
+    et = misc.GetEncryptionMethods(daemon)
     # print 'Installed encryption templates:'
     print(('%s\t%-20s\t%s' % ('#', 'Name', 'Description')))
     i = 0
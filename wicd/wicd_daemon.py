@@ -56,12 +56,20 @@ else:
 # wicd specific libraries
 import wicd
 from wicd.config import CFG
+from wicd import cache
+from wicd import commands
+from wicd import ieee80211
+from wicd import netlink
 from wicd import networking
+from wicd import psk
 from wicd import misc
+from wicd import templates
 from wicd import wnettools
 from wicd.misc import noneToBlankString, _status_dict
 from wicd.logfile import ManagedStdio
 from wicd.configmanager import ConfigManager
+from wicd.scanresults import AccessPoint
+from wicd.scanresults import ScanResults
 
 
 CFG.load()
@@ -72,6 +80,59 @@ wired_conf = os.path.join(CFG.etc, "wired-settings.conf")
 dhclient_conf = os.path.join(CFG.etc, "dhclient.conf.template")
 
 
+# Milliseconds to wait for more link events before sending UpdateState;
+# bringing an interface up or getting a lease makes a burst of them.
+LINK_EVENT_DELAY = 200
+
+# Network properties sent along with the ScanDelta signal.
+SCAN_PROPERTIES = ('bssid', 'essid', 'hidden', 'channel', 'mode',
+                   'encryption', 'encryption_method', 'quality', 'strength',
+                   'bitrates')
+
+
+def _scan_properties(network):
+    """Return the scan properties of a network, ready for D-Bus.
+
+    Profile settings (keys included) are left out, and None, which D-Bus
+    can't carry, is sent as an empty string.
+
+    """
+    props = {}
+    for key in SCAN_PROPERTIES:
+        if key in network:
+            value = network[key]
+            props[key] = value if value is not None else ''
+    return props
+
+
+def _async_reply(reply_handler, error_handler, convert=None):
+    """Return a callback answering an asynchronous D-Bus call.
+
+    Keyword arguments:
+    reply_handler -- the reply callback dbus-python passed in
+    error_handler -- the error callback dbus-python passed in
+    convert -- function applied to the result before replying
+
+    """
+    def callback(result):
+        try:
+            if convert is not None:
+                result = convert(result)
+        except Exception as e:
+            error_handler(e)
+            return
+        reply_handler(result)
+    return callback
+
+
+def _in_main_loop(func, *args):
+    """Have the main loop call func once, e.g. from a worker thread."""
+    def call():
+        func(*args)
+        return False
+    gobject.idle_add(call)
+
+
 class WicdDaemon(dbus.service.Object, object):
     """The main wicd daemon class.
 
@@ -129,6 +190,11 @@ class WicdDaemon(dbus.service.Object, object):
         # Load the config file
         self.ReadConfig()
 
+        # Learn about carrier and address changes as they happen.
+        self._link_events = None
+        self._link_update_pending = False
+        self._start_link_monitor()
+
         signal.signal(signal.SIGTERM, self.DaemonClosing)
         self.DaemonStarting()
 
@@ -361,27 +427,47 @@ class WicdDaemon(dbus.service.Object, object):
         """Returns True if the computer is in the suspend state."""
         return self.suspended
 
-    @dbus.service.method('org.wicd.daemon')
-    def AutoConnect(self, fresh):
+    @dbus.service.method('org.wicd.daemon',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def AutoConnect(self, fresh, reply_handler=None, error_handler=None):
         """Attempts to autoconnect to a wired or wireless network.
 
         Autoconnect will first try to connect to a wired network, if that
         fails it tries a wireless connection.
 
+        Called over D-Bus, the reply is sent right away and the attempt
+        (checking the cable, scanning) runs in its own thread, so the
+        main loop isn't held up.  The connection itself is started from
+        the main loop.
+
         """
+        if reply_handler is not None:
+            reply_handler()
+            self._threaded_autoconnect(fresh)
+            return
+        self._autoconnect(fresh)
+
+    @misc.threaded
+    def _threaded_autoconnect(self, fresh):
+        """Run _autoconnect off the main loop."""
+        self._autoconnect(fresh)
+
+    def _autoconnect(self, fresh):
+        """Attempts to autoconnect, see AutoConnect."""
         print("Autoconnecting...")
         if self.CheckIfConnecting():
             if self.debug_mode:
                 print('Already connecting, doing nothing.')
-            return
+            return False
         if self.wired_bus.CheckPluggedIn():
             if self.debug_mode:
                 print("Starting wired autoconnect...")
-            self._wired_autoconnect(fresh)
+            _in_main_loop(self._wired_autoconnect, fresh)
         else:
             if self.debug_mode:
                 print("Starting wireless autoconnect...")
             self.wireless_bus._wireless_autoconnect(fresh)
+        return False
 
     @dbus.service.method('org.wicd.daemon')
     def GetAutoReconnect(self):
@@ -566,6 +652,116 @@ class WicdDaemon(dbus.service.Object, object):
         """Returns current value for WAP connection verification."""
         return bool(self.wifi.should_verify_ap)
 
+    @dbus.service.method('org.wicd.daemon')
+    def SetPersistentSupplicant(self, value):
+        """Enable/disable keeping wpa_supplicant running.
+
+        If this is True, wpa_supplicant isn't stopped between wireless
+        connections, it is given the network to connect to over its
+        control interface instead.
+
+        """
+        self.config.set("Settings", "persistent_supplicant", int(value),
+                        write=True)
+        self.wifi.persistent_supplicant = misc.to_bool(value)
+
+    @dbus.service.method('org.wicd.daemon')
+    def GetPersistentSupplicant(self):
+        """Returns whether wpa_supplicant is kept running."""
+        return bool(self.wifi.persistent_supplicant)
+
+    @dbus.service.method('org.wicd.daemon')
+    def SetScanCacheTTL(self, value):
+        """Sets how long (in seconds) missed networks stay listed.
+
+        Networks which don't show up in a scan are kept in the scan
+        results until they haven't been seen for this long.  0 makes
+        every scan start from scratch.
+
+        """
+        self.config.set("Settings", "scan_cache_ttl", int(value), write=True)
+        self.wifi.scan_cache.ttl = int(value)
+
+    @dbus.service.method('org.wicd.daemon')
+    def GetScanCacheTTL(self):
+        """Returns the scan cache time to live, in seconds."""
+        return int(self.wifi.scan_cache.ttl)
+
+    @dbus.service.method('org.wicd.daemon', out_signature='a{si}')
+    def GetCacheStats(self):
+        """Returns the counters of the interface query cache.
+
+        Besides the totals (hits, misses, expired, evictions and
+        invalidations) and the size of the cache, the counters are
+        reported per cached method, e.g. 'GetIwconfig.hits'.
+
+        """
+        return cache.CACHE.stats()
+
+    @dbus.service.method('org.wicd.daemon', out_signature='a{sd}')
+    def GetCommandStats(self):
+        """Returns the counters of the external commands run.
+
+        The number of calls, failures, timeouts and calls answered by
+        an identical run already in progress ('coalesced') and the
+        seconds spent are reported per program, e.g. 'iwconfig.calls'.
+        'coalesced' also holds the total number of forks saved.
+
+        """
+        return commands.EXECUTOR.stats()
+
+    @dbus.service.method('org.wicd.daemon', out_signature='a{sa{ss}}')
+    def GetInterfaceInventory(self):
+        """Returns every network interface with its kind and state.
+
+        Each interface maps to its 'kind' (wireless, wired, virtual,
+        loopback or other), ARPHRD 'type', 'operstate' and 'driver'.
+
+        """
+        return wnettools.GetInterfaceInventory()
+
+    @dbus.service.method('org.wicd.daemon', in_signature='bu',
+                         out_signature='(ua(ssaasaasaas))')
+    def GetEncryptionCatalog(self, wired, version):
+        """Returns the encryption templates clients can offer.
+
+        Keyword arguments:
+        wired -- whether to list the templates for wired networks
+        version -- the version of the catalog the client already has,
+                   0 if none
+
+        Returns:
+        The version of the catalog and, unless it is the version the
+        client has, the type, name, required, optional and protected
+        fields of each template.  Fields are [field, display name].
+
+        """
+        current, methods = templates.TEMPLATES.catalog(bool(wired))
+        if int(version) == current:
+            return (current, [])
+        return (current, [(method['type'], method['name'],
+                           method['required'], method['optional'],
+                           method['protected']) for method in methods])
+
+    @dbus.service.method('org.wicd.daemon')
+    def SetPassiveScanMaxAge(self, value):
+        """Sets how old (in seconds) passive scan results may be.
+
+        While wpa_supplicant runs, scans use the networks it saw during
+        its own background scans if it saw any during the last value
+        seconds, and only scan actively otherwise.  0 always scans
+        actively.
+
+        """
+        self.config.set("Settings", "passive_scan_max_age", int(value),
+                        write=True)
+        self.wifi.passive_scan_max_age = int(value)
+
+    @dbus.service.method('org.wicd.daemon')
+    def GetPassiveScanMaxAge(self):
+        """Returns the passive scan result age limit, in seconds."""
+        return int(self.wifi.passive_scan_max_age)
+
     @dbus.service.method('org.wicd.daemon')
     def GetWiredAutoConnectMethod(self):
         """Returns the wired autoconnect method."""
@@ -748,7 +944,7 @@ class WicdDaemon(dbus.service.Object, object):
             if not network:
                 print("Couldn't find a default wired connection, wired "
                       "autoconnect failed.")
-                self.wireless_bus._wireless_autoconnect(fresh)
+                self.wireless_bus._threaded_wireless_autoconnect(fresh)
                 return
 
         # Last-Used.
@@ -757,20 +953,25 @@ class WicdDaemon(dbus.service.Object, object):
             if not network:
                 print("no previous wired profile available, wired "
                       "autoconnect failed.")
-                self.wireless_bus._wireless_autoconnect(fresh)
+                self.wireless_bus._threaded_wireless_autoconnect(fresh)
                 return
 
         wiredb.ReadWiredNetworkProfile(network)
         wiredb.ConnectWired()
         print("Attempting to autoconnect with wired interface...")
         self.auto_connecting = True
-        time.sleep(1.5)
+        # Give the connection thread a head start before checking on it.
+        gobject.timeout_add(1500, self._watch_wired_autoconnect, fresh)
+        return True
+
+    def _watch_wired_autoconnect(self, fresh):
+        """Start monitoring a wired auto-connection attempt."""
         try:
             gobject.timeout_add_seconds(3, self._monitor_wired_autoconnect,
                                         fresh)
         except AttributeError:
             gobject.timeout_add(3000, self._monitor_wired_autoconnect, fresh)
-        return True
+        return False
 
     def _monitor_wired_autoconnect(self, fresh):
         """Monitor a wired auto-connection attempt.
@@ -787,7 +988,7 @@ class WicdDaemon(dbus.service.Object, object):
             self.auto_connecting = False
             return False
         elif not self.wireless_bus.CheckIfWirelessConnecting():
-            self.wireless_bus._wireless_autoconnect(fresh)
+            self.wireless_bus._threaded_wireless_autoconnect(fresh)
             return False
         self.auto_connecting = False
         return False
@@ -831,6 +1032,70 @@ class WicdDaemon(dbus.service.Object, object):
     def UpdateState(self):
         pass
 
+    def _start_link_monitor(self):
+        """Subscribe to rtnetlink link and address notifications.
+
+        Whenever the link or an address of the wired or wireless
+        interface changes, UpdateState is sent right away, so that the
+        monitor doesn't have to wait for its next poll to notice a
+        pulled cable or a lost lease.
+
+        """
+        try:
+            self._link_events = netlink.RouteEventSocket()
+        except OSError as e:
+            print('Link monitoring unavailable, only polling for '
+                  'changes: %s' % e)
+            return
+        gobject.io_add_watch(self._link_events.fileno(), gobject.IO_IN,
+                             self._on_link_event)
+
+    def _on_link_event(self, fd, condition):
+        """Handle rtnetlink notifications."""
+        ifaces = set([self.wired.wired_interface,
+                      self.wifi.wireless_interface])
+        try:
+            events = self._link_events.read_events()
+        except OSError as e:
+            # We fell behind (ENOBUFS) and missed some, assume the worst.
+            print('Lost link notifications: %s' % e)
+            events = [{'type': netlink.RTM_NEWLINK, 'ifname': iface}
+                      for iface in ifaces]
+        types = set(event['type'] for event in events)
+        if types & set([netlink.RTM_NEWLINK, netlink.RTM_DELLINK]):
+            # An interface was plugged, removed or changed state.
+            wnettools.InvalidateInterfaceInventory()
+        if types & set([netlink.RTM_NEWADDR, netlink.RTM_DELADDR]):
+            wnettools.InvalidateAddresses()
+        changed = [event['ifname'] for event in events
+                   if event.get('ifname') in ifaces]
+        for iface in set(changed):
+            cache.CACHE.invalidate(iface)
+        if changed and not self._link_update_pending:
+            if self.debug_mode:
+                print('link or address changed on %s' %
+                      ', '.join(sorted(set(changed))))
+            self._link_update_pending = True
+            gobject.timeout_add(LINK_EVENT_DELAY, self._send_link_update)
+        return True
+
+    def _send_link_update(self):
+        """Send UpdateState for the link events received lately."""
+        self._link_update_pending = False
+        self.UpdateState()
+        return False
+
+    @dbus.service.method('org.wicd.daemon')
+    def GetLinkEventsEnabled(self):
+        """Returns True if link and address changes are signalled.
+
+        When they are, UpdateState is sent as soon as the link or an
+        address of an interface changes, and the monitor only needs to
+        poll as a safety net.
+
+        """
+        return self._link_events is not None
+
     @dbus.service.signal(dbus_interface='org.wicd.daemon', signature='')
     def LaunchChooser(self):
         """Emits the wired profile chooser dbus signal."""
@@ -923,6 +1188,14 @@ class WicdDaemon(dbus.service.Object, object):
                                                default=0))
         self.SetShouldVerifyAp(app_conf.get("Settings", "should_verify_ap",
                                             default=1))
+        self.SetPersistentSupplicant(app_conf.get("Settings",
+                                                  "persistent_supplicant",
+                                                  default=0))
+        self.SetScanCacheTTL(app_conf.get("Settings", "scan_cache_ttl",
+                                          default=30))
+        self.SetPassiveScanMaxAge(app_conf.get("Settings",
+                                               "passive_scan_max_age",
+                                               default=30))
         self.SetDHCPClient(app_conf.get("Settings", "dhcp_client", default=0))
         self.SetLinkDetectionTool(app_conf.get("Settings", "link_detect_tool",
                                                default=0))
@@ -980,7 +1253,10 @@ class WirelessDaemon(dbus.service.Object, object):
         self.wifi = wifi
         self._debug_mode = debug
         self._scanning = False
-        self.LastScan = []
+        self.LastScan = ScanResults()
+        # Scan results as returned by the backend, by bssid, used to
+        # tell which networks changed since the previous scan.
+        self._raw_scan = {}
         self.config = ConfigManager(wireless_conf, debug=debug)
 
     def get_debug_mode(self):
@@ -1027,27 +1303,114 @@ class WirelessDaemon(dbus.service.Object, object):
         """Run a scan in its own thread."""
         self._sync_scan()
 
-    def _sync_scan(self):
-        """Run a scan and send a signal when its finished."""
-        scan = self.wifi.Scan(str(self.hidden_essid))
-        self.LastScan = scan
+    def _sync_scan(self, freqs=None):
+        """Run a scan and send a signal when its finished.
+
+        Keyword arguments:
+        freqs -- frequencies (MHz) to limit the scan to, all if None
+
+        Returns:
+        The set of the BSSIDs the scan itself found, LastScan also
+        holds the networks the scan cache keeps from earlier scans.
+
+        """
+        started = time.time()
+        scan = self.wifi.Scan(str(self.hidden_essid), freqs)
+        added, changed, removed = self._merge_scan(scan)
         if self.debug_mode:
             print('scanning done')
-            print('found ' + str(len(scan)) + ' networks:')
-        for i, network in enumerate(scan):
-            self.ReadWirelessNetworkProfile(i)
+            print('found ' + str(len(scan)) + ' networks: %d added, '
+                  '%d changed, %d removed' % (len(added), len(changed),
+                                              len(removed)))
+        self.ScanDelta(added, changed, removed,
+                       [network['bssid'] for network in self.LastScan])
         self.SendEndScanSignal()
+        # Networks kept by the scan cache were last seen before.
+        return set(network['bssid'] for network in scan
+                   if (network.get('last_seen') or started) >= started)
 
-    @dbus.service.method('org.wicd.daemon.wireless')
-    def GetIwconfig(self):
-        """Calls and returns the output of iwconfig"""
-        return misc.to_unicode(self.wifi.GetIwconfig())
+    def _merge_scan(self, scan):
+        """Replace LastScan with a new scan, diffing it by bssid.
+
+        Networks whose profile related fields (bssid, essid, hidden) did
+        not change keep the dict already merged with their profile, so
+        the profile is only read for new or renamed networks.
+
+        Keyword arguments:
+        scan -- list containing the networks returned by the backend
+
+        Returns:
+        A (added, changed, removed) tuple: the properties of the new
+        networks, the changed properties of the known ones (with their
+        bssid) and the bssids of the networks which went away.
+
+        """
+        previous = dict((network['bssid'], network)
+                        for network in self.LastScan)
+        raw_scan = {}
+        networks = ScanResults()
+        fresh = []
+        changed = []
+        for network in scan:
+            bssid = network['bssid']
+            raw_scan[bssid] = AccessPoint(network)
+            old_raw = self._raw_scan.get(bssid)
+            if bssid in previous and old_raw is not None:
+                diff = dict((key, value) for key, value in network.items()
+                            if old_raw.get(key) != value)
+                if not set(diff) & set(('bssid', 'essid', 'hidden')):
+                    previous[bssid].update(diff)
+                    networks.append(previous[bssid])
+                    diff['bssid'] = bssid
+                    props = _scan_properties(diff)
+                    # Being seen again alone isn't worth a signal.
+                    if len(props) > 1:
+                        changed.append(props)
+                    continue
+            fresh.append(len(networks))
+            networks.append(network)
+
+        self.LastScan = networks
+        self._raw_scan = raw_scan
+        added = []
+        for i in fresh:
+            self.ReadWirelessNetworkProfile(i)
+            if networks[i]['bssid'] in previous:
+                changed.append(_scan_properties(networks[i]))
+            else:
+                added.append(_scan_properties(networks[i]))
+        removed = [bssid for bssid in previous if bssid not in raw_scan]
+        return added, changed, removed
+
+    @dbus.service.method('org.wicd.daemon.wireless',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetIwconfig(self, reply_handler=None, error_handler=None):
+        """Calls and returns the output of iwconfig
+
+        Called over D-Bus, the reply is sent once iwconfig is done,
+        without blocking the main loop meanwhile.
+
+        """
+        if reply_handler is None:
+            return misc.to_unicode(self.wifi.GetIwconfig())
+        self.wifi.GetIwconfigAsync(_async_reply(reply_handler, error_handler,
+                                                misc.to_unicode))
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def GetNumberOfNetworks(self):
         """Returns number of networks."""
         return len(self.LastScan)
 
+    @dbus.service.method('org.wicd.daemon.wireless', out_signature='aa{sv}')
+    def GetScanResults(self):
+        """Returns the scan properties of all networks, in order.
+
+        This is the starting point for clients following the ScanDelta
+        signal.
+
+        """
+        return [_scan_properties(network) for network in self.LastScan]
+
     @dbus.service.method('org.wicd.daemon.wireless')
     def GetApBssid(self):
         """Gets the MAC address for the active network."""
@@ -1068,10 +1431,14 @@ class WirelessDaemon(dbus.service.Object, object):
         """Returns the operational mode for the iwlistauth parameter"""
         return misc.to_unicode(self.wifi.GetAvailableAuthMethods(iwlistauth))
 
-    @dbus.service.method('org.wicd.daemon.wireless')
-    def GetAvailableBitrates(self):
+    @dbus.service.method('org.wicd.daemon.wireless',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetAvailableBitrates(self, reply_handler=None, error_handler=None):
         """Returns the available bitrates the wifi card can use"""
-        return self.wifi.GetAvailableBitrates()
+        if reply_handler is None:
+            return self.wifi.GetAvailableBitrates()
+        self.wifi.GetAvailableBitratesAsync(_async_reply(reply_handler,
+                                                         error_handler))
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def GetOperableBitrates(self, networkid):
@@ -1101,10 +1468,14 @@ class WirelessDaemon(dbus.service.Object, object):
         """Switches the rfkill on/off for wireless cards."""
         return self.wifi.SwitchRfKill()
 
-    @dbus.service.method('org.wicd.daemon.wireless')
-    def GetRfKillEnabled(self):
+    @dbus.service.method('org.wicd.daemon.wireless',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetRfKillEnabled(self, reply_handler=None, error_handler=None):
         """Returns true if rfkill switch is enabled."""
-        return self.wifi.GetRfKillStatus()
+        if reply_handler is None:
+            return self.wifi.GetRfKillStatus()
+        self.wifi.GetRfKillStatusAsync(_async_reply(reply_handler,
+                                                    error_handler))
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def GetWirelessProperty(self, networkid, prop):
@@ -1125,6 +1496,8 @@ class WirelessDaemon(dbus.service.Object, object):
             print('Setting script properties through the daemon is not '
                   'permitted.')
             return False
+        # Unsaved changes are dropped by the next scan.
+        self._raw_scan.pop(self.LastScan[netid]['bssid'], None)
         # whitelist some props that need different handling
         if prop in ('key_index', ):
             self.LastScan[netid][prop] = \
@@ -1241,6 +1614,11 @@ class WirelessDaemon(dbus.service.Object, object):
         ip = self.wifi.GetIP(ifconfig)
         return ip
 
+    @dbus.service.method('org.wicd.daemon.wireless', out_signature='as')
+    def GetWirelessIPv6Addresses(self):
+        """Returns the IPv6 addresses of the wireless interface."""
+        return self.wifi.GetIPv6Addresses()
+
     @dbus.service.method('org.wicd.daemon.wireless')
     def CheckWirelessConnectingStatus(self):
         """Returns the wireless interface's status code."""
@@ -1300,6 +1678,7 @@ class WirelessDaemon(dbus.service.Object, object):
         bssid_key = cur_network["bssid"]
         essid_key = "essid:%s" % cur_network["essid"]
 
+        self._forget_changed_psk(bssid_key, cur_network)
         self.config.remove_section(bssid_key)
         self.config.add_section(bssid_key)
 
@@ -1311,7 +1690,8 @@ class WirelessDaemon(dbus.service.Object, object):
 
         for x in cur_network:
             # There's no reason to save these to a configfile...
-            if x not in ['quality', 'strength', 'bitrates', 'has_profile']:
+            if x not in ['quality', 'strength', 'bitrates', 'has_profile',
+                         'last_seen']:
                 self.config.set(bssid_key, x, cur_network[x])
                 if cur_network.get("use_settings_globally", False):
                     self.config.set(essid_key, x, cur_network[x])
@@ -1328,6 +1708,7 @@ class WirelessDaemon(dbus.service.Object, object):
             write_script_ent(essid_key, "postdisconnectscript")
 
         self.config.write()
+        self._raw_scan.clear()
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def SaveWirelessNetworkProperty(self, nid, option):
@@ -1341,18 +1722,29 @@ class WirelessDaemon(dbus.service.Object, object):
         cur_network = self.LastScan[nid]
         essid_key = "essid:" + cur_network["essid"]
 
+        if option == 'key':
+            self._forget_changed_psk(cur_network["bssid"], cur_network)
         config.set(cur_network["bssid"], option, str(cur_network[option]))
 
         # Write the global section as well, if required.
         if config.get(essid_key, 'use_settings_globally'):
             config.set(essid_key, option, str(cur_network[option]))
         config.write()
+        self._raw_scan.clear()
+
+    def _forget_changed_psk(self, section, network):
+        """Drop the cached PSK of a network whose key is changing."""
+        saved_key = self.config.get(section, 'key')
+        if saved_key is not None and \
+           str(saved_key) != str(network.get('key')):
+            psk.CACHE.forget(str(network['essid']))
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def RemoveGlobalEssidEntry(self, networkid):
         """Removes the global entry for the networkid provided."""
         essid_key = "essid:" + str(self.LastScan[networkid])
         self.config.remove_section(essid_key)
+        self._raw_scan.clear()
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def GetWpaSupplicantDrivers(self):
@@ -1363,6 +1755,7 @@ class WirelessDaemon(dbus.service.Object, object):
     def ReloadConfig(self):
         """Reloads the active config file."""
         self.config.reload()
+        self._raw_scan.clear()
 
     @dbus.service.method('org.wicd.daemon.wireless', out_signature='as')
     def GetWirelessInterfaces(self):
@@ -1385,10 +1778,14 @@ class WirelessDaemon(dbus.service.Object, object):
     def DeleteWirelessNetwork(self, section):
         """Deletes a wireless network section."""
         section = misc.to_unicode(section)
+        essid = self.config.get(section, 'essid')
         print("Deleting wireless settings for %s (%s)" %
-              (self.config.get(section, 'essid'), str(section)))
+              (essid, str(section)))
+        if essid is not None:
+            psk.CACHE.forget(str(essid))
         self.config.remove_section(section)
         self.config.write()
+        self._raw_scan.clear()
 
     @dbus.service.signal(dbus_interface='org.wicd.daemon.wireless',
                          signature='')
@@ -1402,8 +1799,37 @@ class WirelessDaemon(dbus.service.Object, object):
         """Emits a signal announcing a scan has finished."""
         self._scanning = False
 
+    @dbus.service.signal(dbus_interface='org.wicd.daemon.wireless',
+                         signature='aa{sv}aa{sv}asas')
+    def ScanDelta(self, added, changed, removed, order):
+        """Emits the differences between the last two scans.
+
+        This D-Bus signal is emitted right before SendEndScanSignal.
+        added holds the scan properties of the new networks, changed
+        the properties which changed (and the bssid) of the networks
+        already known, removed the bssids of the networks gone, and
+        order the bssids of all networks, by network id.
+
+        """
+        pass
+
+    @misc.threaded
+    def _threaded_wireless_autoconnect(self, fresh):
+        """Run _wireless_autoconnect off the main loop."""
+        self._wireless_autoconnect(fresh)
+
     def _wireless_autoconnect(self, fresh=True):
-        """Attempts to autoconnect to a wireless network."""
+        """Attempts to autoconnect to a wireless network.
+
+        A fresh autoconnect first only scans the channels saved networks
+        were last seen on, which is a lot quicker than scanning them
+        all, and only does a full scan if none of them turns up and
+        the first scan couldn't be limited to those channels.
+
+        The scans are synchronous, this is meant to run in its own
+        thread; the connection is started from the main loop.
+
+        """
         print("No wired connection present, attempting to autoconnect to "
               "wireless network")
         if self.wifi.wireless_interface is None:
@@ -1411,9 +1837,40 @@ class WirelessDaemon(dbus.service.Object, object):
                   'None')
             return
         if fresh:
-            self.Scan(sync=True)
+            freqs = self._profile_frequencies()
+            full_scan = True
+            if freqs and not self._scanning:
+                print('scanning the channels of saved networks: %s' %
+                      ' '.join(str(freq) for freq in freqs))
+                self.SendStartScanSignal()
+                found = self._sync_scan(freqs)
+                if self._connect_automatic_network(found):
+                    return
+                # Without wpa_supplicant, iwlist scanned all channels.
+                full_scan = self.wifi.limited_scan
+                if full_scan:
+                    print('no saved network found on those channels, '
+                          'doing a full scan')
+            if full_scan:
+                self.Scan(sync=True)
+
+        if not self._connect_automatic_network():
+            print("Unable to autoconnect, you'll have to manually connect")
+
+    def _connect_automatic_network(self, bssids=None):
+        """Connect to the first network of LastScan set to autoconnect.
+
+        Keyword arguments:
+        bssids -- if given, only the networks with one of these BSSIDs
+                  are considered, e.g. the ones a scan just found
 
-        for x, network in enumerate(self.LastScan):
+        Returns:
+        True if a connection attempt was started, False otherwise.
+
+        """
+        for network in self.LastScan:
+            if bssids is not None and network['bssid'] not in bssids:
+                continue
             if self.config.has_section(network['bssid']):
                 if self.debug_mode:
                     print(network["essid"] + ' has profile')
@@ -1425,10 +1882,38 @@ class WirelessDaemon(dbus.service.Object, object):
                         print(f'{network["essid"]} has no never connect value')
                     print(f'trying to automatically connect to... '
                           f'{network["essid"]}')
-                    self.ConnectWireless(x)
-                    time.sleep(1)
-                    return
-        print("Unable to autoconnect, you'll have to manually connect")
+                    _in_main_loop(self._connect_bssid, network['bssid'])
+                    return True
+        return False
+
+    def _connect_bssid(self, bssid):
+        """Connect to the network of LastScan with the given bssid."""
+        for nid, network in enumerate(self.LastScan):
+            if network['bssid'] == bssid:
+                self.ConnectWireless(nid)
+                return
+        print('%s is no longer in the scan results, not connecting' % bssid)
+
+    def _profile_frequencies(self):
+        """Return the frequencies saved automatic networks were seen on.
+
+        Returns:
+        A sorted list of frequencies (MHz), empty when the channel of
+        none of the saved networks set to autoconnect is known.
+
+        """
+        freqs = set()
+        for section in self.config.sections():
+            if section.startswith('essid:'):
+                continue
+            if not bool(self.config.get(section, 'automatic')) or \
+               bool(self.config.get(section, 'never')):
+                continue
+            freq = ieee80211.ChannelToFreq(self.config.get(section,
+                                                           'channel'))
+            if freq:
+                freqs.add(freq)
+        return sorted(freqs)
 
 
 class WiredDaemon(dbus.service.Object, object):
@@ -1460,6 +1945,11 @@ class WiredDaemon(dbus.service.Object, object):
         ip = self.wired.GetIP(ifconfig)
         return ip
 
+    @dbus.service.method('org.wicd.daemon.wired', out_signature='as')
+    def GetWiredIPv6Addresses(self):
+        """Returns the IPv6 addresses of the wired interface."""
+        return self.wired.GetIPv6Addresses()
+
     @dbus.service.method('org.wicd.daemon.wired')
     def CheckIfWiredConnecting(self):
         """Returns True if wired interface is connecting, otherwise False."""
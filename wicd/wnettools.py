@@ -32,6 +32,7 @@ class BaseWirelessInterface() -- Control a wireless network interface.
 #
 
 import dbus
+import errno
 import fcntl
 import functools
 import os
@@ -39,11 +40,17 @@ import random
 import re
 import shutil
 import socket
+import threading
 import time
 
 from wicd.config import CFG
+from wicd import cache
 from wicd import misc
-from wicd.misc import find_path
+from wicd import netlink
+from wicd import psk
+from wicd import routes
+from wicd import toolcache
+from wicd import wpasupplicant
 
 
 CFG.load()
@@ -65,6 +72,9 @@ altwpa_pattern = re.compile('(wpa_ie)', _re_mode)
 wpa1_pattern = re.compile('(WPA Version 1)', _re_mode)
 wpa2_pattern = re.compile('(WPA2)', _re_mode)
 
+# Line-local regular expressions for the single-pass iwlist scan parser.
+scan_mode_pattern = re.compile('Mode:([A-Za-z-]*)$', re.I)
+
 # iwconfig-only regular expressions.
 ip_up = re.compile(r'flags=[0.9]*<([^>]*)>', re.S)
 ip_pattern = re.compile(r'inet [Aa]d?dr[^.]*:([^.]*\.[^.]*\.[^.]*\.[0-9]*)',
@@ -74,6 +84,17 @@ bssid_pattern = re.compile('.*[(Access Point)|(Cell)]: '
                            '(([0-9A-Z]{2}:){5}[0-9A-Z]{2})', _re_mode)
 bitrate_pattern = re.compile('.*Bit Rate[=:](.*?/s)', _re_mode)
 opmode_pattern = re.compile('.*Mode:(.*?) ', _re_mode)
+
+# Interface inventory.
+SYS_CLASS_NET = '/sys/class/net'
+INVENTORY_TTL = 30
+# Address table.
+ADDRESS_TTL = 5
+# Seconds the output of iwconfig is cached for.
+IWCONFIG_TTL = 2
+# From linux/if_arp.h, as found in /sys/class/net/<iface>/type.
+ARPHRD_ETHER = '1'
+ARPHRD_LOOPBACK = '772'
 authmethods_pattern = re.compile('.*Authentication capabilities '
                                  ':\n(.*?)Current', _re_mode)
 
@@ -89,7 +110,14 @@ blacklist_norm = list(";`$!*|><&\\")
 blacklist_strict_t = str.maketrans(dict.fromkeys(blacklist_strict, None))
 blacklist_norm_t = str.maketrans(dict.fromkeys(blacklist_norm, None))
 
-_cache = {}
+
+def _new_scan_cell(start):
+    """Return an empty record for a cell of iwlist scan output."""
+    return {'start': start, 'has_essid': False, 'essid': None,
+            'bssid': None, 'channel': None, 'freq': None, 'mode': None,
+            'wep': None, 'wpa1': False, 'wpa2': False, 'wpa_ie': False,
+            'quality': None, 'altquality': None, 'dbm': None,
+            'bitrates': []}
 
 
 def _sanitize_string(string):
@@ -108,47 +136,66 @@ def _sanitize_string_strict(string):
         return string
 
 
+def _cache_key(args, kwargs):
+    """Return the key timedcache stores a result of a call under."""
+    return (args, tuple(sorted(kwargs.items())))
+
+
 def timedcache(duration=5):
     """A caching decorator for use with wnettools methods.
 
     Caches the results of a function for a given number of
-    seconds (defaults to 5).
+    seconds (defaults to 5), per interface, in the bounded cache of
+    wicd.cache.  Methods decorated with invalidatecache drop the
+    results cached for their interface.
 
     """
     def _timedcache(f):
+        name = f.__name__
+
         def __timedcache(self, *args, **kwargs):
-            key = str(args) + str(kwargs) + str(f)
-            if hasattr(self, 'iface'):
-                key += self.iface
-            if (key in _cache and
-                    (time.time() - _cache[key]['time']) < duration):
-                return _cache[key]['value']
-            else:
+            namespace = getattr(self, 'iface', None)
+            key = _cache_key(args, kwargs)
+            value = cache.CACHE.get(namespace, name, key, duration)
+            if value is cache.MISSING:
                 value = f(self, *args, **kwargs)
-                _cache[key] = {'time': time.time(), 'value': value}
-                return value
+                cache.CACHE.set(namespace, name, key, value)
+            return value
 
+        __timedcache.__name__ = name
+        __timedcache.__doc__ = f.__doc__
+        __timedcache.__module__ = f.__module__
         return __timedcache
 
     return _timedcache
 
 
-def GetDefaultGateway():
-    """Attempts to determine the default gateway by parsing route -n."""
-    route_info = misc.Run("route -n")
-    lines = route_info.split('\n')
-    gateway = None
-    for line in lines:
-        words = line.split()
-        print(words)
-        if not words:
-            continue
-        if words[0] == '0.0.0.0':
-            gateway = words[1]
-            break
+def invalidatecache(f):
+    """A decorator for methods which change the state of an interface.
+
+    Once the method returns, the results timedcache stored for the
+    interface are dropped, so that e.g. GetIwconfig doesn't report the
+    old association after Associate.  So is the address table, as it
+    is shared by all interfaces.
+
+    """
+    def wrapper(self, *args, **kwargs):
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            cache.CACHE.invalidate(getattr(self, 'iface', None))
+            InvalidateAddresses()
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    wrapper.__module__ = f.__module__
+    return wrapper
 
+
+def GetDefaultGateway():
+    """Returns the gateway of the default route, read from /proc."""
+    gateway = routes.GetDefaultGateway()
     if not gateway:
-        print('couldn\'t retrieve default gateway from route -n')
+        print('couldn\'t retrieve default gateway from the routing table')
     return gateway
 
 
@@ -178,28 +225,151 @@ def isWireless(devname):
     return we is not None
 
 
+def _read_sysfs(path):
+    """Return the stripped content of a sysfs attribute, or ''."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return ''
+
+
+def _interface_kind(path, iftype):
+    """Classify the interface whose sysfs directory is path."""
+    if (os.path.exists(os.path.join(path, 'phy80211')) or
+            os.path.isdir(os.path.join(path, 'wireless'))):
+        return 'wireless'
+    if iftype == ARPHRD_LOOPBACK:
+        return 'loopback'
+    if iftype == ARPHRD_ETHER:
+        # Bridges, veths, VLANs, bonds... have no device behind them.
+        if os.path.exists(os.path.join(path, 'device')):
+            return 'wired'
+        return 'virtual'
+    return 'other'
+
+
+def GetInterfaceInventory(sysfs=None):
+    """Return every network interface with its kind and state.
+
+    The inventory is built from a single walk of /sys/class/net and
+    cached until an interface appears, goes away or changes its link
+    state (see InvalidateInterfaceInventory), or for INVENTORY_TTL
+    seconds at most.
+
+    Keyword arguments:
+    sysfs -- the directory listing the interfaces (SYS_CLASS_NET)
+
+    Returns:
+    A dict mapping interface names to dicts with the interface 'kind'
+    (wireless, wired, virtual, loopback or other), the ARPHRD 'type',
+    the 'operstate' and the kernel 'driver' (empty if there is none),
+    all as strings.
+
+    """
+    sysfs = sysfs or SYS_CLASS_NET
+    inventory = cache.CACHE.get(None, 'GetInterfaceInventory', sysfs,
+                                INVENTORY_TTL)
+    if inventory is not cache.MISSING:
+        return inventory
+    inventory = {}
+    try:
+        ifnames = os.listdir(sysfs)
+    except OSError:
+        ifnames = []
+    for iface in ifnames:
+        path = os.path.join(sysfs, iface)
+        if not os.path.isdir(path):
+            # e.g. bonding_masters
+            continue
+        iftype = _read_sysfs(os.path.join(path, 'type'))
+        try:
+            driver = os.path.basename(
+                os.readlink(os.path.join(path, 'device', 'driver')))
+        except OSError:
+            driver = ''
+        inventory[iface] = {
+            'kind': _interface_kind(path, iftype),
+            'type': iftype,
+            'operstate': _read_sysfs(os.path.join(path, 'operstate')),
+            'driver': driver,
+        }
+    cache.CACHE.set(None, 'GetInterfaceInventory', sysfs, inventory)
+    return inventory
+
+
+def InvalidateInterfaceInventory():
+    """Forget the interface inventory, e.g. on hotplug events."""
+    cache.CACHE.invalidate(names=('GetInterfaceInventory',))
+
+
+def GetAddressTable():
+    """Return the addresses of all interfaces.
+
+    All addresses are fetched with a single rtnetlink dump, which is
+    cached until an address changes (see InvalidateAddresses), or for
+    ADDRESS_TTL seconds at most.
+
+    Returns:
+    A dict mapping interface names to lists of address dicts, as
+    returned by netlink.RouteSocket.get_addresses.
+
+    Raises OSError if the addresses can't be dumped.
+
+    """
+    table = cache.CACHE.get(None, 'GetAddressTable', None, ADDRESS_TTL)
+    if table is cache.MISSING:
+        sock = netlink.RouteSocket()
+        try:
+            table = sock.get_addresses()
+        finally:
+            sock.close()
+        cache.CACHE.set(None, 'GetAddressTable', None, table)
+    return table
+
+
+def GetAddresses(iface, family=None):
+    """Return the addresses of an interface.
+
+    Keyword arguments:
+    iface -- the interface name
+    family -- only return the addresses of this family
+
+    Returns:
+    A list of address dicts, see GetAddressTable.
+
+    """
+    return [address for address in GetAddressTable().get(iface, [])
+            if family is None or address['family'] == family]
+
+
+def InvalidateAddresses():
+    """Forget the address table, e.g. when an address changed."""
+    cache.CACHE.invalidate(names=('GetAddressTable',))
+
+
 def GetWirelessInterfaces():
     """Get available wireless interfaces.
 
-    Attempts to get an interface first by parsing /proc/net/wireless,
-    and should that fail, by parsing iwconfig.
     Returns:
-    The first interface available.
+    The names of the wireless interfaces, sorted.
 
     """
-    dev_dir = '/sys/class/net/'
-    ifnames = [iface for iface in os.listdir(dev_dir)
-               if isWireless(str(iface))]
-    return ifnames
+    return sorted(iface for iface, info in GetInterfaceInventory().items()
+                  if info['kind'] == 'wireless')
 
 
 def GetWiredInterfaces():
-    """Returns a list of wired interfaces on the system."""
-    basedir = '/sys/class/net/'
-    return [iface for iface in os.listdir(basedir)
-            if os.path.isdir(basedir + iface) and
-            'wireless' not in os.listdir(basedir + iface) and
-            open(basedir + iface + "/type").readlines()[0].strip() == "1"]
+    """Returns a list of wired interfaces on the system.
+
+    Ethernet interfaces backed by a device come first, followed by
+    the virtual ones (bridges, veths, VLANs...).
+
+    """
+    inventory = GetInterfaceInventory()
+    return [iface for kind in ('wired', 'virtual')
+            for iface in sorted(inventory)
+            if inventory[iface]['kind'] == kind]
 
 
 def NeedsExternalCalls():
@@ -209,10 +379,10 @@ def NeedsExternalCalls():
 
 def GetWpaSupplicantDrivers():
     """Returns a list of all valid wpa_supplicant drivers."""
-    output = misc.Run(["wpa_supplicant", "-h"])
+    output = toolcache.TOOLS.probe("wpa_supplicant", ["-h"])
     try:
         output = output.split("drivers:")[1].split("options:")[0].strip()
-    except KeyError:
+    except (KeyError, IndexError):
         print("Warning: Couldn't get list of valid wpa_supplicant drivers")
         return [""]
     patt = re.compile(r"(\S+)\s+=.*")
@@ -225,11 +395,19 @@ def GetWpaSupplicantDrivers():
 
 def IsValidWpaSuppDriver(driver):
     """Returns True if given string is a valid wpa_supplicant driver."""
-    output = misc.Run(["wpa_supplicant", "-D%s" % driver, "-iolan19",
-                       "-c/etc/abcd%sdefzz.zconfz" % random.randint(1, 1000)])
+    output = toolcache.TOOLS.probe(
+        "wpa_supplicant", ["-D%s" % driver, "-iolan19",
+                           "-c/etc/abcd%sdefzz.zconfz" %
+                           random.randint(1, 1000)],
+        key="-D%s" % driver)
     return "Unsupported driver" not in output
 
 
+def _iface_exists(iface):
+    """Return True if iface is set and the interface exists."""
+    return bool(iface) and os.path.exists('/sys/class/net/%s' % iface)
+
+
 def neediface(default_response):
     """A decorator for only running a method if self.iface is defined.
 
@@ -240,17 +418,48 @@ def neediface(default_response):
     """
     def wrapper(func):
         def newfunc(self, *args, **kwargs):
-            if not self.iface or \
-               not os.path.exists('/sys/class/net/%s' % self.iface):
+            if not _iface_exists(self.iface):
                 return default_response
             return func(self, *args, **kwargs)
         newfunc.__dict__ = func.__dict__
+        newfunc.__name__ = func.__name__
         newfunc.__doc__ = func.__doc__
         newfunc.__module__ = func.__module__
         return newfunc
     return wrapper
 
 
+def _netmask_to_prefixlen(netmask):
+    """Convert a dotted quad netmask to a prefix length."""
+    return sum(bin(int(octet)).count('1') for octet in netmask.split('.'))
+
+
+def _parse_batch_errors(output, batch):
+    """Match the errors of an ip -force -batch run to its operations.
+
+    Keyword arguments:
+    output -- the output of ip, stderr included
+    batch -- the operations it was fed, in order
+
+    Returns:
+    A list of (operation, error message) tuples.
+
+    """
+    errors = []
+    messages = []
+    for line in output.splitlines():
+        if line.startswith('Command failed -:'):
+            try:
+                operation = batch[int(line.rsplit(':', 1)[1]) - 1]
+            except (ValueError, IndexError):
+                continue
+            errors.append((operation, ' '.join(messages) or 'failed'))
+            messages = []
+        elif line.strip():
+            messages.append(line.strip())
+    return errors
+
+
 class BaseInterface(object):
     """Control a network interface."""
     def __init__(self, iface, verbose=False):
@@ -267,6 +476,14 @@ class BaseInterface(object):
         self.flush_tool = None
         self.link_detect = None
         self.dhcp_object = None
+        self._batch = None
+        # Held from StartBatch to CommitBatch by the thread batching.
+        self._batch_lock = threading.Lock()
+        self._batch_owner = None
+        # The rtnetlink socket, False once found unusable, and what
+        # makes the threads using it take turns.
+        self._rtnl = None
+        self._rtnl_lock = threading.Lock()
 
         self.ethtool_cmd = None
         self.miitool_cmd = None
@@ -301,7 +518,8 @@ class BaseInterface(object):
     def _find_program_path(self, program):
         """Determines the full path for the given program.
 
-        Searches for a given program name on the PATH.
+        Searches for a given program name on the PATH, the result being
+        shared with the other interfaces (see toolcache.ToolCache).
 
         Keyword arguments:
         program -- The name of the program to search for
@@ -310,7 +528,7 @@ class BaseInterface(object):
         The full path of the program or None
 
         """
-        path = find_path(program)
+        path = toolcache.TOOLS.find(program)
         if not path and self.verbose:
             print("WARNING: No path found for %s" % program)
         return path
@@ -469,8 +687,7 @@ class BaseInterface(object):
         """
         self.dhclient_cmd = self._find_program_path("dhclient")
         if self.dhclient_cmd is not None:
-            output = misc.Run(self.dhclient_cmd + " --version",
-                              include_stderr=True)
+            output = toolcache.TOOLS.probe(self.dhclient_cmd, ["--version"])
             if '4.' in output:
                 self.dhclient_needs_verbose = True
             else:
@@ -487,8 +704,6 @@ class BaseInterface(object):
     def CheckWirelessTools(self):
         """Check for the existence of wpa_cli"""
         self.wpa_cli_cmd = self._find_program_path("wpa_cli")
-        if not self.wpa_cli_cmd:
-            print("wpa_cli not found.  Authentication will not be validated.")
 
     def CheckRouteFlushTool(self):
         """Check for a route flush tool."""
@@ -501,6 +716,46 @@ class BaseInterface(object):
         self.kdesu_cmd = self._find_program_path("kdesu")
         self.ktsuss_cmd = self._find_program_path("ktsuss")
 
+    def _netlink(self, operation, *args):
+        """Make a change through rtnetlink instead of running a tool.
+
+        Only done when the route tool is selected automatically.  The
+        tools remain the fallback when the socket can't be opened or
+        the kernel refuses the change.  The connection and disconnection
+        threads share the socket, one operation at a time.
+
+        Keyword arguments:
+        operation -- the name of the netlink.RouteSocket method to call
+        args -- its arguments after the interface index
+
+        Returns:
+        True if the change was made, False if a tool has to make it.
+
+        """
+        if self.flush_tool != misc.AUTO or self._rtnl is False:
+            return False
+        with self._rtnl_lock:
+            try:
+                if self._rtnl is None:
+                    self._rtnl = netlink.RouteSocket()
+                if self._rtnl is False:
+                    return False
+                getattr(self._rtnl, operation)(
+                    socket.if_nametoindex(self.iface), *args)
+            except OSError as e:
+                print('netlink %s on %s failed, falling back to the tools: '
+                      '%s' % (operation, self.iface, e))
+                if self._rtnl is None or e.errno in (errno.EPERM,
+                                                     errno.EACCES):
+                    # It won't get any better, stop trying.
+                    self._rtnl = False
+                return False
+        if self.verbose:
+            print('netlink %s %s %s' % (operation, self.iface,
+                                        ' '.join(str(arg) for arg in args)))
+        return True
+
+    @invalidatecache
     @neediface(False)
     def Up(self):
         """Bring the network interface up.
@@ -509,12 +764,15 @@ class BaseInterface(object):
         True
 
         """
+        if self._netlink('set_link_up', True):
+            return True
         cmd = 'ifconfig ' + self.iface + ' up'
         if self.verbose:
             print(cmd)
         misc.Run(cmd)
         return True
 
+    @invalidatecache
     @neediface(False)
     def Down(self):
         """Take down the network interface.
@@ -523,6 +781,8 @@ class BaseInterface(object):
         True
 
         """
+        if self._netlink('set_link_up', False):
+            return True
         cmd = 'ifconfig ' + self.iface + ' down'
         if self.verbose:
             print(cmd)
@@ -536,8 +796,72 @@ class BaseInterface(object):
         cmd = "ifconfig %s" % self.iface
         if self.verbose:
             print(cmd)
-        return misc.Run(cmd)
+        return misc.Run(cmd, coalesce=True)
+
+    def StartBatch(self):
+        """Start collecting address and route changes.
+
+        Until CommitBatch is called, SetAddress (to reset the address or
+        to set an address and netmask), FlushRoutes, SetDefaultRoute
+        and DelDefaultRoute queue their changes, which CommitBatch then
+        applies with a single ip -batch run.  Changes made through
+        rtnetlink aren't queued.  Without ip, or when route is the
+        configured route tool, changes are still applied one by one.
 
+        Only the changes of the calling thread are queued, and another
+        thread starting a batch waits for CommitBatch, so CommitBatch
+        must always be called, from the same thread.  Batches don't
+        nest.
+
+        """
+        self._batch_lock.acquire()
+        self._batch_owner = threading.current_thread()
+        if self.ip_cmd and self.flush_tool in [misc.AUTO, misc.IP]:
+            self._batch = []
+
+    def _queue(self, operation):
+        """Queue an ip operation, return False if not batching."""
+        if (self._batch is None or
+                self._batch_owner is not threading.current_thread()):
+            return False
+        if self.verbose:
+            print('queued: ip ' + operation)
+        self._batch.append(operation)
+        return True
+
+    @invalidatecache
+    def CommitBatch(self):
+        """Apply the changes collected since StartBatch.
+
+        Operations are run in order, a failing one doesn't prevent the
+        following ones from running.
+
+        Returns:
+        A list of (operation, error message) tuples, one for each
+        operation which failed.
+
+        """
+        if self._batch_owner is not threading.current_thread():
+            return []
+        batch, self._batch = self._batch, None
+        try:
+            if not batch:
+                return []
+            # Only IPv4 is configured, like ifconfig and route do.
+            cmd = [self.ip_cmd, '-4', '-force', '-batch', '-']
+            if self.verbose:
+                print(cmd)
+            output = misc.Run(cmd, include_stderr=True,
+                              input=''.join(op + '\n' for op in batch))
+            errors = _parse_batch_errors(output, batch)
+            for operation, message in errors:
+                print('ip %s failed: %s' % (operation, message))
+            return errors
+        finally:
+            self._batch_owner = None
+            self._batch_lock.release()
+
+    @invalidatecache
     @neediface("")
     def SetAddress(self, ip=None, netmask=None, broadcast=None):
         """Set the IP addresses of an interface.
@@ -555,6 +879,19 @@ class BaseInterface(object):
                 print('WARNING: Invalid IP address found, aborting!')
                 return False
 
+        if ip == '0.0.0.0' and not netmask and not broadcast:
+            if (self._netlink('flush_addresses') or
+                    self._queue('addr flush dev %s' % self.iface)):
+                return
+        elif ip and netmask:
+            prefixlen = _netmask_to_prefixlen(netmask)
+            # "broadcast +" derives it from the netmask, as ifconfig does.
+            if (self._netlink('replace_address', ip, prefixlen, broadcast) or
+                    self._queue('addr replace %s/%d broadcast %s dev %s' %
+                                (ip, prefixlen, broadcast or '+',
+                                 self.iface))):
+                return
+
         cmd = ''.join(['ifconfig ', self.iface, ' '])
         if ip:
             cmd = ''.join([cmd, ip, ' '])
@@ -683,6 +1020,7 @@ class BaseInterface(object):
             print('DHCP connection failed')
             return 'dhcp_failed'
 
+    @invalidatecache
     @neediface(False)
     def StartDHCP(self, hostname, staticdns):
         """Start the DHCP client to obtain an IP address.
@@ -714,6 +1052,7 @@ class BaseInterface(object):
         self.dhcp_object.wait()
         return ret
 
+    @invalidatecache
     @neediface(False)
     def ReleaseDHCP(self):
         """Release the DHCP lease for this interface."""
@@ -722,9 +1061,32 @@ class BaseInterface(object):
             print(cmd)
         misc.Run(cmd)
 
+    def _has_routes(self, default=False):
+        """Check whether the interface has IPv4 routes.
+
+        Keyword arguments:
+        default -- only look for default routes
+
+        Returns:
+        False if the routing table shows there is nothing to remove,
+        True otherwise (also when it can't be read).
+
+        """
+        try:
+            if default:
+                return bool(routes.GetDefaultRoutes(self.iface))
+            return bool(routes.GetRoutes(self.iface, socket.AF_INET))
+        except IOError:
+            return True
+
     @neediface(False)
     def DelDefaultRoute(self):
         """Delete only the default route for a device."""
+        if not self._has_routes(default=True):
+            return
+        if (self._netlink('del_default_route') or
+                self._queue('route del default dev %s' % self.iface)):
+            return
         if self.ip_cmd and self.flush_tool in [misc.AUTO, misc.IP]:
             cmd = '%s route del default dev %s' % (self.ip_cmd, self.iface)
         elif self.route_cmd and self.flush_tool in [misc.AUTO, misc.ROUTE]:
@@ -799,6 +1161,13 @@ class BaseInterface(object):
     @neediface(False)
     def FlushRoutes(self):
         """Flush network routes for this device."""
+        if not self._has_routes():
+            if self.verbose:
+                print('No routes to flush on %s' % self.iface)
+            return
+        if (self._netlink('flush_routes') or
+                self._queue('route flush dev %s' % self.iface)):
+            return
         if self.ip_cmd and self.flush_tool in [misc.AUTO, misc.IP]:
             cmds = ['%s route flush dev %s' % (self.ip_cmd, self.iface)]
         elif self.route_cmd and self.flush_tool in [misc.AUTO, misc.ROUTE]:
@@ -822,6 +1191,10 @@ class BaseInterface(object):
         if not misc.IsValidIP(gw):
             print('WARNING: Invalid gateway found.  Aborting!')
             return False
+        if (self._netlink('replace_default_route', gw) or
+                self._queue('route replace default via %s dev %s' %
+                            (gw, self.iface))):
+            return
         cmd = 'route add default gw %s dev %s' % (gw, self.iface)
         if self.verbose:
             print(cmd)
@@ -831,11 +1204,24 @@ class BaseInterface(object):
     def GetIP(self, ifconfig=""):
         """Get the IP address of the interface.
 
+        The address is looked up in the address table, unless the
+        output of ifconfig is given or the table can't be dumped.
+
+        Keyword arguments:
+        ifconfig -- output of ifconfig to parse the address from
+
         Returns:
         The IP address of the interface in dotted quad form.
 
         """
         if not ifconfig:
+            try:
+                addresses = GetAddresses(self.iface, socket.AF_INET)
+            except OSError as e:
+                if self.verbose:
+                    print("Couldn't dump the addresses: %s" % e)
+            else:
+                return addresses[0]['address'] if addresses else None
             output = self.GetIfconfig()
         else:
             output = ifconfig
@@ -846,6 +1232,26 @@ class BaseInterface(object):
                 return m
         return None
 
+    @neediface([])
+    def GetIPv6Addresses(self):
+        """Get the IPv6 addresses of the interface.
+
+        Returns:
+        A list of addresses in address/prefixlen form, global ones
+        first, or an empty list if there are none or they can't be
+        dumped.
+
+        """
+        try:
+            addresses = GetAddresses(self.iface, socket.AF_INET6)
+        except OSError as e:
+            if self.verbose:
+                print("Couldn't dump the addresses: %s" % e)
+            return []
+        return ['%s/%d' % (address['address'], address['prefixlen'])
+                for address in sorted(addresses,
+                                      key=lambda address: address['scope'])]
+
     @neediface(False)
     def VerifyAPAssociation(self, gateway):
         """Verify assocation with an access point.
@@ -885,13 +1291,27 @@ class BaseInterface(object):
             return self._slow_is_up(ifconfig)
         return bool(int(flags, 16) & 1)
 
+    @invalidatecache
     @neediface(False)
     def StopWPA(self):
-        """Terminates wpa using wpa_cli"""
-        cmd = 'wpa_cli -i %s terminate' % self.iface
+        """Terminates wpa_supplicant using its ctrl interface.
+
+        Waits (briefly) for it to be gone, so another one can be
+        started on the interface right away.
+
+        """
+        if not os.path.exists(os.path.join(wpasupplicant.CTRL_IFACE_DIR,
+                                           self.iface)):
+            # Not running.
+            return
         if self.verbose:
-            print(cmd)
-        misc.Run(cmd)
+            print('wpa_supplicant TERMINATE on %s' % self.iface)
+        try:
+            if not wpasupplicant.Terminate(self.iface):
+                print('wpa_supplicant on %s is still shutting down' %
+                      self.iface)
+        except OSError as e:
+            print("Couldn't terminate wpa_supplicant: %s" % e)
 
     def _slow_is_up(self, ifconfig=None):
         """Determine if an interface is up using ifconfig."""
@@ -988,7 +1408,7 @@ class BaseWiredInterface(BaseInterface):
             time.sleep(6)
         if self.verbose:
             print(cmd)
-        tool_data = misc.Run(cmd, include_stderr=True)
+        tool_data = misc.Run(cmd, include_stderr=True, coalesce=True)
         if misc.RunRegex(re.compile('(Link detected: yes)',
                                     re.I | re.M | re.S), tool_data):
             return True
@@ -1005,7 +1425,7 @@ class BaseWiredInterface(BaseInterface):
         cmd = "%s %s" % (self.miitool_cmd, self.iface)
         if self.verbose:
             print(cmd)
-        tool_data = misc.Run(cmd, include_stderr=True)
+        tool_data = misc.Run(cmd, include_stderr=True, coalesce=True)
         if misc.RunRegex(re.compile('(Invalid argument)', re.I | re.M | re.S),
                          tool_data) is not None:
             print('Wired Interface is down, putting it up')
@@ -1021,6 +1441,7 @@ class BaseWiredInterface(BaseInterface):
         else:
             return False
 
+    @invalidatecache
     def Authenticate(self, network):
         """Authenticate with wpa_supplicant."""
         misc.ParseEncryption(network)
@@ -1045,11 +1466,38 @@ class BaseWirelessInterface(BaseInterface):
         BaseInterface.__init__(self, iface, verbose)
         self.wpa_driver = wpa_driver
         self.scan_iface = None
+        self.persistent_supplicant = False
+        # Whether GetNetworks can limit a scan to some frequencies.
+        self.scans_frequencies = False
 
     def SetWpaDriver(self, driver):
         """Sets the wpa_driver."""
         self.wpa_driver = _sanitize_string(driver)
 
+    def SetPersistentSupplicant(self, value):
+        """If True, keep wpa_supplicant running between connections.
+
+        wpa_supplicant is then only disconnected by StopWPA, and
+        Authenticate hands it the new network over its ctrl interface
+        instead of starting it again.
+
+        """
+        self.persistent_supplicant = bool(value)
+
+    @invalidatecache
+    @neediface(False)
+    def StopWPA(self):
+        """Terminates wpa_supplicant, or disconnects it if persistent."""
+        if not self.persistent_supplicant:
+            return BaseInterface.StopWPA(self)
+        try:
+            with wpasupplicant.WpaCtrl(self.iface) as wpa:
+                wpa.request('DISCONNECT')
+        except OSError:
+            # Not running, Authenticate will start it.
+            pass
+
+    @invalidatecache
     @neediface(False)
     def SetEssid(self, essid):
         """Set the essid of the wireless interface.
@@ -1081,14 +1529,42 @@ class BaseWirelessInterface(BaseInterface):
 
         return radiostatus
 
-    @timedcache(2)
+    @timedcache(IWCONFIG_TTL)
     @neediface(False)
     def GetIwconfig(self):
         """Returns the output of iwconfig for this interface."""
         cmd = "iwconfig " + self.iface
         if self.verbose:
             print(cmd)
-        return misc.Run(cmd)
+        return misc.Run(cmd, coalesce=True)
+
+    def GetIwconfigAsync(self, callback):
+        """Get the output of iwconfig without blocking.
+
+        The output is shared with GetIwconfig through the cache.
+
+        Keyword arguments:
+        callback -- function called with the output of iwconfig (False
+                    if the interface doesn't exist)
+
+        """
+        if not _iface_exists(self.iface):
+            callback(False)
+            return
+        iface = self.iface
+        key = _cache_key((), {})
+        output = cache.CACHE.get(iface, 'GetIwconfig', key, IWCONFIG_TTL)
+        if output is not cache.MISSING:
+            callback(output)
+            return
+
+        def done(output):
+            cache.CACHE.set(iface, 'GetIwconfig', key, output)
+            callback(output)
+        cmd = "iwconfig " + iface
+        if self.verbose:
+            print(cmd)
+        misc.RunAsync(cmd, done)
 
     def _FreqToChannel(self, freq):
         """Translate the specified frequency to a channel.
@@ -1195,6 +1671,7 @@ class BaseWirelessInterface(BaseInterface):
                 ap['encryption'] = False
         return ap
 
+    @invalidatecache
     @neediface(False)
     def SetMode(self, mode):
         """Set the mode of the wireless interface.
@@ -1213,6 +1690,7 @@ class BaseWirelessInterface(BaseInterface):
             print(cmd)
         misc.Run(cmd)
 
+    @invalidatecache
     @neediface(False)
     def SetChannel(self, channel):
         """Set the channel of the wireless interface.
@@ -1230,6 +1708,7 @@ class BaseWirelessInterface(BaseInterface):
             print(cmd)
         misc.Run(cmd)
 
+    @invalidatecache
     @neediface(False)
     def SetKey(self, key):
         """Set the encryption key of the wireless interface.
@@ -1243,6 +1722,7 @@ class BaseWirelessInterface(BaseInterface):
             print(cmd)
         misc.Run(cmd)
 
+    @invalidatecache
     @neediface(False)
     def SetBitrate(self, bitrate, allow_lower=False):
         ''' Set the desired bitrate for the interface.
@@ -1262,6 +1742,7 @@ class BaseWirelessInterface(BaseInterface):
                 cmd = 'iwconfig %s rate %sM fixed' % (self.iface, bitrate)
         misc.Run(cmd)
 
+    @invalidatecache
     @neediface(False)
     def Associate(self, essid, channel=None, bssid=None):
         """Associate with the specified wireless network.
@@ -1286,22 +1767,23 @@ class BaseWirelessInterface(BaseInterface):
             misc.Run(cmd)
 
     def GeneratePSK(self, network):
-        """Generate a PSK using wpa_passphrase.
+        """Generate the PSK of the network passphrase.
+
+        The PSK is derived in process and cached (see wicd.psk), no
+        wpa_passphrase is run.
 
         Keyword arguments:
         network -- dictionary containing network info
 
+        Returns:
+        The PSK, or None if the key isn't a valid passphrase.
+
         """
-        wpa_pass_path = misc.find_path('wpa_passphrase')
-        if not wpa_pass_path:
-            return None
-        key_pattern = re.compile(r'network={.*?\spsk=(.*?)\n}.*',
-                                 re.I | re.M | re.S)
-        cmd = [wpa_pass_path, str(network['essid']), str(network['key'])]
         if self.verbose:
-            print(cmd)
-        return misc.RunRegex(key_pattern, misc.Run(cmd))
+            print('Deriving the PSK of %s' % network['essid'])
+        return psk.CACHE.get(str(network['essid']), str(network['key']))
 
+    @invalidatecache
     @neediface(False)
     def Authenticate(self, network):
         """Authenticate with the specified wireless network.
@@ -1310,9 +1792,12 @@ class BaseWirelessInterface(BaseInterface):
         network -- dictionary containing network info
 
         """
-        misc.ParseEncryption(network)
+        config = misc.ParseEncryption(network)
         if self.wpa_driver == RALINK_DRIVER:
             self._AuthenticateRalinkLegacy(network)
+        elif (self.persistent_supplicant and
+              self._ReconfigureSupplicant(config)):
+            return
         else:
             if self.wpa_driver == NONE_DRIVER:
                 driver = ''
@@ -1326,6 +1811,27 @@ class BaseWirelessInterface(BaseInterface):
                 print(cmd)
             misc.Run(cmd)
 
+    def _ReconfigureSupplicant(self, config):
+        """Hand a network to the running wpa_supplicant.
+
+        Keyword arguments:
+        config -- the configuration written for the network
+
+        Returns:
+        True if wpa_supplicant took the network, False if it has to be
+        started.
+
+        """
+        if self.verbose:
+            print('Reconfiguring wpa_supplicant on %s' % self.iface)
+        try:
+            return wpasupplicant.ConfigureNetwork(self.iface, config)
+        except OSError as e:
+            print("Couldn't reconfigure wpa_supplicant, restarting it: %s" %
+                  e)
+            BaseInterface.StopWPA(self)
+            return False
+
     def _AuthenticateRalinkLegacy(self, network):
         """Authenticate with the specified wireless network.
 
@@ -1368,9 +1874,14 @@ class BaseWirelessInterface(BaseInterface):
                     misc.Run(cmd)
 
     @neediface([])
-    def GetNetworks(self, essid=None):
+    def GetNetworks(self, essid=None, freqs=None):
         """Get a list of available wireless networks.
 
+        Keyword arguments:
+        essid -- hidden essid to probe for, if any
+        freqs -- frequencies (MHz) to limit the scan to, if possible;
+                 iwlist always scans all channels
+
         Returns:
         A list containing available wireless networks.
 
@@ -1389,12 +1900,7 @@ class BaseWirelessInterface(BaseInterface):
 
         if self.verbose:
             print(cmd)
-        results = misc.Run(cmd)
-        # Split the networks apart, using Cell as our split point
-        # this way we can look at only one network at a time.
-        # The spaces around '   Cell ' are to minimize the chance that someone
-        # has an essid named Cell...
-        networks = results.split('   Cell ')
+        results = misc.Run(cmd, coalesce=True)
 
         # Get available network info from iwpriv get_site_survey
         # if we're using a ralink card (needed to get encryption info)
@@ -1403,113 +1909,182 @@ class BaseWirelessInterface(BaseInterface):
         else:
             ralink_info = None
 
-        # An array for the access points
-        access_points = []
         access_points = {}
-        for cell in networks:
-            # Only use sections where there is an ESSID.
-            if 'ESSID:' in cell:
-                # Add this network to the list of networks
-                entry = self._ParseAccessPoint(cell, ralink_info)
-                if entry is not None:
-                    # Normally we only get duplicate bssids with hidden
-                    # networks.  If we hit this, we only want the entry
-                    # with the real essid to be in the network list.
-                    if (entry['bssid'] not in access_points
-                            or not entry['hidden']):
-                        access_points[entry['bssid']] = entry
+        for entry in self._ParseScanResults(results, ralink_info):
+            # Normally we only get duplicate bssids with hidden
+            # networks.  If we hit this, we only want the entry
+            # with the real essid to be in the network list.
+            if entry['bssid'] not in access_points or not entry['hidden']:
+                access_points[entry['bssid']] = entry
 
         return list(access_points.values())
 
-    def _ParseAccessPoint(self, cell, ralink_info):
-        """Parse a single cell from the output of iwlist.
+    def _ParseScanResults(self, results, ralink_info):
+        """Parse the output of iwlist scan in a single pass.
+
+        The output is walked once, line by line, and each recognised
+        field is stored in the record of the cell it belongs to.  When a
+        field shows up more than once in a cell the last value wins, just
+        like with greedy regular expressions run on the whole cell.
 
         Keyword arguments:
-        cell -- string containing the cell information
-        ralink_info -- string contating network information needed
+        results -- string containing the output of iwlist scan
+        ralink_info -- dict containing network information needed
                        for ralink cards.
 
         Returns:
-        A dictionary containing the cell networks properties.
+        A list of dictionaries containing the networks properties, in the
+        order they appear in the output.
 
         """
-        ap = {}
-        ap['essid'] = misc.RunRegex(essid_pattern, cell)
-        try:
-            ap['essid'] = misc.to_unicode(ap['essid'])
-        except (UnicodeDecodeError, UnicodeEncodeError):
-            print('Unicode problem with current network essid, ignoring!!')
-            return None
+        access_points = []
+        lines = results.split('\n')
+        cell = _new_scan_cell(0)
+        for index, line in enumerate(lines):
+            # The spaces around '   Cell ' are to minimize the chance that
+            # someone has an essid named Cell...
+            pos = line.find('   Cell ')
+            if pos != -1:
+                access_points.append(self._BuildAccessPoint(cell, ralink_info,
+                                                            lines, index))
+                cell = _new_scan_cell(index)
+                line = line[pos + 8:]
+
+            if 'ESSID:' in line:
+                cell['has_essid'] = True
+                value = line[line.rfind('ESSID:') + 6:]
+                if value.startswith('"'):
+                    value = value[1:]
+                end = value.find('"')
+                if end != -1:
+                    cell['essid'] = value[:end]
+            if 'Address: ' in line:
+                cell['bssid'] = line[line.rfind('Address: ') + 9:]
+            if 'Channel' in line:
+                channel = misc.RunRegex(channel_pattern, line)
+                if channel is not None:
+                    cell['channel'] = channel
+            if 'Frequency:' in line:
+                cell['freq'] = line[line.rfind('Frequency:') + 10:]
+            if 'Mode:' in line:
+                mode = misc.RunRegex(scan_mode_pattern, line)
+                if mode is not None:
+                    cell['mode'] = mode
+            if 'Encryption key:' in line:
+                cell['wep'] = line[line.rfind('Encryption key:') + 15:]
+            if 'WPA' in line:
+                if 'WPA Version 1' in line:
+                    cell['wpa1'] = True
+                if 'WPA2' in line:
+                    cell['wpa2'] = True
+            if 'wpa_ie' in line:
+                cell['wpa_ie'] = True
+            if 'Quality' in line:
+                match = strength_pattern.search(line)
+                if match:
+                    cell['quality'] = match.groups()
+            if 'Signal level' in line:
+                match = altstrength_pattern.search(line)
+                if match:
+                    cell['altquality'] = match.groups()
+                dbm = misc.RunRegex(signaldbm_pattern, line)
+                if dbm is not None:
+                    cell['dbm'] = dbm
+            # Only the rates listed after the last 'Bit Rates' count, or
+            # the whole cell if there is no such line.
+            if 'Bit Rates' in line:
+                line = line.split('Bit Rates')[-1]
+                cell['bitrates'] = []
+            if '/s' in line:
+                cell['bitrates'].extend(bitrates_pattern.findall(line))
+
+        access_points.append(self._BuildAccessPoint(cell, ralink_info,
+                                                    lines, len(lines)))
+        return [ap for ap in access_points if ap is not None]
+
+    def _BuildAccessPoint(self, cell, ralink_info, lines, end):
+        """Turn the fields collected for a cell into an access point.
+
+        Keyword arguments:
+        cell -- dict containing the raw fields found in the cell
+        ralink_info -- dict containing network information needed
+                       for ralink cards.
+        lines -- list containing all lines of the scan output
+        end -- index of the line following the cell
+
+        Returns:
+        A dictionary containing the cell networks properties, or None if
+        the cell doesn't describe a usable network.
 
-        # We (well, DBus) don't support ESSIDs with null bytes in it.
-        # From some bugreports, it seems like some APs transmit the "hidden"
-        # essid as NULL bytes. Let's strip them off.
-        ap['essid'] = ap['essid'].replace('\x00', '')
+        """
+        # Only use sections where there is an ESSID.
+        if not cell['has_essid']:
+            return None
 
-        if ap['essid'] in ['Hidden', '<hidden>', "", None]:
+        ap = {}
+        essid = cell['essid']
+        if essid is not None:
+            try:
+                essid = misc.to_unicode(essid)
+            except (UnicodeDecodeError, UnicodeEncodeError):
+                print('Unicode problem with current network essid, '
+                      'ignoring!!')
+                return None
+            # We (well, DBus) don't support ESSIDs with null bytes in it.
+            essid = essid.replace('\x00', '')
+        if essid in ['Hidden', '<hidden>', "", None]:
             print('hidden')
             ap['hidden'] = True
             ap['essid'] = "<hidden>"
         else:
             ap['hidden'] = False
+            ap['essid'] = essid
 
-        # Channel - For cards that don't have a channel number,
-        # convert the frequency.
-        ap['channel'] = misc.RunRegex(channel_pattern, cell)
+        ap['channel'] = cell['channel']
         if ap['channel'] is None:
-            freq = misc.RunRegex(freq_pattern, cell)
-            ap['channel'] = self._FreqToChannel(freq)
+            ap['channel'] = self._FreqToChannel(cell['freq'])
 
-        # Bit Rate
-        bitrates = cell.split('Bit Rates')[-1].replace('\n', '; ')
-        m = re.findall(bitrates_pattern, bitrates)
-        if m:
+        if cell['bitrates']:
             # numeric sort
-            ap['bitrates'] = sorted(m,
+            ap['bitrates'] = sorted(cell['bitrates'],
                                     key=functools.
                                     cmp_to_key(lambda x, y:
                                                int(float(x) - float(y))))
         else:
             ap['bitrates'] = None
 
-        # BSSID
-        ap['bssid'] = misc.RunRegex(ap_mac_pattern, cell)
+        ap['bssid'] = cell['bssid']
 
-        # Mode
-        ap['mode'] = misc.RunRegex(mode_pattern, cell)
+        ap['mode'] = cell['mode']
         if ap['mode'] is None:
             print('Invalid network mode string, ignoring!')
             return None
 
-        # Break off here if we're using a ralink card
         if self.wpa_driver == RALINK_DRIVER:
-            ap = self._ParseRalinkAccessPoint(ap, ralink_info, cell)
-        elif misc.RunRegex(wep_pattern, cell) == 'on':
-            # Encryption - Default to WEP
+            cell_text = '\n'.join(lines[cell['start']:end]) + '\n'
+            ap = self._ParseRalinkAccessPoint(ap, ralink_info, cell_text)
+        elif cell['wep'] == 'on':
             ap['encryption'] = True
             ap['encryption_method'] = 'WEP'
-
-            if misc.RunRegex(wpa1_pattern, cell) == 'WPA Version 1':
+            if cell['wpa1'] or cell['wpa_ie']:
                 ap['encryption_method'] = 'WPA'
-
-            if misc.RunRegex(altwpa_pattern, cell) == 'wpa_ie':
-                ap['encryption_method'] = 'WPA'
-
-            if misc.RunRegex(wpa2_pattern, cell) == 'WPA2':
+            if cell['wpa2']:
                 ap['encryption_method'] = 'WPA2'
         else:
             ap['encryption'] = False
 
-        # Link Quality
-        # Set strength to -1 if the quality is not found
-        ap['quality'] = self._get_link_quality(cell)
-        if ap['quality'] is None:
-            ap['quality'] = -1
+        # Link quality, or 101 if it can't be found at all.
+        strength, max_strength = cell['quality'] or cell['altquality'] or \
+            (None, None)
+        if strength is None:
+            ap['quality'] = 101
+        elif max_strength:
+            ap['quality'] = 100 * int(strength) // int(max_strength)
+        else:
+            ap['quality'] = int(strength)
 
-        # Signal Strength (only used if user doesn't want link
-        # quality displayed or it isn't found)
-        if misc.RunRegex(signaldbm_pattern, cell):
-            ap['strength'] = misc.RunRegex(signaldbm_pattern, cell)
+        if cell['dbm']:
+            ap['strength'] = cell['dbm']
         # This is already set for ralink
         elif self.wpa_driver != RALINK_DRIVER:
             ap['strength'] = -1
@@ -1535,53 +2110,10 @@ class BaseWirelessInterface(BaseInterface):
 
         """
         # Right now there's no way to do this for these drivers
-        if self.wpa_driver == RALINK_DRIVER or not self.wpa_cli_cmd:
+        if self.wpa_driver == RALINK_DRIVER:
             return True
-
-        MAX_TIME = 35
-        MAX_DISCONNECTED_TIME = 3
-        disconnected_time = 0
-        forced_rescan = False
-        while (time.time() - auth_time) < MAX_TIME:
-            cmd = '%s -i %s status' % (self.wpa_cli_cmd, self.iface)
-            output = misc.Run(cmd)
-            result = misc.RunRegex(auth_pattern, output)
-            if self.verbose:
-                print('WPA_CLI RESULT IS', result)
-
-            if not result:
-                return False
-            if result == "COMPLETED":
-                return True
-            elif result == "DISCONNECTED" and not forced_rescan:
-                disconnected_time += 1
-                if disconnected_time > MAX_DISCONNECTED_TIME:
-                    disconnected_time = 0
-                    # Force a rescan to get wpa_supplicant moving again.
-                    forced_rescan = True
-                    self._ForceSupplicantScan()
-                    MAX_TIME += 5
-            else:
-                disconnected_time = 0
-            time.sleep(1)
-
-        print('wpa_supplicant authentication may have failed.')
-        return False
-
-    def _ForceSupplicantScan(self):
-        """Force wpa_supplicant to rescan available networks.
-
-        This function forces wpa_supplicant to rescan.
-        This works around authentication validation sometimes failing for
-        wpa_supplicant because it remains in a DISCONNECTED state for
-        quite a while, after which a rescan is required, and then
-        attempting to authenticate.  This whole process takes a long
-        time, so we manually speed it up if we see it happening.
-
-        """
-        print('wpa_supplicant rescan forced...')
-        cmd = 'wpa_cli -i' + self.iface + ' scan'
-        misc.Run(cmd)
+        return wpasupplicant.ValidateAuthentication(self.iface, auth_time,
+                                                    verbose=self.verbose)
 
     @neediface("")
     def GetBSSID(self, iwconfig=None):
@@ -1625,7 +2157,7 @@ class BaseWirelessInterface(BaseInterface):
             cmd = 'iwlist ' + self.iface + ' auth'
             if self.verbose:
                 print(cmd)
-            output = misc.Run(cmd)
+            output = misc.Run(cmd, coalesce=True)
         else:
             output = iwlistauth
 
@@ -1640,9 +2172,26 @@ class BaseWirelessInterface(BaseInterface):
         cmd = 'iwlist ' + self.iface + ' rate'
         if self.verbose:
             print(cmd)
-        rates = misc.Run(cmd)
+        return self._parse_bitrates(misc.Run(cmd, coalesce=True))
+
+    def GetAvailableBitratesAsync(self, callback):
+        """Get the available bitrates without blocking.
+
+        Keyword arguments:
+        callback -- function called with the bitrates
+
+        """
+        if not _iface_exists(self.iface):
+            callback('')
+            return
+        cmd = 'iwlist ' + self.iface + ' rate'
+        if self.verbose:
+            print(cmd)
+        misc.RunAsync(cmd, lambda rates:
+                      callback(self._parse_bitrates(rates)))
 
-        # process the output
+    def _parse_bitrates(self, rates):
+        """Parse the bitrates out of iwlist rate output."""
         rates = rates.split('\n')
         rates = [x.strip().split(' ')[0] for x in rates]
         rates = [x for x in rates if x and x[0].isdigit()]
@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""wpa_supplicant control interface client.
+
+wpa_supplicant listens for commands on a unix datagram socket per
+interface (the ctrl_interface set in the templates wicd generates the
+configuration from).  This module speaks that protocol directly, so
+wicd doesn't need to spawn wpa_cli or depend on python-wpactrl.
+
+class WpaCtrlError() -- A request to wpa_supplicant failed.
+class WpaCtrl() -- A connection to the control socket of wpa_supplicant.
+ValidateAuthentication() -- Wait for wpa_supplicant to authenticate.
+ConfigureNetwork() -- Make a running wpa_supplicant use another network.
+
+"""
+
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import collections
+import errno
+import itertools
+import os
+import select
+import socket
+import tempfile
+import time
+
+from wicd.ieee80211 import MakeAccessPoint
+
+CTRL_IFACE_DIR = '/var/run/wpa_supplicant'
+
+# Big enough for the largest reply wpa_supplicant sends.
+REPLY_SIZE = 8192
+
+# Seconds to wait for a scan requested from wpa_supplicant to finish.
+SCAN_TIMEOUT = 10
+
+# Seconds to wait for wpa_supplicant to authenticate.
+AUTH_TIMEOUT = 35
+# Seconds wpa_supplicant may stay disconnected before forcing a rescan.
+MAX_DISCONNECTED_TIME = 3
+# Seconds to wait for wpa_supplicant to exit once told to.
+TERMINATE_TIMEOUT = 3
+
+_counter = itertools.count()
+
+
+class WpaCtrlError(OSError):
+    """A request to wpa_supplicant failed."""
+
+
+class WpaCtrl(object):
+    """A connection to the control socket of wpa_supplicant."""
+    def __init__(self, iface, ctrl_dir=CTRL_IFACE_DIR, timeout=10):
+        """Connect to the control socket of iface.
+
+        Keyword arguments:
+        iface -- the interface wpa_supplicant runs on
+        ctrl_dir -- the ctrl_interface directory of wpa_supplicant
+        timeout -- seconds to wait for a reply
+
+        """
+        self.path = os.path.join(ctrl_dir, iface)
+        self.timeout = timeout
+        # Events received while waiting for a reply.
+        self.events = collections.deque()
+        # wpa_supplicant replies to the address we send from, so bind
+        # to a path of our own first, like wpa_cli does.
+        self.local_path = os.path.join(
+            tempfile.gettempdir(),
+            'wicd_ctrl_%d-%d' % (os.getpid(), next(_counter)))
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind(self.local_path)
+            self.sock.connect(self.path)
+        except OSError as e:
+            self.close()
+            raise WpaCtrlError(e.errno, "Couldn't open ctrl_interface %s: %s"
+                               % (self.path, e.strerror))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the connection."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.local_path)
+            except OSError:
+                pass
+
+    def request(self, command):
+        """Send a command and return the reply.
+
+        Unsolicited event messages (which start with '<') that arrive in
+        between are kept for next_event.
+
+        Keyword arguments:
+        command -- the command to send, e.g. 'STATUS'
+
+        Returns:
+        The reply of wpa_supplicant as a string.
+
+        """
+        self.sock.send(command.encode('utf-8'))
+        while True:
+            ready = select.select([self.sock], [], [], self.timeout)[0]
+            if not ready:
+                raise WpaCtrlError(errno.ETIMEDOUT, 'wpa_supplicant did not '
+                                   'reply to %s' % command.split()[0])
+            reply = self.sock.recv(REPLY_SIZE).decode('utf-8', 'replace')
+            if not reply.startswith('<'):
+                return reply
+            self.events.append(reply)
+
+    def attach(self):
+        """Ask wpa_supplicant to send us event messages."""
+        if self.request('ATTACH') != 'OK\n':
+            raise WpaCtrlError(errno.EIO, 'wpa_supplicant refused ATTACH')
+
+    def next_event(self, timeout):
+        """Wait for the next event message, once attached.
+
+        Keyword arguments:
+        timeout -- seconds to wait for
+
+        Returns:
+        A (name, text) tuple, e.g. ('CTRL-EVENT-CONNECTED', '- Connection
+        to 00:1a:2b:3c:4d:5e completed [id=0 id_str=]'), or None on
+        timeout.
+
+        """
+        deadline = time.monotonic() + timeout
+        while not self.events:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if not select.select([self.sock], [], [], remaining)[0]:
+                return None
+            message = self.sock.recv(REPLY_SIZE).decode('utf-8', 'replace')
+            # Anything else is a late reply to a request which timed out.
+            if message.startswith('<'):
+                self.events.append(message)
+        # Events look like "<3>CTRL-EVENT-SCAN-RESULTS ".
+        name, _, text = self.events.popleft().partition('>')[2].partition(' ')
+        return name.strip(), text.strip()
+
+    def wait_event(self, events, timeout):
+        """Wait for one of the given events.
+
+        Keyword arguments:
+        events -- list of event names, e.g. ['CTRL-EVENT-SCAN-RESULTS']
+        timeout -- seconds to wait for
+
+        Returns:
+        The name of the event received, or None on timeout.
+
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            event = self.next_event(deadline - time.monotonic())
+            if event is None:
+                return None
+            if event[0] in events:
+                return event[0]
+
+    def bss_table(self):
+        """Return the BSS table of wpa_supplicant.
+
+        Returns:
+        A list of dicts, one per BSS, mapping the fields of the BSS
+        command reply (bssid, freq, level, ie, age, ...) to their
+        (string) values.
+
+        """
+        table = []
+        reply = self.request('BSS FIRST')
+        while reply.strip() and not reply.startswith('FAIL'):
+            bss = ParseKeyValues(reply)
+            if 'id' not in bss:
+                break
+            table.append(bss)
+            reply = self.request('BSS NEXT-%s' % bss['id'])
+        return table
+
+
+def ParseKeyValues(reply):
+    """Parse a key=value per line reply into a dict."""
+    values = {}
+    for line in reply.splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            values[key] = value
+    return values
+
+
+def BSSToAccessPoint(bss):
+    """Build an access point dict out of a BSS table entry.
+
+    Keyword arguments:
+    bss -- dict as returned by WpaCtrl.bss_table
+
+    Returns:
+    A dictionary containing the network properties, like GetNetworks
+    returns them.
+
+    """
+    try:
+        freq = int(bss.get('freq', 0))
+        capability = int(bss.get('capabilities', '0'), 16)
+        level = int(bss.get('level', 0))
+    except ValueError:
+        freq, capability, level = 0, 0, 0
+    try:
+        ies = bytes.fromhex(bss.get('ie', ''))
+    except ValueError:
+        ies = b''
+    # Drivers reporting a positive level don't report it in dBm.
+    if level < 0:
+        return MakeAccessPoint(bss['bssid'], freq, capability, ies, dbm=level)
+    return MakeAccessPoint(bss['bssid'], freq, capability, ies,
+                           quality=min(level, 100) if level else None)
+
+
+def _fresh_networks(table, max_age, freqs=None):
+    """Return the networks of a BSS table seen during the last max_age s."""
+    networks = []
+    for bss in table:
+        if 'bssid' not in bss or not bss.get('age', '').isdigit():
+            continue
+        if int(bss['age']) > max_age:
+            continue
+        if freqs and bss.get('freq', '').isdigit() and \
+           int(bss['freq']) not in freqs:
+            continue
+        networks.append(BSSToAccessPoint(bss))
+    return networks
+
+
+def GetBSSNetworks(iface, max_age, ctrl_dir=CTRL_IFACE_DIR):
+    """Return the networks wpa_supplicant saw during its last scans.
+
+    Keyword arguments:
+    iface -- the interface wpa_supplicant runs on
+    max_age -- how old (in seconds) the newest BSS entry may be
+    ctrl_dir -- the ctrl_interface directory of wpa_supplicant
+
+    Returns:
+    A list of access point dicts for the networks seen during the
+    last max_age seconds, or None if wpa_supplicant isn't running or
+    hasn't seen anything that recently, in which case a scan is due.
+
+    """
+    if not os.path.exists(os.path.join(ctrl_dir, iface)):
+        return None
+    try:
+        with WpaCtrl(iface, ctrl_dir) as wpa:
+            table = wpa.bss_table()
+    except OSError as e:
+        print('wpa_supplicant BSS table unavailable: %s' % e)
+        return None
+    return _fresh_networks(table, max_age) or None
+
+
+def ScanFrequencies(iface, freqs, timeout=SCAN_TIMEOUT,
+                    ctrl_dir=CTRL_IFACE_DIR):
+    """Have wpa_supplicant scan only the given frequencies.
+
+    Keyword arguments:
+    iface -- the interface wpa_supplicant runs on
+    freqs -- list of frequencies (MHz) to scan
+    timeout -- seconds to wait for the scan to finish
+    ctrl_dir -- the ctrl_interface directory of wpa_supplicant
+
+    Returns:
+    A list of access point dicts for the networks found on those
+    frequencies, or None if wpa_supplicant isn't running or couldn't
+    do the scan.
+
+    """
+    if not os.path.exists(os.path.join(ctrl_dir, iface)):
+        return None
+    start = time.monotonic()
+    try:
+        with WpaCtrl(iface, ctrl_dir) as wpa:
+            # Attach first, so that the end of the scan can't slip by.
+            wpa.attach()
+            command = 'SCAN freq=' + ','.join(str(freq) for freq in freqs)
+            reply = wpa.request(command)
+            if reply != 'OK\n':
+                print('wpa_supplicant refused %s: %s' %
+                      (command, reply.strip()))
+                return None
+            event = wpa.wait_event(['CTRL-EVENT-SCAN-RESULTS',
+                                    'CTRL-EVENT-SCAN-FAILED'], timeout)
+            if event != 'CTRL-EVENT-SCAN-RESULTS':
+                print('wpa_supplicant scan failed or timed out')
+                return None
+            table = wpa.bss_table()
+    except OSError as e:
+        print('wpa_supplicant scan failed: %s' % e)
+        return None
+    # Only what this scan saw; age is in whole seconds, round up.
+    return _fresh_networks(table, int(time.monotonic() - start) + 1, freqs)
+
+
+def ParseConfig(config):
+    """Split a wpa_supplicant configuration into its parts.
+
+    Keyword arguments:
+    config -- the configuration, as written by misc.ParseEncryption
+
+    Returns:
+    A (settings, network) tuple of lists of (name, value) pairs, for
+    the global settings and for the first network block.  Values are
+    kept as written, quotes included.
+
+    """
+    settings = []
+    network = []
+    current = settings
+    for line in config.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.replace(' ', '') == 'network={':
+            current = network
+        elif line == '}':
+            if network:
+                break
+            current = settings
+        else:
+            name, sep, value = line.partition('=')
+            if sep:
+                current.append((name.strip(), value.strip()))
+    return settings, network
+
+
+def _check(wpa, command):
+    """Send a command which has to be answered with OK."""
+    reply = wpa.request(command)
+    if reply.strip() != 'OK':
+        raise WpaCtrlError(errno.EINVAL, 'wpa_supplicant refused %s: %s' %
+                           (command.split()[0], reply.strip()))
+
+
+def ConfigureNetwork(iface, config, ctrl_dir=CTRL_IFACE_DIR):
+    """Make a running wpa_supplicant use another network.
+
+    The networks wpa_supplicant knows are replaced by the one of config,
+    which is then selected, so the process and the driver state survive
+    from one connection to the next.
+
+    Keyword arguments:
+    iface -- the interface wpa_supplicant runs on
+    config -- the configuration, as written by misc.ParseEncryption
+    ctrl_dir -- the ctrl_interface directory of wpa_supplicant
+
+    Returns:
+    True if wpa_supplicant was reconfigured, False if it isn't running.
+
+    Raises WpaCtrlError if wpa_supplicant refused the network.
+
+    """
+    if not os.path.exists(os.path.join(ctrl_dir, iface)):
+        return False
+    settings, network = ParseConfig(config)
+    with WpaCtrl(iface, ctrl_dir) as wpa:
+        for name, value in settings:
+            if name == 'ap_scan':
+                _check(wpa, 'AP_SCAN %s' % value)
+            elif name != 'ctrl_interface':
+                # Not all of them can be changed at run time.
+                reply = wpa.request('SET %s %s' % (name, value))
+                if reply.strip() != 'OK':
+                    print('wpa_supplicant ignored the %s setting' % name)
+        _check(wpa, 'REMOVE_NETWORK all')
+        network_id = wpa.request('ADD_NETWORK').strip()
+        if not network_id.isdigit():
+            raise WpaCtrlError(errno.EINVAL, 'wpa_supplicant refused '
+                               'ADD_NETWORK: %s' % network_id)
+        for name, value in network:
+            _check(wpa, 'SET_NETWORK %s %s %s' % (network_id, name, value))
+        _check(wpa, 'SELECT_NETWORK %s' % network_id)
+    return True
+
+
+def Terminate(iface, timeout=TERMINATE_TIMEOUT, ctrl_dir=CTRL_IFACE_DIR):
+    """Make wpa_supplicant exit and wait for its control socket to go.
+
+    A wpa_supplicant started while the old one still holds the socket
+    fails with "ctrl_iface exists and seems to be in use".
+
+    Keyword arguments:
+    iface -- the interface wpa_supplicant runs on
+    timeout -- seconds to wait for the socket to disappear
+    ctrl_dir -- the ctrl_interface directory of wpa_supplicant
+
+    Returns:
+    True if wpa_supplicant isn't running any more, False if its socket
+    was still there after timeout seconds.
+
+    Raises WpaCtrlError if the request couldn't be sent.
+
+    """
+    path = os.path.join(ctrl_dir, iface)
+    if not os.path.exists(path):
+        return True
+    with WpaCtrl(iface, ctrl_dir) as wpa:
+        wpa.request('TERMINATE')
+    deadline = time.time() + timeout
+    while os.path.exists(path):
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+def _connect(iface, ctrl_dir, deadline):
+    """Connect to wpa_supplicant, waiting until deadline for its socket."""
+    while True:
+        try:
+            return WpaCtrl(iface, ctrl_dir)
+        except WpaCtrlError:
+            # It may have been started just now.
+            if time.time() + 0.5 >= deadline:
+                raise
+            time.sleep(0.5)
+
+
+def ValidateAuthentication(iface, auth_time, max_time=AUTH_TIMEOUT,
+                           ctrl_dir=CTRL_IFACE_DIR, verbose=False):
+    """Wait for wpa_supplicant to authenticate.
+
+    Events are subscribed to, so that the connection or the network
+    being disabled (after a wrong key, for instance) is noticed as soon
+    as wpa_supplicant reports it.  The state is only asked for after a
+    second without such events, to get wpa_supplicant moving again with
+    a rescan if it stays disconnected.
+
+    Keyword arguments:
+    iface -- the interface wpa_supplicant runs on
+    auth_time -- the time at which authentication began
+    max_time -- seconds authentication may take
+    ctrl_dir -- the ctrl_interface directory of wpa_supplicant
+    verbose -- whether to print the states wpa_supplicant goes through
+
+    Returns:
+    True if wpa_supplicant authenticated successfully, False if it
+    failed, didn't finish in time or couldn't be reached.
+
+    """
+    deadline = auth_time + max_time
+    disconnected_time = 0
+    forced_rescan = False
+    try:
+        with _connect(iface, ctrl_dir, deadline) as wpa:
+            wpa.attach()
+            while time.time() < deadline:
+                state = ParseKeyValues(wpa.request('STATUS')).get('wpa_state')
+                if verbose:
+                    print('wpa_supplicant state is %s' % state)
+                if not state:
+                    return False
+                if state == 'COMPLETED':
+                    return True
+                if state == 'DISCONNECTED' and not forced_rescan:
+                    disconnected_time += 1
+                    if disconnected_time > MAX_DISCONNECTED_TIME:
+                        print('wpa_supplicant rescan forced...')
+                        forced_rescan = True
+                        wpa.request('SCAN')
+                        deadline += 5
+                else:
+                    disconnected_time = 0
+                poll_end = min(time.time() + 1, deadline)
+                while True:
+                    event = wpa.next_event(poll_end - time.time())
+                    if event is None:
+                        break
+                    name, text = event
+                    if verbose:
+                        print('wpa_supplicant event %s %s' % (name, text))
+                    if name == 'CTRL-EVENT-CONNECTED':
+                        return True
+                    if name == 'CTRL-EVENT-SSID-TEMP-DISABLED':
+                        print('wpa_supplicant disabled the network: %s' %
+                              text)
+                        return False
+    except OSError as e:
+        print("Couldn't validate the authentication: %s" % e)
+        return False
+    print('wpa_supplicant authentication may have failed.')
+    return False